@@ -2,8 +2,10 @@ from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from typing import List
 from sqlmodel import select
 
-from ...core.database import get_session, Session as DBSession, engine
+from ...core.database import get_session, Session as DBSession
 from ...models.models import Campaign
+from ...services import jobs
+from ...services.llm import usage
 from ...services.llm.generators import generate_campaign_summary_pipeline
 
 router = APIRouter(prefix="/campaigns", tags=["campaigns"])
@@ -35,12 +37,20 @@ def delete_campaign(campaign_id: int, db: DBSession = Depends(get_session)):
     db.commit()
     return {"ok": True}
 
+@router.get("/{campaign_id}/usage")
+def get_campaign_usage(campaign_id: int, db: DBSession = Depends(get_session)):
+    """Gemini tokens and seconds spent on the campaign and its sessions, per operation, session and model."""
+    campaign = db.get(Campaign, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return usage.summarize(db, ["operation", "session_id", "model"], campaign_id=campaign_id)
+
 @router.post("/{campaign_id}/generate_summary")
 def generate_campaign_summary(campaign_id: int, background_tasks: BackgroundTasks, db: DBSession = Depends(get_session)):
     campaign = db.get(Campaign, campaign_id)
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
-    
-    background_tasks.add_task(generate_campaign_summary_pipeline, campaign_id, engine)
-    return {"message": "Campaign summary generation started"}
+
+    job = jobs.dispatch(jobs.CAMPAIGN_SUMMARY, campaign_id, db, background_tasks, generate_campaign_summary_pipeline)
+    return {"message": "Campaign summary generation started", "job_id": job.id if job else None}
 
@@ -2,19 +2,27 @@
 Chat router for the local D&D librarian agent powered by Ollama.
 Provides endpoints for chatting with the campaign librarian.
 """
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import asyncio
+import json
+from datetime import datetime
+from typing import List, Literal, Optional, Dict, Tuple
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from sqlmodel import Session
-
-from ...core.database import get_session
-from ...services.llm.ollama_client import (
-    chat_with_librarian,
-    stream_librarian_response,
-    check_ollama_status
-)
+from pydantic import BaseModel, ValidationError
+from sqlmodel import Session, select
+from starlette.background import BackgroundTask
+
+from ...core.database import get_session, engine
+from ...models.models import Campaign, Conversation
+from ...services.llm.ollama_client import check_ollama_status
 from ...services.llm.vector_store import VectorService
+from ...services.llm.embedders import EMBEDDERS
+from ...services.llm.conversations import ConversationService, compact_conversation
+from ...services.llm.scheduler import scheduler
+from ...core.config import settings
+from ...services.llm.librarian import ask_librarian, collect_answer, answer_batch, build_context, flights
+from ...services.llm.metrics import metrics, RequestTimer
+from ...services.llm.model_router import route_stats
 
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
@@ -28,15 +36,45 @@ class ChatMessage(BaseModel):
 
 
 class ChatRequest(BaseModel):
+    # With a conversation_id only the new user message needs to be sent;
+    # without one, the messages seed a new server-side conversation.
     messages: List[ChatMessage]
     campaign_id: int # Required now for RAG
+    conversation_id: Optional[int] = None
     session_id: Optional[int] = None
     persona_id: Optional[int] = None
+    # Force the fast or strong model; by default the router picks per question
+    tier: Optional[Literal["fast", "strong"]] = None
 
 
 class ChatResponse(BaseModel):
     response: str
     context_sources: List[str]
+    conversation_id: int
+    # Per-request timing spans in ms (embed_ms, retrieve_ms, pack_ms, ttft_ms, total_ms) plus tokens_per_sec
+    timings: Dict[str, float] = {}
+    # Model tier used: {"tier", "model", "reason"}; None when answered without the model
+    route: Optional[Dict[str, str]] = None
+
+
+class EmbedderUpdate(BaseModel):
+    embedder: str
+
+
+class BatchRequest(BaseModel):
+    campaign_id: int
+    questions: List[str]
+    tier: Optional[Literal["fast", "strong"]] = None
+
+
+class ConversationRead(BaseModel):
+    id: int
+    campaign_id: int
+    summary: Optional[str] = None
+    compacted_count: int
+    created_at: datetime
+    updated_at: datetime
+    messages: List[ChatMessage] = []
 
 
 class OllamaStatusResponse(BaseModel):
@@ -76,81 +114,176 @@ async def index_campaign(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/embedders")
+def list_embedders():
+    """Embedders a campaign's RAG index can use."""
+    return {"embedders": list(EMBEDDERS)}
+
+
+@router.put("/embedder/{campaign_id}")
+def set_campaign_embedder(campaign_id: int, update: EmbedderUpdate, db: Session = Depends(get_session)):
+    """Switch the embedder a campaign is indexed and searched with, and rebuild its index."""
+    if update.embedder not in EMBEDDERS:
+        raise HTTPException(status_code=400, detail=f"Unknown embedder. Available: {', '.join(EMBEDDERS)}")
+    campaign = db.get(Campaign, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+
+    campaign.embedder = update.embedder
+    db.add(campaign)
+    db.commit()
+    try:
+        VectorService(db).reindex_campaign(campaign_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "success", "campaign_id": campaign_id, "embedder": campaign.embedder}
+
+
+def _start_turn(request: ChatRequest, db: Session) -> Tuple[Conversation, str, List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    Find the request's conversation (creating one if needed) and the incoming user turn.
+    Returns the conversation, the bounded history (summary, messages) to prompt with, ending in
+    the incoming messages, and the incoming messages themselves. Nothing is recorded yet:
+    _finish_turn stores the turn together with its answer, so a rejected or failed request
+    leaves no unanswered question behind.
+    """
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="No messages provided")
+
+    conversations = ConversationService(db)
+    incoming = [{"role": m.role, "content": m.content} for m in request.messages]
+
+    if request.conversation_id is not None:
+        conversation = conversations.get(request.conversation_id)
+        if not conversation:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        if conversation.campaign_id != request.campaign_id:
+            raise HTTPException(status_code=400, detail="Conversation belongs to a different campaign")
+        # The server already holds the history; only the newest message is new
+        incoming = incoming[-1:]
+    else:
+        conversation = conversations.create(request.campaign_id)
+
+    history_summary, history = conversations.build_history(conversation)
+    return conversation, history_summary, history + incoming, incoming
+
+
+def _open_turn(request: ChatRequest) -> Tuple[int, str, List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    _start_turn with its own DB session. The async endpoints run it with asyncio.to_thread,
+    so the conversation reads and writes don't block the event loop.
+    """
+    with Session(engine) as db:
+        conversation, history_summary, messages, incoming = _start_turn(request, db)
+        return conversation.id, history_summary, messages, incoming
+
+
+def _finish_turn(conversation_id: int, incoming: List[Dict[str, str]], response: str):
+    """Persist the user turn with the assistant reply and compact the conversation if it has grown too long."""
+    with Session(engine) as db:
+        conversations = ConversationService(db)
+        conversation = conversations.get(conversation_id)
+        if not conversation:
+            return
+        conversations.add_messages(conversation, incoming + [{"role": "assistant", "content": response}])
+        if conversations.needs_compaction(conversation):
+            compact_conversation(conversation_id, engine)
+
+
 @router.post("/librarian", response_model=ChatResponse)
-def chat_librarian(
+async def chat_librarian(
     request: ChatRequest,
-    db: Session = Depends(get_session)
+    background_tasks: BackgroundTasks
 ):
     """
     Chat with the D&D campaign librarian using Vector RAG.
+    Identical concurrent questions share a single retrieval and generation.
     """
-    if not request.messages:
-        raise HTTPException(status_code=400, detail="No messages provided")
-        
-    last_user_message = request.messages[-1].content
-    
-    # 1. Retrieve relevant context via Vector Search
-    vector_service = VectorService(db)
-    # Search using the last message
-    # TODO: Could summarize strictly the last few turns for a better query
-    results = vector_service.search(last_user_message, request.campaign_id, limit=8)
-    
-    # 2. Build Context String
-    context_parts = []
-    sources = []
-    
-    if not results:
-        # Fallback to basic context if index is empty (or user hasn't indexed yet)
-        context_parts.append("No specific archives found. Answering based on general campaign knowledge if available.")
-    else:
-        context_parts.append(f"Found {len(results)} relevant entries in the archives across sessions and characters:")
-        for r in results:
-            context_parts.append(f"---\n{r.text_content}")
-            sources.append(f"{r.source_type}:{r.source_id}")
-            
-    final_context = "\n".join(context_parts)
-    
-    # Track what context sources were used
-    context_sources = sources
-    
-    # Convert messages to dict format
-    messages = [{"role": m.role, "content": m.content} for m in request.messages]
-    
-    try:
-        response = chat_with_librarian(messages=messages, context=final_context)
-        return ChatResponse(response=response, context_sources=context_sources)
-    except RuntimeError as e:
-        raise HTTPException(status_code=503, detail=str(e))
+    conversation_id, history_summary, messages, incoming = await asyncio.to_thread(_open_turn, request)
+
+    answer = await collect_answer(
+        ask_librarian(request.campaign_id, messages, history_summary, stream=False, tier=request.tier)
+    )
+    if answer["error"]:
+        raise HTTPException(status_code=answer["error"]["status"], detail=answer["error"]["detail"])
+
+    background_tasks.add_task(_finish_turn, conversation_id, incoming, answer["response"])
+    return ChatResponse(
+        response=answer["response"],
+        context_sources=answer["sources"],
+        conversation_id=conversation_id,
+        timings=answer["timings"],
+        route=answer["route"]
+    )
 
 
 @router.post("/librarian/stream")
 async def stream_librarian(
     request: ChatRequest,
-    db: Session = Depends(get_session)
+    http_request: Request
 ):
     """
     Stream a chat response from the D&D campaign librarian.
+    The conversation id is sent first as an `event: conversation` SSE event, and the
+    retrieved context sources as `event: sources` before the first token. Request timings
+    and the model route taken arrive in a final `event: metadata` just before `[DONE]`.
+    While waiting for a generation slot, `event: queue` events report the queue position;
+    if the wait times out an `event: error` with status 503 ends the stream.
+    Identical concurrent questions share one generation, its tokens fanned out to every stream.
+    If the client disconnects, its subscription is dropped; once no stream is listening the
+    Ollama generation is aborted and its scheduler slot released.
     """
-    last_user_message = request.messages[-1].content
-    
-    # 1. Retrieve relevant context
-    vector_service = VectorService(db)
-    results = vector_service.search(last_user_message, request.campaign_id, limit=8)
-    
-    context_parts = []
-    if results:
-        for r in results:
-            context_parts.append(f"---\n{r.text_content}")
-    
-    final_context = "\n".join(context_parts)
-    
-    # Convert messages to dict format
-    messages = [{"role": m.role, "content": m.content} for m in request.messages]
+    conversation_id, history_summary, messages, incoming = await asyncio.to_thread(_open_turn, request)
+
+    events = ask_librarian(request.campaign_id, messages, history_summary, stream=True, tier=request.tier)
+
+    # Admission is decided by the first event; a full queue is a plain 503
+    first_event = await anext(events, None)
+    if first_event and first_event[0] == "error":
+        events.close()
+        raise HTTPException(status_code=first_event[1]["status"], detail=first_event[1]["detail"])
     
+    response_chunks = []
+    completed = False
+
+    async def replay():
+        if first_event:
+            yield first_event
+        async for event in events:
+            yield event
+
     async def generate():
-        async for chunk in stream_librarian_response(messages=messages, context=final_context):
-            yield f"data: {chunk}\n\n"
-        yield "data: [DONE]\n\n"
+        nonlocal completed
+        try:
+            yield f"event: conversation\ndata: {conversation_id}\n\n"
+            async for event, data in replay():
+                # Starlette cancels this generator on disconnect; the explicit check also
+                # covers servers that keep accepting writes to a closed connection.
+                if await http_request.is_disconnected():
+                    return
+                if event == "token":
+                    response_chunks.append(data)
+                    yield f"data: {data}\n\n"
+                elif event == "queue":
+                    yield f"event: queue\ndata: {json.dumps({'position': data})}\n\n"
+                elif event == "sources":
+                    yield f"event: sources\ndata: {json.dumps(data)}\n\n"
+                elif event == "metadata":
+                    yield f"event: metadata\ndata: {json.dumps(data)}\n\n"
+                elif event == "error":
+                    yield f"event: error\ndata: {json.dumps(data)}\n\n"
+                    return
+            completed = True
+            yield "data: [DONE]\n\n"
+        finally:
+            events.close()
+
+    async def finish():
+        # Also runs when the stream never started (client gone before the first byte)
+        events.close()
+        # Abandoned answers are not recorded in the conversation
+        if completed and response_chunks:
+            await asyncio.to_thread(_finish_turn, conversation_id, incoming, "".join(response_chunks))
     
     return StreamingResponse(
         generate(),
@@ -158,10 +291,204 @@ async def stream_librarian(
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-        }
+        },
+        background=BackgroundTask(finish)
     )
 
 
+@router.post("/librarian/batch")
+async def batch_librarian(request: BatchRequest, http_request: Request):
+    """
+    Answer many standalone questions for one campaign (e.g. a pre-session FAQ).
+    Streams NDJSON: one line per answered question, in completion order
+    ({"index", "question", "response", "sources", "error", "timings"}), then a final
+    {"done": true, ...} line. Questions are not recorded as conversations.
+    """
+    questions = [q.strip() for q in request.questions if q.strip()]
+    if not questions:
+        raise HTTPException(status_code=400, detail="No questions provided")
+    if len(questions) > settings.LIBRARIAN_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.LIBRARIAN_BATCH_MAX_QUESTIONS} questions per batch")
+
+    async def generate():
+        results = answer_batch(request.campaign_id, questions, request.tier)
+        try:
+            async for item in results:
+                if await http_request.is_disconnected():
+                    return
+                yield json.dumps(item) + "\n"
+        except Exception as e:
+            # Retrieval failed (e.g. Ollama is down) before any answer could be produced
+            yield json.dumps({"done": True, "error": {"status": 503, "detail": str(e)}}) + "\n"
+        finally:
+            await results.aclose()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+class SocketAsk(ChatRequest):
+    # Client-chosen stream id; every frame about this question carries it
+    id: str
+
+
+@router.websocket("/ws")
+async def librarian_socket(websocket: WebSocket):
+    """
+    One connection per client, carrying any number of concurrent librarian questions.
+
+    Client frames (JSON):
+      {"type": "ask", "id": "q1", "campaign_id": 1, "messages": [...], "conversation_id"?, "tier"?}
+      {"type": "cancel", "id": "q1"}
+    Server frames all carry the question's "id":
+      conversation -> queue* -> sources -> token* -> metadata -> done
+    or "error" / "cancelled" instead of finishing. Sources are always sent before the first token.
+    Cancelling (or disconnecting) drops the question's subscription; once nobody is listening
+    the Ollama generation is aborted, exactly as with the SSE endpoint.
+    """
+    await websocket.accept()
+    streams: Dict[str, asyncio.Task] = {}
+    send_lock = asyncio.Lock()
+
+    async def send(frame: dict):
+        async with send_lock:
+            await websocket.send_json(frame)
+
+    async def run(ask: SocketAsk):
+        stream_id = ask.id
+        events = None
+        completed = False
+        chunks = []
+        try:
+            try:
+                conversation_id, history_summary, messages, incoming = await asyncio.to_thread(_open_turn, ask)
+            except HTTPException as e:
+                await send({"type": "error", "id": stream_id, "status": e.status_code, "detail": e.detail})
+                return
+            await send({"type": "conversation", "id": stream_id, "conversation_id": conversation_id})
+
+            events = ask_librarian(ask.campaign_id, messages, history_summary, stream=True, tier=ask.tier)
+            async for event, data in events:
+                if event == "token":
+                    chunks.append(data)
+                    await send({"type": "token", "id": stream_id, "content": data})
+                elif event == "queue":
+                    await send({"type": "queue", "id": stream_id, "position": data})
+                elif event == "sources":
+                    await send({"type": "sources", "id": stream_id, "sources": data})
+                elif event == "metadata":
+                    await send({"type": "metadata", "id": stream_id, **data})
+                elif event == "error":
+                    await send({"type": "error", "id": stream_id, **data})
+                    return
+            completed = True
+            await send({"type": "done", "id": stream_id})
+        except asyncio.CancelledError:
+            # Explicit cancel frame (the socket may already be gone on disconnect)
+            try:
+                await send({"type": "cancelled", "id": stream_id})
+            except Exception:
+                pass
+            raise
+        finally:
+            if events is not None:
+                events.close()
+            streams.pop(stream_id, None)
+            if completed and chunks:
+                await asyncio.to_thread(_finish_turn, conversation_id, incoming, "".join(chunks))
+
+    try:
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                frame = None
+            if not isinstance(frame, dict):
+                await send({"type": "error", "id": "", "status": 400, "detail": "Frames must be JSON objects"})
+                continue
+            kind = frame.get("type")
+            stream_id = str(frame.get("id", ""))
+
+            if kind == "cancel":
+                task = streams.get(stream_id)
+                if task is not None:
+                    task.cancel()
+                continue
+
+            if kind != "ask":
+                await send({"type": "error", "id": stream_id, "status": 400, "detail": f"Unknown frame type: {kind}"})
+                continue
+            if stream_id in streams:
+                await send({"type": "error", "id": stream_id, "status": 409, "detail": "A question with this id is already running"})
+                continue
+            try:
+                ask = SocketAsk(**frame)
+            except ValidationError as e:
+                await send({"type": "error", "id": stream_id, "status": 422, "detail": json.loads(e.json(include_url=False))})
+                continue
+            streams[ask.id] = asyncio.create_task(run(ask))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in list(streams.values()):
+            task.cancel()
+
+
+@router.get("/scheduler")
+def get_scheduler_status():
+    """Current generation slot usage, per-campaign queue depth and coalesced runs in flight."""
+    return {**scheduler.stats(), "in_flight": flights.in_flight()}
+
+
+@router.get("/routes")
+def get_route_stats():
+    """Model tiers with their configured model, request counts and latency (ttft/total) histograms."""
+    return route_stats()
+
+
+@router.get("/metrics")
+def get_chat_metrics():
+    """Librarian counters (e.g. cancelled generations) and latency histograms per timing span."""
+    return metrics.snapshot()
+
+
+@router.get("/conversations", response_model=List[ConversationRead])
+def list_conversations(campaign_id: int, db: Session = Depends(get_session)):
+    """List librarian conversations for a campaign (without messages)."""
+    return db.exec(
+        select(Conversation)
+        .where(Conversation.campaign_id == campaign_id)
+        .order_by(Conversation.updated_at.desc())
+    ).all()
+
+
+@router.get("/conversations/{conversation_id}", response_model=ConversationRead)
+def get_conversation(conversation_id: int, db: Session = Depends(get_session)):
+    """Fetch a conversation with its full message history."""
+    conversations = ConversationService(db)
+    conversation = conversations.get(conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return ConversationRead(
+        id=conversation.id,
+        campaign_id=conversation.campaign_id,
+        summary=conversation.summary,
+        compacted_count=conversation.compacted_count,
+        created_at=conversation.created_at,
+        updated_at=conversation.updated_at,
+        messages=[ChatMessage(role=m.role, content=m.content) for m in conversations.get_messages(conversation)]
+    )
+
+
+@router.delete("/conversations/{conversation_id}")
+def delete_conversation(conversation_id: int, db: Session = Depends(get_session)):
+    conversation = db.get(Conversation, conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    db.delete(conversation)
+    db.commit()
+    return {"ok": True}
+
+
 @router.get("/context/{campaign_id}")
 def get_context_preview(
     campaign_id: int,
@@ -169,13 +496,18 @@ def get_context_preview(
     db: Session = Depends(get_session)
 ):
     """
-    Debug endpoint to view what the Vector RAG would retrieve for a query.
+    Debug endpoint to view what the Vector RAG would retrieve for a query,
+    and the compressed context the librarian would actually be prompted with.
     """
     service = VectorService(db)
     results = service.search(query, campaign_id, limit=10)
+    timer = RequestTimer()
+    context, _ = build_context(results, timer)
     
     return {
         "campaign_id": campaign_id,
         "query": query,
-        "results": [{"text": r.text_content, "score": "N/A"} for r in results]
+        "results": [{"text": r.text_content, "score": "N/A"} for r in results],
+        "context": context,
+        "compression": timer.as_dict()
     }
@@ -0,0 +1,128 @@
+import asyncio
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import Session, select, func
+from typing import List, Literal, Optional
+
+from ...core.config import settings
+from ...core.database import get_session
+from ...models.enums import JobStatus
+from ...models.models import Job, GeminiUsage
+from ...services import jobs
+from ...services.llm import file_cache, usage
+from ...services.llm.metrics import pipeline_metrics
+from ...services.llm.model_health import model_health, recorded_health
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+def _job_view(job: Job) -> dict:
+    view = job.model_dump(exclude={"stage_history"})
+    view["stage_history"] = jobs.stage_history(job)
+    return view
+
+
+@router.get("/")
+def list_jobs(
+    status: Optional[JobStatus] = None,
+    kind: Optional[str] = None,
+    target_id: Optional[int] = None,
+    limit: int = 50,
+    db: Session = Depends(get_session)
+) -> List[dict]:
+    query = select(Job)
+    if status:
+        query = query.where(Job.status == status)
+    if kind:
+        query = query.where(Job.kind == kind)
+    if target_id is not None:
+        query = query.where(Job.target_id == target_id)
+    return [_job_view(j) for j in db.exec(query.order_by(Job.id.desc()).limit(min(limit, 500))).all()]
+
+
+@router.get("/stats")
+def job_stats(db: Session = Depends(get_session)):
+    """Job counts per status, plus the workers currently holding leases."""
+    counts = dict(db.exec(select(Job.status, func.count()).group_by(Job.status)).all())
+    workers = db.exec(select(Job.lease_owner).where(Job.status == JobStatus.RUNNING).distinct()).all()
+    return {
+        "counts": {s.value: counts.get(s, 0) for s in JobStatus},
+        "workers": [w for w in workers if w],
+    }
+
+
+@router.get("/metrics")
+def get_pipeline_metrics():
+    """Pipeline timings of this process, e.g. Gemini upload throughput and time-to-ACTIVE."""
+    return pipeline_metrics.snapshot()
+
+
+@router.get("/gemini-files")
+def list_gemini_files():
+    """Audio kept on Gemini for reuse, soonest to expire first."""
+    return file_cache.registry_view()
+
+
+@router.post("/gemini-files/sweep")
+async def sweep_gemini_files():
+    """Delete expired and orphaned Gemini files now instead of waiting for the next pipeline run."""
+    return await asyncio.to_thread(file_cache.sweep)
+
+
+@router.get("/model-health")
+def get_model_health(db: Session = Depends(get_session)):
+    """
+    Circuit state, error rate and latency per Gemini model in this process, and under
+    `all_processes` the same numbers from the calls recorded by every process. With
+    PIPELINE_EXECUTOR=queue the calls are made in the workers, so only the latter says
+    anything about them.
+    """
+    models = settings.GEMINI_ANALYSIS_MODELS + settings.GEMINI_SUMMARY_MODELS
+    recorded = recorded_health(db, models)
+    return [
+        {**breaker, "all_processes": recorded.get(breaker["model"])}
+        for breaker in model_health.snapshot(list(recorded))
+    ]
+
+
+@router.get("/usage")
+def get_gemini_usage(operation: Optional[str] = None, since: Optional[datetime] = None, db: Session = Depends(get_session)):
+    """Gemini tokens and seconds spent, in total and per operation, model and campaign."""
+    return usage.summarize(db, ["operation", "model", "campaign_id"], operation=operation, since=since)
+
+
+@router.get("/usage/calls", response_model=List[GeminiUsage])
+def list_heaviest_gemini_calls(
+    order_by: Literal["input_tokens", "output_tokens", "total_tokens", "seconds"] = "input_tokens",
+    operation: Optional[str] = None,
+    session_id: Optional[int] = None,
+    campaign_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    limit: int = 20,
+    db: Session = Depends(get_session)
+):
+    """The single Gemini calls with the largest prompts (or outputs, or times), to find heavy prompts."""
+    return usage.heaviest(db, order_by, min(limit, 500), session_id=session_id, campaign_id=campaign_id, operation=operation, since=since)
+
+
+@router.get("/{job_id}")
+def get_job(job_id: int, db: Session = Depends(get_session)):
+    job = db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_view(job)
+
+
+@router.post("/{job_id}/retry")
+def retry_job(job_id: int, db: Session = Depends(get_session)):
+    try:
+        job = jobs.retry(db, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_view(job)
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from typing import List, Optional
+from typing import List, Literal, Optional
 from sqlmodel import select
 
 from ...core.database import get_session, Session as DBSession, engine
-from ...models.models import Session
+from ...models.models import Session, AnalysisRun, Transcript
+from ...services.llm import analysis_store, transcripts, usage
 from ...models.enums import ProcessingStatus
 from ...services.llm.generators import process_session_pipeline, process_text_session_pipeline
 import json
@@ -39,9 +40,38 @@ from ...services.session_service import SessionService
 def regenerate_session(
     session_id: int, 
     background_tasks: BackgroundTasks,
+    mode: Literal["full", "replay", "transcript"] = "full",
+    run_id: Optional[int] = None,
     db: DBSession = Depends(get_session)
 ):
-    return SessionService.regenerate_session(session_id, db, background_tasks)
+    """
+    mode=full re-analyses the session's audio or text with Gemini (in the background).
+    mode=replay re-saves the latest stored analysis response (or run_id) immediately, without a model call.
+    mode=transcript re-analyses the stored transcript (in the background) without sending the audio again.
+    """
+    return SessionService.regenerate_session(session_id, db, background_tasks, mode=mode, run_id=run_id)
+
+@router.get("/{session_id}/analysis-runs")
+def list_analysis_runs(session_id: int, db: DBSession = Depends(get_session)):
+    """Stored analysis responses for the session with their input fingerprints, newest first."""
+    if not db.get(Session, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    runs = db.exec(select(AnalysisRun).where(AnalysisRun.session_id == session_id).order_by(AnalysisRun.id.desc())).all()
+    return [analysis_store.run_view(r) for r in runs]
+
+@router.get("/{session_id}/transcript", response_model=List[Transcript])
+def get_transcript(session_id: int, db: DBSession = Depends(get_session)):
+    """The stored speaker turns of the session, in recording order."""
+    if not db.get(Session, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return transcripts.load(db, session_id)
+
+@router.get("/{session_id}/usage")
+def get_session_usage(session_id: int, db: DBSession = Depends(get_session)):
+    """Gemini tokens and seconds spent on the session, in total and per operation and model."""
+    if not db.get(Session, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return usage.summarize(db, ["operation", "model"], session_id=session_id)
 
 @router.post("/", response_model=Session)
 def create_session(session: Session, db: DBSession = Depends(get_session)):
@@ -6,11 +6,12 @@ from typing import List
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, BackgroundTasks
 from pydantic import BaseModel
 
-from ...core.database import get_session, Session as DBSession, engine
+from ...core.database import get_session, Session as DBSession
 from ...core.config import settings
 from ...models.models import Session, Campaign
 from ...services.llm.generators import process_session_pipeline, process_text_session_pipeline
 from ...models.enums import ProcessingStatus
+from ...services import jobs
 
 router = APIRouter(tags=["uploads"])
 
@@ -59,9 +60,9 @@ async def import_session_text(
         db.refresh(new_session)
         
         # Trigger TEXT Pipeline
-        background_tasks.add_task(process_text_session_pipeline, new_session.id, engine)
+        job = jobs.dispatch(jobs.TEXT_SESSION, new_session.id, db, background_tasks, process_text_session_pipeline)
         
-        return {"session_id": new_session.id, "status": ProcessingStatus.UPLOADED}
+        return {"session_id": new_session.id, "status": ProcessingStatus.UPLOADED, "job_id": job.id if job else None}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -104,9 +105,9 @@ async def upload_session(
         
         # Trigger AI Pipeline in background
         print(f"Triggering background task for session {new_session.id}", flush=True)
-        background_tasks.add_task(process_session_pipeline, new_session.id, engine)
+        job = jobs.dispatch(jobs.SESSION, new_session.id, db, background_tasks, process_session_pipeline)
         
-        return {"session_id": new_session.id, "status": ProcessingStatus.UPLOADED, "file_count": len(saved_paths)}
+        return {"session_id": new_session.id, "status": ProcessingStatus.UPLOADED, "file_count": len(saved_paths), "job_id": job.id if job else None}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -143,9 +144,9 @@ async def import_local_session(
         
         # Trigger AI Pipeline in background
         print(f"Triggering background task for local session {new_session.id}", flush=True)
-        background_tasks.add_task(process_session_pipeline, new_session.id, engine)
+        job = jobs.dispatch(jobs.SESSION, new_session.id, db, background_tasks, process_session_pipeline)
         
-        return {"session_id": new_session.id, "status": ProcessingStatus.UPLOADED, "file_count": len(valid_paths)}
+        return {"session_id": new_session.id, "status": ProcessingStatus.UPLOADED, "file_count": len(valid_paths), "job_id": job.id if job else None}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -185,9 +186,9 @@ async def reupload_session(
         
         # Trigger Pipeline
         print(f"Triggering background task for reuploaded session {session.id}", flush=True)
-        background_tasks.add_task(process_session_pipeline, session.id, engine)
+        job = jobs.dispatch(jobs.SESSION, session.id, db, background_tasks, process_session_pipeline)
         
-        return {"session_id": session.id, "status": ProcessingStatus.PROCESSING, "file_count": len(saved_paths)}
+        return {"session_id": session.id, "status": ProcessingStatus.PROCESSING, "file_count": len(saved_paths), "job_id": job.id if job else None}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
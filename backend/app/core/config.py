@@ -1,15 +1,104 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite:///database.db"
     GEMINI_API_KEY: str
     UPLOAD_DIR: str = "uploads"
     FFMPEG_PATH: str = "ffmpeg"  # Default to system 'ffmpeg' (e.g. in Docker)
+    FFPROBE_PATH: str = "ffprobe"
     
     # Ollama settings for local chat agent
     OLLAMA_HOST: str = "http://127.0.0.1:11434"
     OLLAMA_MODEL: str = "phi4"
+    OLLAMA_CONTEXT_WINDOW: int = 8192
+    OLLAMA_KEEP_ALIVE: str = "30m"  # How long Ollama keeps the model loaded after a request
+    # Smaller model for simple librarian questions (e.g. "llama3.2:3b"); unset sends everything to OLLAMA_MODEL
+    OLLAMA_FAST_MODEL: Optional[str] = None
+    # Opt-in: also index every chunk with the built-in hashing embedder, so search still works while Ollama
+    # is down. Doubles the stored chunks and the indexing time.
+    EMBEDDING_FALLBACK: bool = False
+
+    # Librarian model routing: a question goes to the fast model only if it passes every check
+    ROUTER_FAST_MAX_WORDS: int = 20  # Longer questions go to the strong model
+    # Best retrieval cosine similarity needed to trust the fast model, per embedder (their scores aren't on one
+    # scale). Searches with an embedder that has no entry here, or with the hashing fallback, go to the strong model.
+    ROUTER_FAST_MIN_SCORE: Dict[str, float] = {"ollama": 0.45}
+    ROUTER_FAST_MAX_DEPTH: int = 4  # Prior messages in the prompt history before a conversation counts as deep
+
+    # Librarian conversation history
+    CHAT_HISTORY_WINDOW: int = 6  # Most recent messages left out of the summary when a conversation is compacted
+    CHAT_COMPACTION_THRESHOLD: int = 12  # Un-summarized messages (all sent verbatim) before compaction kicks in
+
+    # Librarian generation scheduling (CPU-only Ollama hosts can't run many generations at once)
+    LIBRARIAN_MAX_CONCURRENT_GENERATIONS: int = 1
+    LIBRARIAN_MAX_QUEUE: int = 20  # Waiting requests beyond this are rejected with a 503
+    LIBRARIAN_QUEUE_TIMEOUT: float = 120.0  # Seconds a request may wait for a slot
+    LIBRARIAN_BATCH_CONCURRENCY: int = 2  # Batch questions queued for a slot at once
+    LIBRARIAN_BATCH_MAX_QUESTIONS: int = 100
+
+    # Gemini file uploads
+    GEMINI_UPLOAD_CONCURRENCY: int = 3  # Files of one session uploaded at once
+    GEMINI_POLL_INITIAL_DELAY: float = 2.0  # Seconds before the first processing-state poll; doubles per round
+    GEMINI_POLL_MAX_DELAY: float = 30.0
+    GEMINI_FILE_ACTIVE_TIMEOUT: float = 900.0  # Give up if uploaded files are not ACTIVE by then
+    # Keep uploaded audio on Gemini and reuse it when the same file is processed again
+    GEMINI_FILE_CACHE: bool = True
+    GEMINI_FILE_REUSE_MARGIN: float = 7200.0  # Seconds a cached file must still be valid for to be reused
+    GEMINI_FILE_SWEEP_INTERVAL: float = 1800.0  # Seconds between sweeps of expired and orphaned files
+    # Uploads are named with this prefix, so the sweeper can tell this app's files from others on the key
+    GEMINI_FILE_DISPLAY_PREFIX: str = "dnd-audio-manager-"
+    # Opt-in: also delete remote files with the prefix that the registry doesn't know (left by crashed runs)
+    # once older than this many seconds. Leave at 0 if another instance or database shares the key and prefix.
+    GEMINI_FILE_ORPHAN_GRACE: float = 0.0
+
+    # Gemini models tried in order for session analysis; models with an open circuit are skipped
+    GEMINI_ANALYSIS_MODELS: List[str] = ["gemini-flash-latest", "gemini-3-flash-preview", "gemini-pro-latest"]
+    GEMINI_SUMMARY_MODELS: List[str] = ["gemini-flash-latest"]  # Campaign summaries and summary refinement
+    GEMINI_CIRCUIT_WINDOW: float = 900.0  # Seconds of call history the error rate is computed over
+    GEMINI_CIRCUIT_MIN_CALLS: int = 2  # Calls in the window before the error rate can open a circuit
+    GEMINI_CIRCUIT_ERROR_RATE: float = 0.5
+    GEMINI_CIRCUIT_COOLDOWN: float = 300.0  # Seconds an open circuit skips its model before a trial call
+    # Retries on the same model per error class, with exponential backoff from `delay` seconds
+    GEMINI_RETRY_POLICY: Dict[str, Dict[str, float]] = {
+        "rate_limit": {"retries": 1, "delay": 20.0},
+        "unavailable": {"retries": 1, "delay": 5.0},
+        "timeout": {"retries": 0, "delay": 0.0},
+        "not_found": {"retries": 0, "delay": 0.0},
+        "invalid_request": {"retries": 0, "delay": 0.0},
+        "invalid_response": {"retries": 1, "delay": 0.0},
+        "other": {"retries": 0, "delay": 5.0},
+    }
+
+    # Campaign summaries fold new sessions into the stored story so far instead of re-reading every session
+    GEMINI_SESSION_DIGEST_WORDS: int = 200  # Length of the per-session digest the story is built from
+    GEMINI_DIGEST_CONCURRENCY: int = 4  # Session digests generated at once
+    GEMINI_CAMPAIGN_FOLD_BATCH: int = 8  # Session digests folded into the story per call
+    GEMINI_CAMPAIGN_STORY_WORDS: int = 1500  # Length the story so far is kept under
+    GEMINI_CAMPAIGN_MAX_ITEMS: int = 15  # Key events / ongoing conflicts kept
+
+    # Opt-in: transcribe session audio once and analyse the stored transcript, so regenerations don't resend
+    # audio. Costs a second call per session, and the text analysis can't hear voices or tone
+    # (voice_description); very long recordings should be segmented so the transcript fits the output limit.
+    GEMINI_TRANSCRIPT_FIRST: bool = False
+
+    # Long recordings are cut into overlapping windows that are analysed concurrently and merged.
+    # 'auto' segments recordings longer than GEMINI_SEGMENT_THRESHOLD seconds, 'always' every recording, 'off' none
+    GEMINI_SEGMENTED_ANALYSIS: str = "auto"
+    GEMINI_SEGMENT_THRESHOLD: float = 7200.0
+    GEMINI_SEGMENT_LENGTH: float = 2700.0  # Seconds per window
+    GEMINI_SEGMENT_OVERLAP: float = 120.0  # Seconds each window repeats of the previous one
+    GEMINI_SEGMENT_CONCURRENCY: int = 4  # Windows cut and analysed at once
+
+    # Session processing pipelines: 'background' runs them in the API process,
+    # 'queue' stores them as jobs for the standalone worker (python -m app.worker)
+    PIPELINE_EXECUTOR: str = "background"
+    WORKER_SLOTS: int = 2  # Pipelines a worker runs at once
+    WORKER_POLL_INTERVAL: float = 2.0  # Seconds an idle slot waits before polling the queue again
+    JOB_LEASE_SECONDS: int = 120  # A job whose worker missed heartbeats this long is picked up again
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BASE_DELAY: float = 30.0  # Seconds before the first retry; doubles per attempt
+    JOB_RETRY_MAX_DELAY: float = 1800.0
 
     class Config:
         # Look for .env in current dir, or in backend/ (for when running from root)
@@ -8,6 +8,7 @@ from fastapi import BackgroundTasks
 # Imports from new structure
 from ..models.models import Session as DBSession, Persona as DBPersona, Highlight as DBHighlight, Quote as DBQuote, Campaign as DBCampaign, Moment as DBMoment
 from ..services.llm.generators import generate_campaign_summary_pipeline, refine_session_summary
+from ..services import jobs
 from ..core.database import engine
 
 # Input Types
@@ -219,7 +220,7 @@ class Mutation:
         db_engine = info.context.get("engine")
         
         if bg_tasks and db_engine:
-             bg_tasks.add_task(generate_campaign_summary_pipeline, id, db_engine)
+             jobs.dispatch(jobs.CAMPAIGN_SUMMARY, id, info.context["db"], bg_tasks, generate_campaign_summary_pipeline)
              return True
         return False
 
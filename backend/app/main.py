@@ -8,7 +8,7 @@ from .core.database import create_db_and_tables, get_session, Session as DBSessi
 from .graphql.schema import schema
 
 # Import Routers
-from .api.routers import campaigns, sessions, personas, highlights, uploads, moments, chat
+from .api.routers import campaigns, sessions, personas, highlights, uploads, moments, chat, jobs
 
 # Initialize DB (Optional, or use a lifespan event)
 create_db_and_tables()
@@ -45,6 +45,7 @@ app.include_router(highlights.router)
 app.include_router(moments.router)
 app.include_router(uploads.router)
 app.include_router(chat.router)
+app.include_router(jobs.router)
 
 @app.get("/")
 def read_root():
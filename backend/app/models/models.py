@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional, List
 from sqlmodel import Field, SQLModel, Relationship
-from .enums import ProcessingStatus
+from .enums import ProcessingStatus, JobStatus
 
 # --- Base/Read Models to break circular dependencies ---
 
@@ -37,6 +37,10 @@ class Campaign(SQLModel, table=True):
     sessions: List["Session"] = Relationship(back_populates="campaign", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
     personas: List["Persona"] = Relationship(back_populates="campaign", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
     summary: Optional[str] = Field(default=None, description="AI generated summary of the campaign")
+    embedder: str = Field(default="ollama", description="Embedder used for the RAG index: 'ollama' or 'hashing'")
+    # Incremental summary: the structured story so far and the sessions folded into it
+    summary_state: Optional[str] = Field(default=None, description="JSON CampaignSummarySchema of the story so far")
+    summary_sessions: str = Field(default="[]", description="JSON list of [session id, digest source hash] folded into summary_state, in order")
     
     highlights: List["Highlight"] = Relationship(back_populates="campaign", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
     quotes: List["Quote"] = Relationship(back_populates="campaign", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
@@ -57,15 +61,35 @@ class Session(SQLModel, table=True):
     moments: List["Moment"] = Relationship(back_populates="session", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
     highlights: List["Highlight"] = Relationship(back_populates="session", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
     quotes: List["Quote"] = Relationship(back_populates="session", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
+    analysis_runs: List["AnalysisRun"] = Relationship(back_populates="session", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
+    transcripts: List["Transcript"] = Relationship(back_populates="session", sa_relationship_kwargs={"cascade": "all, delete-orphan", "order_by": "Transcript.id"})
+    digests: List["SessionDigest"] = Relationship(back_populates="session", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
     
     summary: Optional[str] = Field(default=None, description="AI generated summary of the session")
 
 class Transcript(SQLModel, table=True):
+    """One speaker turn of a session's transcript, in recording order (by id)."""
     id: Optional[int] = Field(default=None, primary_key=True)
-    session_id: int = Field(foreign_key="session.id")
+    session_id: int = Field(foreign_key="session.id", index=True)
     speaker: str
     text: str
-    timestamp: str 
+    timestamp: str # HH:MM:SS into the recording, empty if unknown
+
+    session: Session = Relationship(back_populates="transcripts")
+
+class SessionDigest(SQLModel, table=True):
+    """
+    A short plot digest of a session for the campaign summary, made once from the session's
+    summary and highlights and redone only when the hash of that material changes.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: int = Field(foreign_key="session.id", index=True, unique=True)
+    source_hash: str = Field(description="SHA-256 of the session material the digest was made from")
+    digest: str
+    model: str
+    created_at: datetime = Field(default_factory=datetime.now)
+
+    session: Session = Relationship(back_populates="digests")
 
 # --- Persona Base Class ---
 class PersonaBase(SQLModel):
@@ -133,6 +157,7 @@ class Moment(SQLModel, table=True):
     session_id: int = Field(foreign_key="session.id")
     title: str
     description: str
+    timestamp: Optional[str] = None # HH:MM:SS into the recording
     type: str = Field(default="highlight") # highlight, funny, fail, rule_cool
     
     session: Session = Relationship(back_populates="moments")
@@ -154,6 +179,115 @@ class VectorStore(SQLModel, table=True):
     
     # The embedding vector (stored as JSON string of float list)
     embedding_json: str
+    # Which embedder produced it; vectors are only comparable within one embedder
+    embedder: str = Field(default="ollama", index=True)
     
     created_at: datetime = Field(default_factory=datetime.now)
 
+
+class Conversation(SQLModel, table=True):
+    """
+    A persisted librarian chat thread.
+    Older turns are folded into `summary` so the prompt stays bounded.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    campaign_id: int = Field(foreign_key="campaign.id", index=True)
+    summary: Optional[str] = Field(default=None, description="Rolling summary of compacted turns")
+    compacted_count: int = Field(default=0, description="Number of leading messages folded into the summary")
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+    messages: List["ConversationMessage"] = Relationship(back_populates="conversation", sa_relationship_kwargs={"cascade": "all, delete-orphan", "order_by": "ConversationMessage.id"})
+
+class ConversationMessage(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    conversation_id: int = Field(foreign_key="conversation.id", index=True)
+    role: str # 'user' or 'assistant'
+    content: str
+    created_at: datetime = Field(default_factory=datetime.now)
+
+    conversation: Conversation = Relationship(back_populates="messages")
+
+
+class Job(SQLModel, table=True):
+    """
+    A queued pipeline run, executed by the standalone worker (app/worker.py).
+    A running job holds a lease its worker renews with heartbeats; once the lease
+    expires the worker is presumed dead and another worker picks the job up again.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(index=True) # 'session', 'text_session', 'campaign_summary'
+    target_id: int = Field(description="Session or campaign ID the pipeline runs for")
+    status: JobStatus = Field(default=JobStatus.QUEUED, index=True)
+    stage: Optional[str] = Field(default=None, description="Pipeline stage currently (or last) running")
+    stage_history: str = Field(default="[]", description="JSON list of {stage, attempt, at}")
+
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=3)
+    run_after: datetime = Field(default_factory=datetime.now, index=True)
+    last_error: Optional[str] = None
+
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
+
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    finished_at: Optional[datetime] = None
+
+
+class GeminiFile(SQLModel, table=True):
+    """
+    Audio already uploaded to the Gemini Files API, keyed by the SHA-256 of the source file,
+    so regenerations can reuse the remote copy instead of transcoding and uploading again.
+    Gemini deletes files on its own after 48 hours; expired rows are swept.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    content_hash: str = Field(index=True, unique=True, description="SHA-256 of the source audio file")
+    name: str = Field(description="Gemini file name, e.g. 'files/abc123'")
+    uri: str
+    mime_type: str
+    size_bytes: int = Field(default=0)
+    session_id: Optional[int] = Field(default=None, index=True, description="Session that last used the file")
+    expires_at: datetime
+    created_at: datetime = Field(default_factory=datetime.now)
+    last_used_at: datetime = Field(default_factory=datetime.now)
+
+
+class AnalysisRun(SQLModel, table=True):
+    """
+    A raw Gemini analysis response for a session, stored with the fingerprint of its inputs
+    so the save stage can be replayed later without calling the model again.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: int = Field(foreign_key="session.id", index=True)
+    source: str = Field(description="'audio' or 'text'")
+    model: str
+    schema_version: str = Field(description="Hash of the response schema the model was asked for")
+    prompt_hash: str = Field(description="SHA-256 of the system prompt including campaign context")
+    input_hashes: str = Field(default="[]", description="JSON list of SHA-256 hashes of the audio or transcript inputs")
+    response_text: str
+    created_at: datetime = Field(default_factory=datetime.now)
+    saved_at: Optional[datetime] = Field(default=None, description="Last time the response was saved to the session")
+
+    session: Session = Relationship(back_populates="analysis_runs")
+
+
+class GeminiUsage(SQLModel, table=True):
+    """
+    One generate_content attempt: what it was for, its token counts from usage_metadata and
+    its wall-clock time. Kept after the session or campaign is deleted, as a record of spend.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    operation: str = Field(index=True, description="'analysis', 'segment_analysis', 'segment_summary_merge', 'transcription', 'text_analysis', 'refine', 'digest' or 'campaign_summary'")
+    session_id: Optional[int] = Field(default=None, index=True)
+    campaign_id: Optional[int] = Field(default=None, index=True)
+    model: str = Field(index=True)
+    status: str = Field(default="ok", description="'ok' or the error class of a failed attempt")
+    input_tokens: int = Field(default=0)
+    output_tokens: int = Field(default=0)
+    thinking_tokens: int = Field(default=0)
+    cached_tokens: int = Field(default=0)
+    total_tokens: int = Field(default=0)
+    seconds: float = Field(default=0.0, description="Wall-clock time of the call, parsing included")
+    created_at: datetime = Field(default_factory=datetime.now, index=True)
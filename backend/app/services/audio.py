@@ -22,6 +22,41 @@ def _compress_audio(input_path: str) -> str:
     subprocess.run(cmd, check=True)
     return output_path
 
+def probe_duration(input_path: str) -> float:
+    """Duration of an audio/video file in seconds, via ffprobe."""
+    cmd = [
+        settings.FFPROBE_PATH, "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        input_path
+    ]
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return float(result.stdout.strip())
+
+def segment_windows(duration: float, length: float, overlap: float) -> List[Tuple[float, float]]:
+    """(start, length) windows covering `duration` seconds, each overlapping the previous one by `overlap`."""
+    if duration <= length:
+        return [(0.0, duration)]
+    overlap = min(overlap, length / 2)
+    windows = []
+    start = 0.0
+    while True:
+        end = min(start + length, duration)
+        windows.append((start, end - start))
+        if end >= duration:
+            return windows
+        start = end - overlap
+
+def cut_segment(input_path: str, start: float, length: float, output_path: str) -> str:
+    """Cut `length` seconds from `start` into a compact mono mp3 (same encoding as _compress_audio)."""
+    cmd = [
+        settings.FFMPEG_PATH, "-y", "-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", input_path,
+        "-ac", "1", "-b:a", "32k", "-map", "a",
+        output_path
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return output_path
+
 async def prepare_audio_files(audio_paths: List[str]) -> Tuple[List[str], List[str]]:
     """Converts files if necessary and returns list of paths to upload + temp files to clean."""
     final_paths = []
@@ -0,0 +1,245 @@
+"""
+Persistent job queue for the session processing pipelines.
+
+With settings.PIPELINE_EXECUTOR = "queue", uploads and regenerations are stored as Job rows
+instead of FastAPI background tasks, and app/worker.py runs them:
+  - a worker claims a due job with a conditional UPDATE and holds a lease on it,
+    renewed by heartbeats while the pipeline runs;
+  - a failed run is retried with exponential backoff until max_attempts is reached;
+  - a job whose lease expired (the worker crashed or was killed) is claimed again.
+Pipelines report their current stage through report_stage(), which is a no-op outside a job.
+"""
+import json
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import BackgroundTasks
+from sqlalchemy import and_, or_, update
+from sqlmodel import Session, select
+
+from ..core.config import settings
+from ..core.database import engine
+from ..models.enums import JobStatus
+from ..models.models import Job
+
+logger = logging.getLogger(__name__)
+
+SESSION = "session"
+TEXT_SESSION = "text_session"
+TRANSCRIPT_SESSION = "transcript_session"
+CAMPAIGN_SUMMARY = "campaign_summary"
+KINDS = (SESSION, TEXT_SESSION, TRANSCRIPT_SESSION, CAMPAIGN_SUMMARY)
+
+# Set while a worker runs a job, so report_stage() knows which row to update
+_current_job: ContextVar[Optional[int]] = ContextVar("current_job", default=None)
+
+
+def pipeline_for(kind: str) -> Callable:
+    # Imported lazily: the pipelines import report_stage from this module
+    from .llm import generators
+    pipelines = {
+        SESSION: generators.process_session_pipeline,
+        TEXT_SESSION: generators.process_text_session_pipeline,
+        TRANSCRIPT_SESSION: generators.process_transcript_session_pipeline,
+        CAMPAIGN_SUMMARY: generators.generate_campaign_summary_pipeline,
+    }
+    if kind not in pipelines:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    return pipelines[kind]
+
+
+def retry_delay(attempt: int) -> float:
+    """Seconds to wait before retrying after the given (1-based) failed attempt."""
+    return min(settings.JOB_RETRY_MAX_DELAY, settings.JOB_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+
+
+def dispatch(kind: str, target_id: int, db: Session, background_tasks: BackgroundTasks, pipeline: Callable) -> Optional[Job]:
+    """
+    Start a pipeline with the configured executor.
+    Returns the queued Job, or None when the pipeline was handed to FastAPI's background tasks.
+    """
+    if settings.PIPELINE_EXECUTOR == "queue":
+        return enqueue(db, kind, target_id)
+    background_tasks.add_task(pipeline, target_id, engine)
+    return None
+
+
+def enqueue(db: Session, kind: str, target_id: int, max_attempts: Optional[int] = None) -> Job:
+    """Queue a job; a job for the same target still waiting in the queue is reused."""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    existing = db.exec(
+        select(Job)
+        .where(Job.kind == kind, Job.target_id == target_id, Job.status == JobStatus.QUEUED)
+    ).first()
+    if existing:
+        existing.run_after = min(existing.run_after, datetime.now())
+        db.add(existing)
+        db.commit()
+        db.refresh(existing)
+        return existing
+
+    job = Job(kind=kind, target_id=target_id, max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    logger.info("Queued %s job %s for %s", kind, job.id, target_id)
+    return job
+
+
+def _claimable(now: datetime):
+    return or_(
+        and_(Job.status == JobStatus.QUEUED, Job.run_after <= now),
+        and_(Job.status == JobStatus.RUNNING, Job.lease_expires_at < now),
+    )
+
+
+def claim(db: Session, worker_id: str, lease_seconds: Optional[int] = None) -> Optional[Job]:
+    """
+    Take the next due job, or one whose lease expired, and lease it to `worker_id`.
+    The UPDATE re-checks the claim condition, so two workers can never take the same job.
+    """
+    lease = timedelta(seconds=lease_seconds or settings.JOB_LEASE_SECONDS)
+    while True:
+        now = datetime.now()
+        job_id = db.exec(
+            select(Job.id).where(_claimable(now)).order_by(Job.run_after, Job.id).limit(1)
+        ).first()
+        if job_id is None:
+            return None
+
+        result = db.execute(
+            update(Job)
+            .where(Job.id == job_id, _claimable(now))
+            .values(
+                status=JobStatus.RUNNING,
+                lease_owner=worker_id,
+                lease_expires_at=now + lease,
+                heartbeat_at=now,
+                attempts=Job.attempts + 1,
+                updated_at=now,
+            )
+        )
+        db.commit()
+        if result.rowcount != 1:
+            continue  # Another worker got there first
+
+        job = db.get(Job, job_id)
+        db.refresh(job)
+        if job.attempts > job.max_attempts:
+            # Only reachable through expired leases: the job keeps killing its workers
+            _finish(db, job, JobStatus.FAILED, job.last_error or "Worker lost the job too many times")
+            logger.error("Job %s abandoned after %s lost leases", job.id, job.attempts - 1)
+            continue
+        return job
+
+
+def heartbeat(db: Session, job_id: int, worker_id: str, lease_seconds: Optional[int] = None) -> bool:
+    """Extend the lease; False means the job is no longer ours (expired and reclaimed)."""
+    now = datetime.now()
+    result = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.lease_owner == worker_id, Job.status == JobStatus.RUNNING)
+        .values(
+            heartbeat_at=now,
+            lease_expires_at=now + timedelta(seconds=lease_seconds or settings.JOB_LEASE_SECONDS),
+        )
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def complete(db: Session, job_id: int, worker_id: str):
+    job = db.get(Job, job_id)
+    if job and job.lease_owner == worker_id:
+        _finish(db, job, JobStatus.SUCCEEDED, None)
+
+
+def fail(db: Session, job_id: int, worker_id: str, error: str) -> Optional[Job]:
+    """Record a failed attempt: requeue with backoff, or mark the job failed once out of attempts."""
+    job = db.get(Job, job_id)
+    if not job or job.lease_owner != worker_id:
+        return None
+    if job.attempts >= job.max_attempts:
+        _finish(db, job, JobStatus.FAILED, error)
+        return job
+
+    delay = retry_delay(job.attempts)
+    job.status = JobStatus.QUEUED
+    job.last_error = error
+    job.run_after = datetime.now() + timedelta(seconds=delay)
+    job.lease_owner = None
+    job.lease_expires_at = None
+    job.updated_at = datetime.now()
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    logger.warning("Job %s attempt %s failed, retrying in %.0fs: %s", job.id, job.attempts, delay, error)
+    return job
+
+
+def retry(db: Session, job_id: int) -> Optional[Job]:
+    """Put a failed job back in the queue with a fresh set of attempts."""
+    job = db.get(Job, job_id)
+    if not job:
+        return None
+    if job.status != JobStatus.FAILED:
+        raise ValueError(f"Job {job_id} is {job.status.value}, only failed jobs can be retried")
+    job.status = JobStatus.QUEUED
+    job.attempts = 0
+    job.run_after = datetime.now()
+    job.finished_at = None
+    job.updated_at = datetime.now()
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def _finish(db: Session, job: Job, status: JobStatus, error: Optional[str]):
+    job.status = status
+    job.last_error = error
+    job.finished_at = datetime.now()
+    job.updated_at = job.finished_at
+    job.lease_owner = None
+    job.lease_expires_at = None
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+
+def report_stage(stage: str, details: Optional[Dict[str, Any]] = None):
+    """
+    Record the stage the current job's pipeline has reached, with optional details
+    (e.g. upload timings) kept in the stage history. Does nothing outside a worker.
+    """
+    job_id = _current_job.get()
+    if job_id is None:
+        return
+    try:
+        with Session(engine) as db:
+            job = db.get(Job, job_id)
+            if not job:
+                return
+            history: List[Any] = json.loads(job.stage_history or "[]")
+            entry = {"stage": stage, "attempt": job.attempts, "at": datetime.now().isoformat()}
+            if details:
+                entry["details"] = details
+            history.append(entry)
+            job.stage = stage
+            job.stage_history = json.dumps(history)
+            job.updated_at = datetime.now()
+            db.add(job)
+            db.commit()
+    except Exception as e:
+        # Stage reporting must never fail the pipeline itself
+        logger.warning("Could not record stage %s for job %s: %s", stage, job_id, e)
+
+
+def stage_history(job: Job) -> List[Any]:
+    try:
+        return json.loads(job.stage_history or "[]")
+    except json.JSONDecodeError:
+        return []
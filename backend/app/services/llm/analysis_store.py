@@ -0,0 +1,78 @@
+"""
+Persisted raw analysis responses.
+
+Every session analysis response is stored before it is saved, together with what
+produced it: the hashes of the audio or transcript inputs, the prompt hash, the model
+and the response schema version. A "replay" regeneration then re-runs only the
+save stage from the stored text, e.g. after a save failure or a change to persona matching.
+"""
+import hashlib
+import json
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from sqlmodel import Session, select
+
+from ...models.models import AnalysisRun
+from .schemas import SessionAnalysisSchema
+from .utils import clean_and_parse_json
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def schema_version() -> str:
+    """Short hash of SessionAnalysisSchema's JSON schema; changes whenever the schema does."""
+    schema = json.dumps(SessionAnalysisSchema.model_json_schema(), sort_keys=True)
+    return sha256_text(schema)[:12]
+
+
+def record_run(db_engine, session_id: int, source: str, model: str, prompt: str, input_hashes: List[str], response_text: str) -> int:
+    with Session(db_engine) as db:
+        run = AnalysisRun(
+            session_id=session_id,
+            source=source,
+            model=model,
+            schema_version=schema_version(),
+            prompt_hash=sha256_text(prompt),
+            input_hashes=json.dumps(input_hashes),
+            response_text=response_text,
+        )
+        db.add(run)
+        db.commit()
+        db.refresh(run)
+        return run.id
+
+
+def mark_saved(db: Session, run_id: int):
+    run = db.get(AnalysisRun, run_id)
+    if run:
+        run.saved_at = datetime.now()
+        db.add(run)
+        db.commit()
+
+
+def latest_run(db: Session, session_id: int) -> Optional[AnalysisRun]:
+    return db.exec(
+        select(AnalysisRun).where(AnalysisRun.session_id == session_id).order_by(AnalysisRun.id.desc())
+    ).first()
+
+
+def parse_response(text: str) -> Dict[str, Any]:
+    """Parse a stored response the way the SDK would have, falling back to the lenient JSON cleanup."""
+    data = clean_and_parse_json(text)
+    try:
+        return SessionAnalysisSchema.model_validate(data).model_dump()
+    except ValueError:
+        return data
+
+
+def run_view(run: AnalysisRun) -> Dict[str, Any]:
+    view = run.model_dump(exclude={"response_text", "input_hashes"})
+    view["input_hashes"] = json.loads(run.input_hashes or "[]")
+    view["response_chars"] = len(run.response_text)
+    view["current_schema"] = run.schema_version == schema_version()
+    return view
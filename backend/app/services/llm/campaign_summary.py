@@ -0,0 +1,247 @@
+"""
+Incremental campaign summaries.
+
+Writing the campaign summary from every session's full summary and highlights makes the
+prompt, and the latency, grow with the campaign. Instead:
+  - each session is condensed once into a short digest (SessionDigest), keyed by the hash
+    of the material it was made from, so it is only redone when that session changes
+  - the campaign keeps the structured story so far (Campaign.summary_state) and which
+    sessions, at which hash, were folded into it (Campaign.summary_sessions)
+  - a run folds only the sessions added since into the story, at most
+    GEMINI_CAMPAIGN_FOLD_BATCH digests per call, and the story is kept under
+    GEMINI_CAMPAIGN_STORY_WORDS words, so no call's prompt grows with the campaign
+A story can't take back what was folded into it: if an already folded session changed or
+was deleted, the story is rebuilt from the stored digests (only the changed sessions get
+new ones).
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.genai import types
+from sqlmodel import Session, select
+
+from ...core.config import settings
+from ...models.models import Campaign, Persona, SessionDigest, Session as DBSessionEntry
+from ..jobs import report_stage
+from .analysis_store import sha256_text
+from .model_health import generate_with_fallback
+from .prompts import SESSION_DIGEST_PROMPT, CAMPAIGN_SUMMARY_PROMPT
+from .schemas import CampaignSummarySchema, SessionDigestSchema
+from .utils import clean_and_parse_json
+
+logger = logging.getLogger(__name__)
+
+# Persona arcs are clipped so the cast list doesn't grow the prompt without bound either
+PERSONA_ARC_CHARS = 400
+
+
+def session_material(session: DBSessionEntry) -> str:
+    """What a session contributes to the campaign summary: its summary, highlights and low points."""
+    material = f"--- Session: {session.name} ---\n"
+    if session.summary:
+        material += f"Summary: {session.summary}\n"
+    highs = [h.text for h in session.highlights if h.type == 'high']
+    if highs:
+        material += "Highlights:\n" + "\n".join(['- ' + t for t in highs]) + "\n"
+    lows = [h.text for h in session.highlights if h.type == 'low']
+    if lows:
+        material += "Low Points:\n" + "\n".join(['- ' + t for t in lows]) + "\n"
+    return material
+
+
+def plan_fold(current: List[Tuple[int, str]], folded: List[Any], has_state: bool) -> Tuple[bool, List[Tuple[int, str]]]:
+    """
+    (rebuild, sessions to fold) for the campaign's [(session id, source hash)] in order, given
+    those already folded into the stored story. New sessions are appended; anything else rebuilds.
+    """
+    folded = [tuple(entry) for entry in folded]
+    if has_state and current[:len(folded)] == folded:
+        return False, current[len(folded):]
+    return True, current
+
+
+def render_markdown(data: Dict[str, Any]) -> str:
+    md_output = f"# The Story So Far\n{data.get('summary', '')}\n\n"
+
+    if data.get('key_events'):
+        md_output += "## Key Events\n" + "\n".join([f"- {e}" for e in data['key_events']]) + "\n\n"
+
+    if data.get('ongoing_conflicts'):
+        md_output += "## Ongoing Conflicts\n" + "\n".join([f"- {c}" for c in data['ongoing_conflicts']]) + "\n\n"
+
+    if data.get('pc_highlights'):
+        md_output += "## PC Highlights\n"
+        for h in data['pc_highlights']:
+            md_output += f"- **{h.get('name')}**: {h.get('highlight')}\n"
+        md_output += "\n"
+
+    if data.get('mvp'):
+        mvp = data['mvp']
+        md_output += f"## MVP: {mvp.get('name')}\n{mvp.get('reason')}\n"
+    return md_output
+
+
+def _parse(response, model: str) -> Dict[str, Any]:
+    if response.parsed:
+        return response.parsed.model_dump()
+    return clean_and_parse_json(response.text)
+
+
+def _persona_context(personas: List[Persona]) -> str:
+    persona_context = "DRAMATIS PERSONAE:\n"
+    for p in personas:
+        persona_context += f"- {p.name} ({p.role}): {p.description or 'No desc'}"
+        if p.summary:
+            arc = p.summary if len(p.summary) <= PERSONA_ARC_CHARS else p.summary[:PERSONA_ARC_CHARS].rsplit(" ", 1)[0] + "..."
+            persona_context += f" [Arc: {arc}]"
+        persona_context += "\n"
+    return persona_context
+
+
+async def _digest(db_engine, session_id: int, material: str, source_hash: str, semaphore: asyncio.Semaphore) -> str:
+    """Generate and store one session's digest; stored right away so a failed run keeps the others."""
+    async with semaphore:
+        model, _, data = await generate_with_fallback(
+            settings.GEMINI_SUMMARY_MODELS,
+            contents=[SESSION_DIGEST_PROMPT.format(words=settings.GEMINI_SESSION_DIGEST_WORDS, material=material)],
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=SessionDigestSchema
+            ),
+            parse=lambda response, model: _parse(response, model)["digest"].strip(),
+            operation="digest",
+            session_id=session_id,
+            db_engine=db_engine,
+        )
+    with Session(db_engine) as db:
+        row = db.exec(select(SessionDigest).where(SessionDigest.session_id == session_id)).first() or SessionDigest(session_id=session_id)
+        row.source_hash = source_hash
+        row.digest = data
+        row.model = model
+        row.created_at = datetime.now()
+        db.add(row)
+        db.commit()
+    return data
+
+
+async def ensure_digests(db_engine, pending: List[Tuple[int, str]], material: Dict[int, str]) -> Dict[int, str]:
+    """{session id: digest} for the pending (session id, source hash) pairs, generating the missing or stale ones."""
+    ids = [session_id for session_id, _ in pending]
+    with Session(db_engine) as db:
+        stored = {row.session_id: row for row in db.exec(select(SessionDigest).where(SessionDigest.session_id.in_(ids))).all()}
+    digests = {
+        session_id: stored[session_id].digest
+        for session_id, source_hash in pending
+        if session_id in stored and stored[session_id].source_hash == source_hash
+    }
+    missing = [(session_id, source_hash) for session_id, source_hash in pending if session_id not in digests]
+    if missing:
+        report_stage("digesting", {"sessions": len(missing)})
+        print(f"Digesting {len(missing)} session(s) for the campaign summary ({len(digests)} reused)")
+        semaphore = asyncio.Semaphore(max(1, settings.GEMINI_DIGEST_CONCURRENCY))
+        results = await asyncio.gather(*(
+            _digest(db_engine, session_id, material[session_id], source_hash, semaphore)
+            for session_id, source_hash in missing
+        ))
+        digests.update(zip([session_id for session_id, _ in missing], results))
+    return digests
+
+
+async def _fold(db_engine, campaign_id: int, state: Optional[Dict[str, Any]], batch: List[Tuple[str, str]], persona_context: str) -> Dict[str, Any]:
+    """The story so far with the digests of `batch` [(session name, digest)] folded in."""
+    story_context = ""
+    if state:
+        story_context = (
+            "\nTHE STORY SO FAR (your previous summary, covering every session before the ones below). "
+            "Update it with the new sessions, keeping what still matters:\n"
+            + json.dumps(state, ensure_ascii=False) + "\n"
+        )
+    session_context = "NEW SESSIONS (Chronological digests):\n" + "".join(f"\n--- Session: {name} ---\n{digest}\n" for name, digest in batch)
+    prompt = CAMPAIGN_SUMMARY_PROMPT.format(
+        story_context=story_context,
+        session_context=session_context,
+        persona_context=persona_context,
+        words=settings.GEMINI_CAMPAIGN_STORY_WORDS,
+        max_items=settings.GEMINI_CAMPAIGN_MAX_ITEMS,
+    )
+    _, _, data = await generate_with_fallback(
+        settings.GEMINI_SUMMARY_MODELS, # Fast model is fine for text summarization
+        contents=[prompt],
+        config=types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=CampaignSummarySchema
+        ),
+        parse=_parse,
+        operation="campaign_summary",
+        campaign_id=campaign_id,
+        db_engine=db_engine,
+    )
+    return data
+
+
+def _save(db_engine, campaign_id: int, state: Dict[str, Any], folded: List[Tuple[int, str]]):
+    with Session(db_engine) as db:
+        campaign = db.get(Campaign, campaign_id)
+        if not campaign:
+            return
+        campaign.summary_state = json.dumps(state)
+        campaign.summary_sessions = json.dumps([list(entry) for entry in folded])
+        campaign.description = state.get('tagline', '')
+        campaign.summary = render_markdown(state)
+        db.add(campaign)
+        db.commit()
+
+
+async def update_campaign_summary(campaign_id: int, db_engine) -> bool:
+    """
+    Fold the sessions added since the last run into the campaign's story and save it.
+    Returns False if the campaign doesn't exist or has no sessions to summarize.
+    """
+    with Session(db_engine) as db:
+        campaign = db.get(Campaign, campaign_id)
+        if not campaign:
+            print(f"Campaign {campaign_id} not found")
+            return False
+
+        sessions = db.exec(select(DBSessionEntry).where(DBSessionEntry.campaign_id == campaign_id).order_by(DBSessionEntry.created_at, DBSessionEntry.id)).all()
+        material = {s.id: session_material(s) for s in sessions if s.summary or s.highlights}
+        names = {s.id: s.name for s in sessions}
+        personas = db.exec(select(Persona).where(Persona.campaign_id == campaign_id)).all()
+        persona_context = _persona_context(personas)
+        state = json.loads(campaign.summary_state) if campaign.summary_state else None
+        folded = json.loads(campaign.summary_sessions or "[]")
+
+    if not material:
+        print("No sessions found for campaign summary.")
+        return False
+
+    current = [(session_id, sha256_text(text)) for session_id, text in material.items()]
+    rebuild, pending = plan_fold(current, folded, state is not None)
+    if rebuild:
+        if state is not None:
+            print(f"Sessions of campaign {campaign_id} changed since the last summary: rebuilding it from digests")
+        state, folded = None, []
+    else:
+        folded = [tuple(entry) for entry in folded]
+    if not pending:
+        print(f"Campaign {campaign_id} summary is up to date")
+        _save(db_engine, campaign_id, state, folded)
+        return True
+
+    digests = await ensure_digests(db_engine, pending, material)
+
+    batch_size = max(1, settings.GEMINI_CAMPAIGN_FOLD_BATCH)
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        report_stage("generating", {"sessions": len(batch), "folded": len(folded)})
+        print(f"Folding {len(batch)} session(s) into the story of campaign {campaign_id} ({len(folded)} already in it)")
+        state = await _fold(db_engine, campaign_id, state, [(names[session_id], digests[session_id]) for session_id, _ in batch], persona_context)
+        folded = folded + batch
+        # Saved per batch, so a failed run resumes from here
+        report_stage("saving")
+        _save(db_engine, campaign_id, state, folded)
+    logger.info("Campaign %s summary updated: %d session(s) folded in", campaign_id, len(pending))
+    return True
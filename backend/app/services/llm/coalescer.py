@@ -0,0 +1,122 @@
+"""
+Single-flight request coalescing.
+Identical concurrent requests join one in-flight run instead of each starting their own;
+the run's events are buffered and fanned out to every subscriber (late joiners replay from the start).
+When the last subscriber goes away before the run finishes, the run is cancelled.
+"""
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+Event = Tuple[str, Any]
+
+
+class Flight:
+    """One in-flight run and the events it has produced so far."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.events: List[Event] = []
+        self.done = False
+        self.subscribers = 0
+        self.task: asyncio.Task = None
+        self._new_data = asyncio.Event()
+
+    def publish(self, event: Event):
+        self.events.append(event)
+        self._wake()
+
+    def finish(self):
+        self.done = True
+        self._wake()
+
+    def unsubscribe(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            # Nobody is listening anymore; stop the work (e.g. abort the Ollama generation)
+            logger.info(f"Cancelling in-flight run {self.key}: all subscribers left")
+            self.task.cancel()
+
+    def _wake(self):
+        waiter, self._new_data = self._new_data, asyncio.Event()
+        waiter.set()
+
+
+class Subscription:
+    """
+    Async iterator over every event of a flight, from the first one, until it finishes.
+    Holds one subscriber reference from creation until it is exhausted or closed;
+    `close()` is idempotent and safe to call even if iteration never started.
+    """
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+        self.closed = False
+        self._idx = 0
+        flight.subscribers += 1
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Event:
+        flight = self.flight
+        try:
+            while not self.closed:
+                if self._idx < len(flight.events):
+                    event = flight.events[self._idx]
+                    self._idx += 1
+                    return event
+                if flight.done:
+                    break
+                waiter = flight._new_data
+                await waiter.wait()
+        except asyncio.CancelledError:
+            self.close()
+            raise
+        self.close()
+        raise StopAsyncIteration
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flight.unsubscribe()
+
+    async def aclose(self):
+        self.close()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def join(self, key: str, run: Callable[[], AsyncIterator[Event]]) -> Subscription:
+        """
+        Subscribe to the flight for `key`, starting `run()` as its leader if none is in progress.
+        Callers must exhaust or close the returned subscription so the subscriber count is released.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            logger.debug("Coalesced request onto in-flight run %s", key)
+        else:
+            flight = Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._drive(flight, run))
+
+        return Subscription(flight)
+
+    async def _drive(self, flight: Flight, run: Callable[[], AsyncIterator[Event]]):
+        try:
+            async for event in run():
+                flight.publish(event)
+        except Exception as e:
+            logger.error(f"In-flight run {flight.key} failed: {e}")
+            flight.publish(("error", {"status": 500, "detail": str(e)}))
+        finally:
+            # New identical requests after this point start a fresh run
+            self._flights.pop(flight.key, None)
+            flight.finish()
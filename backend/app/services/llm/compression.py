@@ -0,0 +1,133 @@
+"""
+Prompt compression for retrieved chunks.
+The index stores each moment, highlight, quote and summary as its own chunk, so the same
+sentence often comes back three times, each with a "Highlight in Session X:" style prefix.
+Before prompt assembly we:
+  1. drop chunks that are near-duplicates of a higher-ranked one (word-shingle Jaccard),
+  2. strip the per-chunk boilerplate prefix and group chunks under their session or source,
+  3. drop sentences already stated earlier in the context.
+"""
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from ...models.models import VectorStore
+
+SHINGLE_SIZE = 3
+# Chunks at least this similar to a kept chunk are dropped
+NEAR_DUPLICATE_JACCARD = 0.8
+# Rough prompt-size estimate, matching how the rest of the code reasons about Ollama's context
+CHARS_PER_TOKEN = 4
+
+# Prefixes written by VectorService.reindex_campaign: (pattern, group title, body format)
+CHUNK_PREFIXES: List[Tuple[re.Pattern, str, str]] = [
+    (re.compile(r"^Session (?P<session>.+?) Summary: (?P<body>.*)$", re.S), "{session}", "{body}"),
+    (re.compile(r"^Moment in (?P<session>.+?): (?P<body>.*)$", re.S), "{session}", "{body}"),
+    (re.compile(r"^Highlight in (?P<session>.+?): (?P<body>.*)$", re.S), "{session}", "{body}"),
+    (re.compile(r"^Quote in (?P<session>.+?) by (?P<speaker>.+?): (?P<body>.*)$", re.S), "{session}", '{speaker}: "{body}"'),
+]
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"\w+")
+
+
+class CompressionStats:
+    def __init__(self, chunks_in: int = 0):
+        self.chunks_in = chunks_in
+        self.chunks_kept = 0
+        self.near_duplicates = 0
+        self.sentences_dropped = 0
+        self.chars_before = 0
+        self.chars_after = 0
+
+    @property
+    def tokens_saved_estimate(self) -> int:
+        return max(0, self.chars_before - self.chars_after) // CHARS_PER_TOKEN
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "context_chunks": self.chunks_in,
+            "context_chunks_kept": self.chunks_kept,
+            "context_near_duplicates": self.near_duplicates,
+            "context_sentences_dropped": self.sentences_dropped,
+            "context_chars_raw": self.chars_before,
+            "context_chars_compressed": self.chars_after,
+            "context_tokens_saved_est": self.tokens_saved_estimate,
+        }
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[Tuple[str, ...]]:
+    words = _WORD.findall(text.casefold())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a: Set, b: Set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def split_chunk(chunk: VectorStore) -> Tuple[str, Optional[str], str]:
+    """(group key, group title, body) for a chunk, with its boilerplate prefix removed."""
+    text = chunk.text_content.strip()
+    for pattern, title, body in CHUNK_PREFIXES:
+        match = pattern.match(text)
+        if match:
+            parts = match.groupdict()
+            return f"session:{parts['session']}", title.format(**parts), body.format(**parts).strip()
+    # Personas and anything unrecognised: merge repeated chunks of the same source
+    return f"{chunk.source_type}:{chunk.source_id}", None, text
+
+
+def compress_chunks(chunks: List[VectorStore]) -> Tuple[List[str], List[str], CompressionStats]:
+    """
+    Compress ranked chunks into context blocks.
+    Returns (blocks, sources of the chunks that were kept, stats); chunks keep their rank order,
+    with each group placed where its best-ranked chunk was.
+    """
+    stats = CompressionStats(chunks_in=len(chunks))
+    stats.chars_before = sum(len(f"---\n{c.text_content}") + 1 for c in chunks)
+
+    kept_shingles: List[Set] = []
+    seen_sentences: Set[str] = set()
+    # group key -> (title, lines); dicts keep first-seen (i.e. rank) order
+    groups: Dict[str, Tuple[Optional[str], List[str]]] = {}
+    sources: List[str] = []
+
+    for chunk in chunks:
+        key, title, body = split_chunk(chunk)
+
+        chunk_shingles = shingles(body)
+        if any(jaccard(chunk_shingles, other) >= NEAR_DUPLICATE_JACCARD for other in kept_shingles):
+            stats.near_duplicates += 1
+            continue
+
+        sentences = []
+        for sentence in _SENTENCE_SPLIT.split(body):
+            normalized = " ".join(_WORD.findall(sentence.casefold()))
+            if not normalized:
+                continue
+            if normalized in seen_sentences:
+                stats.sentences_dropped += 1
+                continue
+            seen_sentences.add(normalized)
+            sentences.append(sentence.strip())
+        if not sentences:
+            stats.near_duplicates += 1
+            continue
+
+        kept_shingles.append(chunk_shingles)
+        stats.chunks_kept += 1
+        groups.setdefault(key, (title, []))[1].append(" ".join(sentences))
+        sources.append(f"{chunk.source_type}:{chunk.source_id}")
+
+    blocks = []
+    for title, lines in groups.values():
+        if title is None:
+            blocks.append("\n".join(lines))
+        else:
+            blocks.append(f"{title}:\n" + "\n".join(f"- {line}" for line in lines))
+
+    stats.chars_after = sum(len(f"---\n{b}") + 1 for b in blocks)
+    return blocks, sources, stats
@@ -0,0 +1,109 @@
+"""
+Server-side conversation state for the librarian chat agent.
+Keeps the full transcript in the DB and folds older turns into a rolling summary,
+so both request size and prompt size stay bounded for long conversations.
+"""
+import logging
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+
+from sqlmodel import Session, select, func
+
+from ...core.config import settings
+from ...models.models import Conversation, ConversationMessage
+from .ollama_client import summarize_conversation
+
+logger = logging.getLogger(__name__)
+
+# Conversations currently being compacted in this process (avoid double summarization)
+_compacting: set = set()
+
+
+class ConversationService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create(self, campaign_id: int) -> Conversation:
+        conversation = Conversation(campaign_id=campaign_id)
+        self.db.add(conversation)
+        self.db.commit()
+        self.db.refresh(conversation)
+        return conversation
+
+    def get(self, conversation_id: int) -> Optional[Conversation]:
+        return self.db.get(Conversation, conversation_id)
+
+    def add_messages(self, conversation: Conversation, messages: List[Dict[str, str]]):
+        """Append messages (dicts with 'role' and 'content') to the conversation."""
+        for m in messages:
+            self.db.add(ConversationMessage(
+                conversation_id=conversation.id,
+                role=m["role"],
+                content=m["content"]
+            ))
+        conversation.updated_at = datetime.now()
+        self.db.add(conversation)
+        self.db.commit()
+        self.db.refresh(conversation)
+
+    def get_messages(self, conversation: Conversation, offset: int = 0, limit: Optional[int] = None) -> List[ConversationMessage]:
+        return self.db.exec(
+            select(ConversationMessage)
+            .where(ConversationMessage.conversation_id == conversation.id)
+            .order_by(ConversationMessage.id)
+            .offset(offset)
+            .limit(limit)
+        ).all()
+
+    def count_messages(self, conversation: Conversation) -> int:
+        return self.db.exec(
+            select(func.count(ConversationMessage.id)).where(ConversationMessage.conversation_id == conversation.id)
+        ).one()
+
+    def build_history(self, conversation: Conversation) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Return (summary, messages not folded into it yet) for prompting.
+        Every earlier message is either in the summary or sent verbatim; compaction keeps the
+        verbatim part to about CHAT_COMPACTION_THRESHOLD messages.
+        """
+        recent = self.get_messages(conversation, offset=conversation.compacted_count)
+        return conversation.summary or "", [{"role": m.role, "content": m.content} for m in recent]
+
+    def needs_compaction(self, conversation: Conversation) -> bool:
+        return self.count_messages(conversation) - conversation.compacted_count > settings.CHAT_COMPACTION_THRESHOLD
+
+
+def compact_conversation(conversation_id: int, db_engine):
+    """
+    Fold every message older than the history window into the rolling summary.
+    Runs as a background task after a chat turn.
+    """
+    if conversation_id in _compacting:
+        return
+    _compacting.add(conversation_id)
+
+    try:
+        with Session(db_engine) as db:
+            service = ConversationService(db)
+            conversation = service.get(conversation_id)
+            if not conversation:
+                return
+
+            fold_until = service.count_messages(conversation) - settings.CHAT_HISTORY_WINDOW
+            if fold_until <= conversation.compacted_count:
+                return
+
+            messages = service.get_messages(conversation, offset=conversation.compacted_count, limit=fold_until - conversation.compacted_count)
+            to_fold = [{"role": m.role, "content": m.content} for m in messages]
+            summary = summarize_conversation(conversation.summary or "", to_fold)
+
+            conversation.summary = summary
+            conversation.compacted_count = fold_until
+            db.add(conversation)
+            db.commit()
+            logger.info(f"Compacted conversation {conversation_id}: {len(to_fold)} messages folded")
+    except Exception as e:
+        # Compaction is best effort; the next turn tries again, meanwhile the messages are sent verbatim
+        logger.error(f"Failed to compact conversation {conversation_id}: {e}")
+    finally:
+        _compacting.discard(conversation_id)
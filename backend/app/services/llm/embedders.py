@@ -0,0 +1,180 @@
+"""
+Pluggable text embedders for the vector index.
+
+  ollama   - the Ollama embedding endpoint (settings.OLLAMA_MODEL); best quality, needs the model server
+  hashing  - built-in hashed n-gram TF-IDF with a fixed random projection; pure NumPy, no model,
+             microseconds per text. Used per campaign by choice, and with EMBEDDING_FALLBACK as
+             a second index so search keeps working while Ollama is down or busy. Its
+             similarities run on a different scale, so model routing doesn't trust them
+             (see model_router.fast_min_score).
+
+The hashing embedder stores documents as log-TF vectors and weights queries by IDF at
+search time (lnc.ltc), so adding chunks never invalidates stored embeddings; only the
+per-campaign document-frequency table, which is rebuilt lazily, changes.
+"""
+import logging
+import re
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from ...core.config import settings
+from ...core.database import engine
+from ...models.models import VectorStore
+from .ollama_client import get_ollama_client
+
+logger = logging.getLogger(__name__)
+
+OLLAMA = "ollama"
+HASHING = "hashing"
+
+_WORD = re.compile(r"\w+")
+
+
+class Embedder(ABC):
+    name: str = ""
+
+    @abstractmethod
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        ...
+
+    def embed_queries(self, texts: List[str], campaign_id: Optional[int] = None, db: Optional[Session] = None) -> List[List[float]]:
+        """Queries default to the document embedding; embedders with corpus statistics override this."""
+        return self.embed_documents(texts)
+
+
+class OllamaEmbedder(Embedder):
+    name = OLLAMA
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        client = get_ollama_client()
+        if len(texts) == 1:
+            return [client.embeddings(model=settings.OLLAMA_MODEL, prompt=texts[0])['embedding']]
+        return client.embed(model=settings.OLLAMA_MODEL, input=texts)['embeddings']
+
+
+class HashingEmbedder(Embedder):
+    """
+    Hashed word unigrams, word bigrams and character 3/4-grams, sublinear TF,
+    projected from FEATURE_BUCKETS to `dim` dimensions by a fixed seeded ±1 matrix.
+    """
+    name = HASHING
+    FEATURE_BUCKETS = 2 ** 14
+
+    def __init__(self, dim: int = 256, seed: int = 13):
+        self.dim = dim
+        self.seed = seed
+        self._projection: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    @property
+    def projection(self) -> np.ndarray:
+        if self._projection is None:
+            with self._lock:
+                if self._projection is None:
+                    rng = np.random.default_rng(self.seed)
+                    # int8 keeps the matrix at 4 MB; rows are cast when used
+                    self._projection = rng.choice(np.array([-1, 1], dtype=np.int8), size=(self.FEATURE_BUCKETS, self.dim))
+        return self._projection
+
+    def features(self, text: str) -> np.ndarray:
+        """Bucket index of every feature occurrence in `text`."""
+        words = _WORD.findall(text.casefold())
+        feats = [f"w:{w}" for w in words]
+        feats += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        for w in words:
+            padded = f"<{w}>"
+            for n in (3, 4):
+                feats += [f"c:{padded[i:i + n]}" for i in range(len(padded) - n + 1)]
+        return np.fromiter((zlib.crc32(f.encode("utf-8")) % self.FEATURE_BUCKETS for f in feats), dtype=np.int64, count=len(feats))
+
+    def term_weights(self, text: str):
+        """(bucket ids, 1 + log(tf)) for the buckets present in `text`."""
+        buckets, counts = np.unique(self.features(text), return_counts=True)
+        return buckets, 1.0 + np.log(counts)
+
+    def _project(self, buckets: np.ndarray, weights: np.ndarray) -> List[float]:
+        if len(buckets) == 0:
+            return [0.0] * self.dim
+        vec = weights.astype(np.float32) @ self.projection[buckets].astype(np.float32)
+        norm = float(np.linalg.norm(vec))
+        return (vec / norm).tolist() if norm else vec.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._project(*self.term_weights(t)) for t in texts]
+
+    def embed_queries(self, texts: List[str], campaign_id: Optional[int] = None, db: Optional[Session] = None) -> List[List[float]]:
+        idf = hashing_stats.idf(campaign_id, db) if campaign_id is not None else None
+        vectors = []
+        for text in texts:
+            buckets, weights = self.term_weights(text)
+            if idf is not None:
+                weights = weights * idf[buckets]
+            vectors.append(self._project(buckets, weights))
+        return vectors
+
+
+class HashingStats:
+    """Per-campaign document frequencies over the hashing embedder's feature buckets."""
+
+    def __init__(self, embedder: HashingEmbedder):
+        self.embedder = embedder
+        self._idf: Dict[int, np.ndarray] = {}
+        self._lock = threading.RLock()
+
+    def idf(self, campaign_id: int, db: Optional[Session] = None) -> np.ndarray:
+        idf = self._idf.get(campaign_id)
+        if idf is not None:
+            return idf
+        with self._lock:
+            if campaign_id not in self._idf:
+                if db is not None:
+                    self._idf[campaign_id] = self._build(campaign_id, db)
+                else:
+                    with Session(engine) as own_db:
+                        self._idf[campaign_id] = self._build(campaign_id, own_db)
+            return self._idf[campaign_id]
+
+    def invalidate(self, campaign_id: int):
+        with self._lock:
+            self._idf.pop(campaign_id, None)
+
+    def _build(self, campaign_id: int, db: Session) -> np.ndarray:
+        texts = db.exec(
+            select(VectorStore.text_content)
+            .where(VectorStore.campaign_id == campaign_id)
+            .where(VectorStore.embedder == HASHING)
+        ).all()
+        df = np.zeros(self.embedder.FEATURE_BUCKETS, dtype=np.float32)
+        for text in texts:
+            df[np.unique(self.embedder.features(text))] += 1
+        return (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+
+EMBEDDERS: Dict[str, Embedder] = {
+    OLLAMA: OllamaEmbedder(),
+    HASHING: HashingEmbedder(),
+}
+
+hashing_stats = HashingStats(EMBEDDERS[HASHING])
+
+
+def get_embedder(name: str) -> Embedder:
+    try:
+        return EMBEDDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown embedder '{name}'. Available: {', '.join(EMBEDDERS)}")
+
+
+@event.listens_for(VectorStore, "after_insert")
+@event.listens_for(VectorStore, "after_delete")
+def _hashing_chunk_changed(mapper, connection, target):
+    if target.embedder == HASHING:
+        hashing_stats.invalidate(target.campaign_id)
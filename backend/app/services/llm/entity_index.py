@@ -0,0 +1,238 @@
+"""
+In-memory index of persona names and aliases, per campaign.
+Used to spot which characters a librarian question is about without touching the LLM,
+and as an inverted index from each character to the VectorStore chunks that mention them,
+so retrieval can pin and boost those chunks.
+Built lazily from the DB and dropped whenever a persona of the campaign is inserted,
+updated or deleted (SQLAlchemy mapper events), so it never serves stale names.
+Chunk postings are kept current as VectorStore rows are inserted and deleted, once the
+transaction commits; a rollback drops the campaign instead, as SQLite reuses the ids.
+"""
+import json
+import logging
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SASession, object_session
+from sqlmodel import Session, select
+
+from ...core.database import engine
+from ...models.models import Persona, VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Longest name (in words) we try to match
+MAX_NAME_TOKENS = 5
+# Words too common to identify a character on their own (e.g. the "The" of "The Dragon")
+NAME_STOPWORDS = {"the", "a", "an", "of", "and", "sir", "lady", "lord", "mr", "mrs", "old", "young", "big", "little"}
+
+
+def normalize(text: str) -> str:
+    """Casefold and turn punctuation into spaces, so "Vex'ahlia's" and "vex ahlia s" compare equal."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.casefold()).split())
+
+
+class CampaignEntities:
+    """Name/alias lookup table and chunk postings for one campaign."""
+
+    def __init__(self):
+        # normalized name or alias -> persona ids (short first names can be ambiguous)
+        self.names: Dict[str, Set[int]] = {}
+        self.display_names: Dict[int, str] = {}
+        # persona id -> ids of chunks that mention them / of their own profile chunks
+        self.mentions: Dict[int, Set[int]] = {}
+        self.profiles: Dict[int, Set[int]] = {}
+
+    def add_persona(self, persona_id: int, name: str, aliases: List[str]):
+        self.display_names[persona_id] = name
+        for key in [name] + aliases:
+            key = normalize(key)
+            if len(key) >= 3:
+                self.names.setdefault(key, set()).add(persona_id)
+
+    def add_first_names(self):
+        """Let "Grog" find "Grog Strongjaw" when no other character shares that first word."""
+        first_words: Dict[str, Set[int]] = {}
+        for persona_id, name in self.display_names.items():
+            words = normalize(name).split()
+            if len(words) > 1 and len(words[0]) >= 3 and words[0] not in NAME_STOPWORDS:
+                first_words.setdefault(words[0], set()).add(persona_id)
+        for word, ids in first_words.items():
+            if len(ids) == 1 and word not in self.names:
+                self.names[word] = ids
+
+    def add_chunk(self, chunk_id: int, source_type: str, source_id: int, text: str):
+        if source_type == "persona" and source_id in self.display_names:
+            self.profiles.setdefault(source_id, set()).add(chunk_id)
+        for _, _, ids in self.find(text):
+            for persona_id in ids:
+                self.mentions.setdefault(persona_id, set()).add(chunk_id)
+
+    def remove_chunk(self, chunk_id: int):
+        for postings in (self.mentions, self.profiles):
+            for chunk_ids in postings.values():
+                chunk_ids.discard(chunk_id)
+
+    def find(self, text: str) -> List[Tuple[int, int, Set[int]]]:
+        """
+        Greedy longest-match scan of `text`.
+        Returns (start, end, persona_ids) token spans for every name or alias mentioned.
+        """
+        tokens = normalize(text).split()
+        matches = []
+        i = 0
+        while i < len(tokens):
+            for n in range(min(MAX_NAME_TOKENS, len(tokens) - i), 0, -1):
+                ids = self.names.get(" ".join(tokens[i:i + n]))
+                if ids:
+                    matches.append((i, i + n, ids))
+                    i += n
+                    break
+            else:
+                i += 1
+        return matches
+
+
+class EntityIndex:
+    def __init__(self):
+        self._campaigns: Dict[int, CampaignEntities] = {}
+        # Re-entrant: building can autoflush the caller's session, whose events come back here
+        self._lock = threading.RLock()
+
+    def get(self, campaign_id: int, db: Optional[Session] = None) -> CampaignEntities:
+        entities = self._campaigns.get(campaign_id)
+        if entities is not None:
+            return entities
+        with self._lock:
+            entities = self._campaigns.get(campaign_id)
+            if entities is None:
+                if db is not None:
+                    entities = self._build(campaign_id, db)
+                else:
+                    with Session(engine) as own_db:
+                        entities = self._build(campaign_id, own_db)
+                self._campaigns[campaign_id] = entities
+        return entities
+
+    def find_personas(self, campaign_id: int, text: str, db: Optional[Session] = None) -> Set[int]:
+        """Ids of every persona named (by name or alias) in `text`."""
+        found: Set[int] = set()
+        for _, _, ids in self.get(campaign_id, db).find(text):
+            found |= ids
+        return found
+
+    def chunk_targets(self, campaign_id: int, text: str, db: Optional[Session] = None) -> Tuple[Set[int], Set[int]]:
+        """
+        Chunks to favour when retrieving for `text`: (pinned, boosted) chunk ids.
+        Pinned are the profile chunks of every character named; boosted are the other chunks mentioning them.
+        """
+        entities = self.get(campaign_id, db)
+        pinned: Set[int] = set()
+        boosted: Set[int] = set()
+        for _, _, ids in entities.find(text):
+            for persona_id in ids:
+                pinned |= entities.profiles.get(persona_id, set())
+                boosted |= entities.mentions.get(persona_id, set())
+        return pinned, boosted - pinned
+
+    def chunk_added(self, campaign_id: int, chunk_id: int, source_type: str, source_id: int, text: str):
+        with self._lock:
+            entities = self._campaigns.get(campaign_id)
+            if entities is not None:
+                entities.add_chunk(chunk_id, source_type, source_id, text)
+
+    def chunk_removed(self, campaign_id: int, chunk_id: int):
+        with self._lock:
+            entities = self._campaigns.get(campaign_id)
+            if entities is not None:
+                entities.remove_chunk(chunk_id)
+
+    def invalidate(self, campaign_id: Optional[int] = None):
+        with self._lock:
+            if campaign_id is None:
+                self._campaigns.clear()
+            else:
+                self._campaigns.pop(campaign_id, None)
+
+    def _build(self, campaign_id: int, db: Session) -> CampaignEntities:
+        entities = CampaignEntities()
+        personas = db.exec(select(Persona).where(Persona.campaign_id == campaign_id)).all()
+        for p in personas:
+            try:
+                aliases = json.loads(p.aliases) if p.aliases else []
+            except (TypeError, ValueError):
+                aliases = []
+            entities.add_persona(p.id, p.name, [a for a in aliases if isinstance(a, str)])
+        entities.add_first_names()
+
+        chunks = db.exec(
+            select(VectorStore.id, VectorStore.source_type, VectorStore.source_id, VectorStore.text_content)
+            .where(VectorStore.campaign_id == campaign_id)
+        ).all()
+        for chunk_id, source_type, source_id, text in chunks:
+            entities.add_chunk(chunk_id, source_type, source_id, text)
+        logger.debug("Built entity index for campaign %s: %d names, %d chunks", campaign_id, len(entities.names), len(chunks))
+        return entities
+
+
+entity_index = EntityIndex()
+
+
+# --- Invalidation ---
+# Drop the campaign at flush time, and again after commit so a rebuild that raced the
+# commit (reading the old rows) is not kept.
+
+@event.listens_for(Persona, "after_insert")
+@event.listens_for(Persona, "after_update")
+@event.listens_for(Persona, "after_delete")
+def _persona_changed(mapper, connection, target):
+    invalidate_on_commit(object_session(target), target.campaign_id)
+
+
+def invalidate_on_commit(session: Optional[SASession], campaign_id: int):
+    """Drop the campaign now and once more when `session` commits. Bulk statements skip the mapper events and call this instead."""
+    entity_index.invalidate(campaign_id)
+    if session is not None:
+        session.info.setdefault("entity_index_dirty", set()).add(campaign_id)
+
+
+@event.listens_for(SASession, "after_commit")
+def _invalidate_after_commit(session):
+    for campaign_id in session.info.pop("entity_index_dirty", ()):
+        entity_index.invalidate(campaign_id)
+
+
+# --- Chunk postings ---
+# Applied when the session commits. A rolled-back id would otherwise stay in the postings and,
+# reused by SQLite, pin or boost an unrelated chunk. Rolling back drops the campaigns touched,
+# in case the index was rebuilt from the session's flushed rows in the meantime.
+
+def _on_commit(session: Optional[SASession], campaign_id: int, change, *args):
+    if session is None:
+        change(campaign_id, *args)
+        return
+    session.info.setdefault("entity_index_chunks", []).append((change, campaign_id, args))
+
+
+@event.listens_for(VectorStore, "after_insert")
+def _chunk_inserted(mapper, connection, target):
+    _on_commit(object_session(target), target.campaign_id, entity_index.chunk_added, target.id, target.source_type, target.source_id, target.text_content)
+
+
+@event.listens_for(VectorStore, "after_delete")
+def _chunk_deleted(mapper, connection, target):
+    _on_commit(object_session(target), target.campaign_id, entity_index.chunk_removed, target.id)
+
+
+@event.listens_for(SASession, "after_commit")
+def _apply_chunk_changes(session):
+    for change, campaign_id, args in session.info.pop("entity_index_chunks", ()):
+        change(campaign_id, *args)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _discard_chunk_changes(session):
+    for _, campaign_id, _ in session.info.pop("entity_index_chunks", ()):
+        entity_index.invalidate(campaign_id)
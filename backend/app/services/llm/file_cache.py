@@ -0,0 +1,225 @@
+"""
+Registry of audio files uploaded to Gemini, keyed by the content hash of the source file.
+
+Regenerating or re-uploading a session used to transcode and upload the same
+multi-hundred-MB audio again. Now process_session_pipeline looks each source file up
+here first and reuses the remote copy while Gemini still has it ACTIVE, with at least
+GEMINI_FILE_REUSE_MARGIN left before it expires. Only cache misses are prepared and uploaded.
+
+sweep() deletes expired entries and entries whose session no longer exists. With
+GEMINI_FILE_ORPHAN_GRACE set it also deletes remote files this app uploaded (display name
+starting with GEMINI_FILE_DISPLAY_PREFIX) that the registry doesn't know about, e.g. from a
+run that crashed between upload and registration; other files on the key are never
+touched. Pipelines call maybe_sweep() so it runs at most once per
+GEMINI_FILE_SWEEP_INTERVAL.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from ...core.config import settings
+from ...core.database import engine
+from ...models.models import GeminiFile, Session as DBSessionEntry
+from .client import client
+
+logger = logging.getLogger(__name__)
+
+# Gemini keeps uploaded files for 48 hours
+GEMINI_FILE_TTL = timedelta(hours=48)
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+_last_sweep: Optional[float] = None
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _local_time(value: Optional[datetime]) -> Optional[datetime]:
+    """Gemini timestamps are timezone-aware UTC; the database stores naive local times."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+async def hash_files(paths: List[str]) -> Dict[str, str]:
+    """{path: content hash} for every path that exists, in order."""
+    existing = [p for p in paths if os.path.exists(p)]
+    return dict(zip(existing, await asyncio.gather(*(asyncio.to_thread(file_hash, p) for p in existing))))
+
+
+async def lookup(audio_paths: List[str], db_engine=engine) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Hash each existing source file and find remote copies that can be reused.
+    Returns ({path: remote file} for reusable hits, {path: content hash} for every hashed path).
+    """
+    hashes = await hash_files(audio_paths)
+    return await lookup_hashes(hashes, db_engine), hashes
+
+
+async def lookup_hashes(hashes: Dict[str, str], db_engine=engine) -> Dict[str, Any]:
+    """
+    Find reusable remote copies for {key: content hash}. Keys are usually source paths; derived
+    uploads such as recording segments use a hash of their source and cut instead of a file hash.
+    Returns {key: remote file} for the hits.
+    """
+    if not settings.GEMINI_FILE_CACHE or not client or not hashes:
+        return {}
+
+    usable_until = datetime.now() + timedelta(seconds=settings.GEMINI_FILE_REUSE_MARGIN)
+    with Session(db_engine) as db:
+        rows = db.exec(select(GeminiFile).where(GeminiFile.content_hash.in_(set(hashes.values())))).all()
+        candidates = {row.content_hash: row.name for row in rows if row.expires_at > usable_until}
+        stale = [row for row in rows if row.content_hash not in candidates]
+        for row in stale:
+            db.delete(row)
+        db.commit()
+
+    async def check(name: str):
+        try:
+            return await asyncio.to_thread(client.files.get, name=name)
+        except Exception as e:
+            logger.info("Cached Gemini file %s is gone: %s", name, e)
+            return None
+
+    remote = dict(zip(candidates, await asyncio.gather(*(check(name) for name in candidates.values()))))
+    hits = {}
+    dead = []
+    for key, content_hash in hashes.items():
+        g_file = remote.get(content_hash)
+        if g_file is not None and g_file.state == "ACTIVE":
+            hits[key] = g_file
+        elif content_hash in remote:
+            dead.append(content_hash)
+
+    if dead:
+        with Session(db_engine) as db:
+            for row in db.exec(select(GeminiFile).where(GeminiFile.content_hash.in_(dead))).all():
+                db.delete(row)
+            db.commit()
+    if hits:
+        print(f"Reusing {len(hits)} file(s) already on Gemini: {', '.join(f.name for f in hits.values())}")
+    return hits
+
+
+def register(session_id: int, uploads: List[Tuple[str, Any]], db_engine=engine):
+    """Record freshly uploaded files as (content hash, remote file) pairs. A newer upload of the same content replaces the old entry."""
+    if not settings.GEMINI_FILE_CACHE:
+        return
+    replaced = []
+    with Session(db_engine) as db:
+        for content_hash, g_file in uploads:
+            expires_at = _local_time(getattr(g_file, "expiration_time", None)) or datetime.now() + GEMINI_FILE_TTL
+            row = db.exec(select(GeminiFile).where(GeminiFile.content_hash == content_hash)).first()
+            if row is None:
+                row = GeminiFile(content_hash=content_hash, name=g_file.name, uri=g_file.uri, mime_type=g_file.mime_type, expires_at=expires_at)
+            elif row.name != g_file.name:
+                replaced.append(row.name)
+            row.name = g_file.name
+            row.uri = g_file.uri
+            row.mime_type = g_file.mime_type
+            row.size_bytes = getattr(g_file, "size_bytes", None) or 0
+            row.expires_at = expires_at
+            row.session_id = session_id
+            row.last_used_at = datetime.now()
+            db.add(row)
+        db.commit()
+    for name in replaced:
+        _delete_remote(name)
+
+
+def touch(session_id: int, content_hashes: List[str], db_engine=engine):
+    """Mark reused entries as used by `session_id`."""
+    with Session(db_engine) as db:
+        for row in db.exec(select(GeminiFile).where(GeminiFile.content_hash.in_(content_hashes))).all():
+            row.session_id = session_id
+            row.last_used_at = datetime.now()
+            db.add(row)
+        db.commit()
+
+
+def is_cached(name: str, db_engine=engine) -> bool:
+    with Session(db_engine) as db:
+        return db.exec(select(GeminiFile.id).where(GeminiFile.name == name)).first() is not None
+
+
+def _delete_remote(name: str) -> bool:
+    try:
+        client.files.delete(name=name)
+        return True
+    except Exception as e:
+        logger.info("Could not delete Gemini file %s: %s", name, e)
+        return False
+
+
+def sweep(db_engine=engine) -> Dict[str, int]:
+    """Delete expired and orphaned files, both from the registry and from Gemini."""
+    global _last_sweep
+    _last_sweep = time.monotonic()
+    stats = {"expired": 0, "orphaned": 0, "untracked": 0}
+    now = datetime.now()
+
+    with Session(db_engine) as db:
+        rows = db.exec(select(GeminiFile)).all()
+        session_ids = {row.session_id for row in rows if row.session_id is not None}
+        live_sessions = set(db.exec(select(DBSessionEntry.id).where(DBSessionEntry.id.in_(session_ids))).all()) if session_ids else set()
+        known = set()
+        for row in rows:
+            if row.expires_at <= now:
+                stats["expired"] += 1
+            elif row.session_id is not None and row.session_id not in live_sessions:
+                stats["orphaned"] += 1
+                if client:
+                    _delete_remote(row.name)
+            else:
+                known.add(row.name)
+                continue
+            db.delete(row)
+        db.commit()
+
+    if client and settings.GEMINI_FILE_ORPHAN_GRACE > 0:
+        cutoff = now - timedelta(seconds=settings.GEMINI_FILE_ORPHAN_GRACE)
+        try:
+            for g_file in client.files.list():
+                if g_file.name in known or not (getattr(g_file, "display_name", None) or "").startswith(settings.GEMINI_FILE_DISPLAY_PREFIX):
+                    continue
+                created = _local_time(getattr(g_file, "create_time", None))
+                if created is not None and created < cutoff:
+                    if _delete_remote(g_file.name):
+                        stats["untracked"] += 1
+        except Exception as e:
+            logger.warning("Could not list Gemini files: %s", e)
+
+    if any(stats.values()):
+        logger.info("Gemini file sweep: %s", stats)
+    return stats
+
+
+async def maybe_sweep(db_engine=engine):
+    """Run sweep() in a thread if the last one was more than GEMINI_FILE_SWEEP_INTERVAL ago."""
+    if not settings.GEMINI_FILE_CACHE:
+        return
+    if _last_sweep is not None and time.monotonic() - _last_sweep < settings.GEMINI_FILE_SWEEP_INTERVAL:
+        return
+    try:
+        await asyncio.to_thread(sweep, db_engine)
+    except Exception as e:
+        logger.warning("Gemini file sweep failed: %s", e)
+
+
+def registry_view(db_engine=engine) -> List[Dict[str, Any]]:
+    with Session(db_engine) as db:
+        rows = db.exec(select(GeminiFile).order_by(GeminiFile.expires_at)).all()
+        return [row.model_dump() for row in rows]
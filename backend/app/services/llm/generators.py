@@ -1,110 +1,171 @@
 import os
 import asyncio
 import json
-import difflib
-from typing import List, Dict, Any
+import random
+import time
+from typing import List, Dict, Any, Optional, Tuple
 
 from google.genai import types
-from sqlmodel import Session, select, col, delete
+from sqlalchemy import insert
+from sqlmodel import Session, select, delete
 
 # Imports from our new structure
-from ...models.models import Session as DBSessionEntry, Persona, Moment, Highlight, Quote, Campaign
+from ...models.models import Session as DBSessionEntry, Persona, Moment, Highlight, Quote, Campaign, AnalysisRun
 from ...models.enums import ProcessingStatus
 from ...core.config import settings
-from ..audio import prepare_audio_files
+from ..audio import prepare_audio_files, cut_segment
+from ..jobs import report_stage
 from .client import client
-from .schemas import SessionAnalysisSchema, CampaignSummarySchema, HighlightSchema
-from .prompts import SYSTEM_PROMPT, construct_prompt_context, REFINE_SUMMARY_PROMPT
+from . import file_cache, analysis_store, segments, transcripts, campaign_summary
+from .model_health import generate_with_fallback
+from .persona_resolver import PersonaResolver
+from .schemas import SessionAnalysisSchema, HighlightSchema, TranscriptSchema
+from .prompts import SYSTEM_PROMPT, SEGMENT_PROMPT, SEGMENT_SUMMARY_MERGE_PROMPT, TRANSCRIBE_PROMPT, construct_prompt_context, REFINE_SUMMARY_PROMPT
 from .utils import clean_and_parse_json
-
-async def _upload_and_wait_for_files(file_paths: List[str]) -> List[Any]:
-    """Uploads files to Gemini and waits for them to be active."""
-    if not client:
-        raise Exception("Gemini Client not initialized")
-    
-    gemini_files = []
-    for path in file_paths:
-        mime_type = "audio/mpeg"
-        if path.endswith(".wav"): mime_type = "audio/wav"
-        elif path.endswith(".m4a"): mime_type = "audio/mp4"
-        
+from .metrics import pipeline_metrics, THROUGHPUT_BUCKETS_MBPS, SLOW_BUCKETS_MS
+
+def _mime_type_for(path: str) -> str:
+    if path.endswith(".wav"): return "audio/wav"
+    if path.endswith(".m4a"): return "audio/mp4"
+    return "audio/mpeg"
+
+class UploadStats:
+    """Timings for one file sent to Gemini: upload throughput and how long it took to become ACTIVE."""
+    def __init__(self, path: str):
+        self.path = path
+        self.size_bytes = os.path.getsize(path) if os.path.exists(path) else 0
+        self.upload_seconds = 0.0
+        self.active_seconds = None # From the end of the upload until the file was ACTIVE
+        self.uploaded_at = 0.0
+
+    @property
+    def throughput_mbps(self) -> float:
+        if not self.upload_seconds: return 0.0
+        return self.size_bytes / (1024 * 1024) / self.upload_seconds
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "size_mb": round(self.size_bytes / (1024 * 1024), 2),
+            "upload_seconds": round(self.upload_seconds, 2),
+            "throughput_mbps": round(self.throughput_mbps, 2),
+            "active_seconds": round(self.active_seconds, 2) if self.active_seconds is not None else None,
+        }
+
+async def _upload_file(path: str, semaphore: asyncio.Semaphore, stats: UploadStats) -> Any:
+    mime_type = _mime_type_for(path)
+    async with semaphore:
         print(f"Uploading file: {path} ({mime_type})")
+        started = time.perf_counter()
         # Ensure upload is non-blocking to the event loop
         g_file = await asyncio.to_thread(
             client.files.upload,
             file=path,
-            config={'mime_type': mime_type}
+            config={'mime_type': mime_type, 'display_name': settings.GEMINI_FILE_DISPLAY_PREFIX + os.path.basename(path)}
         )
-        print(f"Uploaded as: {g_file.uri}")
-        gemini_files.append(g_file)
-
-    print("Waiting for file processing...")
-    for f in gemini_files:
-        attempts = 0
-        while True:
-            attempts += 1
-            if attempts > 120:
-                raise Exception(f"Timeout waiting for file {f.name}")
-            
-            # Poll status
-            current_file = await asyncio.to_thread(client.files.get, name=f.name)
-            
+        stats.uploaded_at = time.perf_counter()
+        stats.upload_seconds = stats.uploaded_at - started
+    print(f"Uploaded as: {g_file.uri} ({stats.throughput_mbps:.2f} MB/s)")
+    return g_file
+
+async def _wait_until_active(gemini_files: List[Any], stats: List[UploadStats]):
+    """Polls every pending file in one round, backing off exponentially with jitter between rounds."""
+    pending = {}
+    for g_file, st in zip(gemini_files, stats):
+        if g_file.state == "ACTIVE":
+            st.active_seconds = 0.0
+        else:
+            pending[g_file.name] = st
+
+    delay = settings.GEMINI_POLL_INITIAL_DELAY
+    deadline = time.perf_counter() + settings.GEMINI_FILE_ACTIVE_TIMEOUT
+    while pending:
+        if time.perf_counter() > deadline:
+            raise Exception(f"Timeout waiting for files {', '.join(pending)}")
+        # Equal jitter keeps concurrent pipelines from polling in lockstep
+        await asyncio.sleep(random.uniform(delay / 2, delay))
+        delay = min(delay * 2, settings.GEMINI_POLL_MAX_DELAY)
+
+        current_files = await asyncio.gather(*(asyncio.to_thread(client.files.get, name=name) for name in pending))
+        for current_file in current_files:
             if current_file.state == "ACTIVE":
-                break
+                st = pending.pop(current_file.name)
+                st.active_seconds = time.perf_counter() - st.uploaded_at
             elif current_file.state == "FAILED":
                 raise Exception(f"File {current_file.name} failed processing")
-            
-            await asyncio.sleep(5) # Non-blocking sleep
-            
+
+async def _upload_and_wait_for_files(file_paths: List[str]) -> List[Any]:
+    """
+    Uploads files to Gemini concurrently (at most GEMINI_UPLOAD_CONCURRENCY at a time)
+    and waits for all of them to be active. If anything fails, files already uploaded are deleted.
+    """
+    if not client:
+        raise Exception("Gemini Client not initialized")
+
+    stats = [UploadStats(path) for path in file_paths]
+    semaphore = asyncio.Semaphore(max(1, settings.GEMINI_UPLOAD_CONCURRENCY))
+    uploads = [asyncio.create_task(_upload_file(path, semaphore, st)) for path, st in zip(file_paths, stats)]
+    try:
+        gemini_files = await asyncio.gather(*uploads)
+        print("Waiting for file processing...")
+        await _wait_until_active(gemini_files, stats)
+    except BaseException:
+        for task in uploads:
+            task.cancel()
+        results = await asyncio.gather(*uploads, return_exceptions=True)
+        for g_file in results:
+            if not isinstance(g_file, BaseException):
+                try: await asyncio.to_thread(client.files.delete, name=g_file.name)
+                except Exception: pass
+        raise
+
+    for st in stats:
+        pipeline_metrics.observe("gemini_upload_throughput_mbps", st.throughput_mbps, THROUGHPUT_BUCKETS_MBPS)
+        pipeline_metrics.observe("gemini_upload_ms", st.upload_seconds * 1000, SLOW_BUCKETS_MS)
+        pipeline_metrics.observe("gemini_time_to_active_ms", st.active_seconds * 1000, SLOW_BUCKETS_MS)
+        print(f"Upload stats: {st.as_dict()}")
+    report_stage("files_active", {"files": [st.as_dict() for st in stats]})
     print("...all files ready")
-    return gemini_files
+    return list(gemini_files)
+
+def _highlight_text(item) -> str:
+    if isinstance(item, str):
+        return item
+    return item.get("highlight") or item.get("text") or str(item)
+
+def _bulk_insert(db: Session, model, rows: List[Dict[str, Any]]):
+    if rows:
+        db.execute(insert(model), rows)
 
 def _save_analysis_to_db(session_id: int, data: Dict[str, Any], db: Session):
-    """Parses the analysis dictionary and saves all entities to the database."""
+    """
+    Parses the analysis dictionary and saves all entities to the database.
+    The session's existing rows and the campaign's personas are loaded once, duplicates and
+    persona links are resolved in memory, and everything is written in one transaction.
+    """
     session_entry = db.get(DBSessionEntry, session_id)
     if not session_entry: return
     campaign_id = session_entry.campaign_id
-    
-    # 1. Personas (Upsert)
+
+    # Prefetch everything the duplicate checks and persona matching need
+    personas = PersonaResolver.for_campaign(db, campaign_id)
+    highlight_texts = set(db.exec(select(Highlight.text).where(Highlight.session_id == session_id)).all())
+    quote_texts = set(db.exec(select(Quote.text).where(Quote.session_id == session_id)).all())
+    moment_titles = set(db.exec(select(Moment.title).where(Moment.session_id == session_id)).all())
+
+    # 1. Personas (Upsert). Highlights keep a reference to their persona until the ids exist.
+    persona_highlights = []
     for p_data in data.get("personas", []):
-        name_query = p_data["name"]
-        
-        # Try exact match
-        existing_persona = db.exec(select(Persona).where(col(Persona.name).ilike(name_query)).where(Persona.campaign_id == campaign_id)).first()
-        
-        if not existing_persona:
-            # Fallback: Check local list for substring
-            all_personas = db.exec(select(Persona).where(Persona.campaign_id == campaign_id)).all()
-            for cp in all_personas:
-                if name_query.lower() in cp.name.lower() or cp.name.lower() in name_query.lower():
-                    existing_persona = cp
-                    break
-                # Fuzzy
-                ratio = difflib.SequenceMatcher(None, name_query.lower(), cp.name.lower()).ratio()
-                if ratio > 0.83:
-                    existing_persona = cp
-                    print(f"Fuzzy match: {name_query} ~= {cp.name} ({ratio:.2f})")
-                    break
-
-            # Check aliases
-            if not existing_persona:
-                for cp in all_personas:
-                    try:
-                        aliases = json.loads(cp.aliases) if cp.aliases else []
-                        if any(a.lower() == name_query.lower() for a in aliases):
-                            existing_persona = cp
-                            print(f"Alias match: {name_query} -> {cp.name}")
-                            break
-                    except: continue
+        existing_persona = personas.resolve(p_data["name"])
 
         # Upsert properties
         voice_desc = p_data.get("voice_description")
-        
+
         if existing_persona:
             if voice_desc: existing_persona.voice_description = voice_desc
             if p_data.get("player_name") and not existing_persona.player_name:
                 existing_persona.player_name = p_data.get("player_name")
-            
+
             # Update new fields if provided
             if p_data.get("gender"): existing_persona.gender = p_data.get("gender")
             if p_data.get("race"): existing_persona.race = p_data.get("race")
@@ -115,9 +176,9 @@ def _save_analysis_to_db(session_id: int, data: Dict[str, Any], db: Session):
             if p_data.get("status"): existing_persona.status = p_data.get("status")
 
             db.add(existing_persona)
-            current_pid = existing_persona.id
+            persona = existing_persona
         else:
-            new_p = Persona(
+            persona = Persona(
                 name=p_data["name"],
                 role=p_data["role"],
                 description=p_data["description"],
@@ -133,77 +194,56 @@ def _save_analysis_to_db(session_id: int, data: Dict[str, Any], db: Session):
                 session_id=session_id,
                 campaign_id=campaign_id
             )
-            db.add(new_p)
-            db.commit()
-            db.refresh(new_p)
-            current_pid = new_p.id
-
-        # Highlights
-        for hl in p_data.get("highlights", []):
-            content = hl
-            if not isinstance(hl, str):
-                content = hl.get("highlight") or hl.get("text") or str(hl)
-            
-            # Check for generic duplicate
-            exists = db.exec(select(Highlight).where(Highlight.text == content).where(Highlight.session_id == session_id)).first()
-            if not exists:
-                name_val = p_data.get("name") # Use persona name
-                db.add(Highlight(text=content, name=name_val, type="high", session_id=session_id, persona_id=current_pid, campaign_id=campaign_id))
-
-        # Low Points
-        for lp in p_data.get("low_points", []):
-            content = lp
-            if not isinstance(lp, str):
-                content = lp.get("highlight") or lp.get("text") or str(lp)
-
-            # Check for generic duplicate
-            exists = db.exec(select(Highlight).where(Highlight.text == content).where(Highlight.session_id == session_id)).first()
-            if not exists:
-                name_val = p_data.get("name") # Use persona name
-                db.add(Highlight(text=content, name=name_val, type="low", session_id=session_id, persona_id=current_pid, campaign_id=campaign_id))
-
-    # 2. Quotes
+            db.add(persona)
+            personas.add(persona)
+
+        # Highlights & Low Points, skipping generic duplicates
+        for hl_type, items in (("high", p_data.get("highlights", [])), ("low", p_data.get("low_points", []))):
+            for hl in items:
+                content = _highlight_text(hl)
+                if content not in highlight_texts:
+                    highlight_texts.add(content)
+                    persona_highlights.append((persona, {"text": content, "name": p_data.get("name"), "type": hl_type}))
+
+    # 2. Quotes, linked to the persona the speaker names exactly or by alias
+    persona_quotes = []
     for q in data.get("memorable_quotes", []):
         q_text = q.get("quote", "") if isinstance(q, dict) else str(q)
         speaker = q.get("speaker", "Unknown") if isinstance(q, dict) else "Unknown"
-        
-        # Link to persona
-        pid = None
-        if speaker:
-            pmatch = db.exec(select(Persona).where(col(Persona.name).ilike(speaker)).where(Persona.campaign_id == campaign_id)).first()
-            if pmatch: pid = pmatch.id
-            
-        # Check duplicate
-        exists = db.exec(select(Quote).where(Quote.text == q_text).where(Quote.session_id == session_id)).first()
-        if not exists:
-             db.add(Quote(text=q_text, speaker_name=speaker, session_id=session_id, persona_id=pid, campaign_id=campaign_id))
-
-    # 3. Moments
+        if q_text not in quote_texts:
+            quote_texts.add(q_text)
+            persona_quotes.append((personas.exact(speaker) if speaker else None, {"text": q_text, "speaker_name": speaker}))
+
+    # New personas get their ids in one flush
+    db.flush()
+    highlight_rows = [
+        {**row, "session_id": session_id, "persona_id": persona.id, "campaign_id": campaign_id}
+        for persona, row in persona_highlights
+    ]
+    quote_rows = [
+        {**row, "session_id": session_id, "persona_id": persona.id if persona else None, "campaign_id": campaign_id}
+        for persona, row in persona_quotes
+    ]
+
+    # 3. Moments, deduplicated by title to avoid re-adding safe moments
+    moment_rows = []
     for m in data.get("moments", []):
-        # Check duplicate by title/desc to avoid re-adding safe moments
-        exists = db.exec(select(Moment).where(Moment.title == m["title"]).where(Moment.session_id == session_id)).first()
-        if not exists:
-            db.add(Moment(
-                session_id=session_id,
-                title=m["title"],
-                description=m["description"],
-                timestamp=m.get("timestamp")
-            ))
-    
+        if m["title"] not in moment_titles:
+            moment_titles.add(m["title"])
+            moment_rows.append({"session_id": session_id, "title": m["title"], "description": m["description"], "timestamp": m.get("timestamp")})
+
     # 4. Session Highlights & Low Points (Top Level)
-    for hl in data.get("highlights", []):
-        content = hl if isinstance(hl, str) else hl.get("highlight", str(hl))
-        name_val = hl.get("name") if isinstance(hl, dict) else None
-        exists = db.exec(select(Highlight).where(Highlight.text == content).where(Highlight.session_id == session_id)).first()
-        if not exists:
-            db.add(Highlight(text=content, name=name_val, type="high", session_id=session_id, persona_id=None, campaign_id=campaign_id))
-
-    for lp in data.get("low_points", []):
-        content = lp if isinstance(lp, str) else lp.get("highlight", str(lp))
-        name_val = lp.get("name") if isinstance(lp, dict) else None
-        exists = db.exec(select(Highlight).where(Highlight.text == content).where(Highlight.session_id == session_id)).first()
-        if not exists:
-            db.add(Highlight(text=content, name=name_val, type="low", session_id=session_id, persona_id=None, campaign_id=campaign_id))
+    for hl_type, items in (("high", data.get("highlights", [])), ("low", data.get("low_points", []))):
+        for hl in items:
+            content = hl if isinstance(hl, str) else hl.get("highlight", str(hl))
+            if content not in highlight_texts:
+                highlight_texts.add(content)
+                name_val = hl.get("name") if isinstance(hl, dict) else None
+                highlight_rows.append({"text": content, "name": name_val, "type": hl_type, "session_id": session_id, "persona_id": None, "campaign_id": campaign_id})
+
+    _bulk_insert(db, Highlight, highlight_rows)
+    _bulk_insert(db, Quote, quote_rows)
+    _bulk_insert(db, Moment, moment_rows)
 
     # 5. Session Summary
     # The summary is upserted by the LLM itself returning a refined version.
@@ -223,8 +263,306 @@ def _save_analysis_to_db(session_id: int, data: Dict[str, Any], db: Session):
         except Exception as e:
             print(f"Failed to auto-index session summary: {e}")
 
-async def process_session_pipeline(session_id: int, db_engine):
-    """Main Async Pipeline"""
+def _clear_session_analysis(db: Session, session_id: int):
+    """
+    Deletes the highlights, moments and quotes of a session, and their search index chunks,
+    before it is analysed again: one DELETE ... WHERE session_id per table. The caller commits.
+    """
+    from .vector_store import VectorService
+    session_entry = db.get(DBSessionEntry, session_id)
+    vectors = VectorService(db)
+    for source_type, model in (("highlight", Highlight), ("moment", Moment), ("quote", Quote)):
+        if session_entry:
+            vectors.delete_chunks(session_entry.campaign_id, source_type, select(model.id).where(model.session_id == session_id))
+        db.exec(delete(model).where(model.session_id == session_id))
+
+def replay_session_analysis(session_id: int, db_engine, run_id: Optional[int] = None) -> AnalysisRun:
+    """
+    Re-runs only the save stage from a stored analysis response (the latest one unless run_id is given).
+    No model is called. Raises LookupError if there is nothing to replay.
+    """
+    with Session(db_engine) as db:
+        run = db.get(AnalysisRun, run_id) if run_id else analysis_store.latest_run(db, session_id)
+        if not run or run.session_id != session_id:
+            raise LookupError(f"No stored analysis response for session {session_id}")
+        data = analysis_store.parse_response(run.response_text)
+
+        _clear_session_analysis(db, session_id)
+        db.commit()
+        _save_analysis_to_db(session_id, data, db)
+        analysis_store.mark_saved(db, run.id)
+        db.refresh(run)
+        return run
+
+def _parse_analysis(response, model: str) -> Dict[str, Any]:
+    if response.parsed:
+        return response.parsed.model_dump()
+    return clean_and_parse_json(response.text)
+
+def _parse_transcript(response, model: str) -> List[Dict[str, Any]]:
+    data = _parse_analysis(response, model)
+    return data if isinstance(data, list) else data.get("lines") or []
+
+def _file_part(g_file) -> types.Part:
+    return types.Part.from_uri(file_uri=g_file.uri, mime_type=g_file.mime_type)
+
+async def _gather_or_cancel(coroutines) -> list:
+    """asyncio.gather that cancels the remaining calls as soon as one fails, instead of paying for them."""
+    tasks = [asyncio.create_task(c) for c in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+async def _whole_files(session_id: int, hashes: Dict[str, str], db_engine, gemini_files: list, temp_files: list) -> List[Any]:
+    """
+    Gemini files for the session's source files, in order: reused while Gemini still has them
+    from an earlier run, otherwise prepared and uploaded. Uploads and converted files are
+    appended to `gemini_files` / `temp_files` for the caller to clean up.
+    """
+    cached_files = await file_cache.lookup_hashes(hashes, db_engine)
+    gemini_files.extend(cached_files.values())
+    # One upload per distinct content, for files Gemini doesn't already have
+    to_upload = []
+    for path, content_hash in hashes.items():
+        if path not in cached_files and all(hashes[p] != content_hash for p in to_upload):
+            to_upload.append(path)
+
+    # Prepare the rest
+    final_paths, converted = await prepare_audio_files(to_upload)
+    temp_files.extend(converted)
+    
+    # Upload
+    report_stage("uploading")
+    uploaded = await _upload_and_wait_for_files(final_paths) if final_paths else []
+    gemini_files.extend(uploaded)
+    uploaded_by_hash = {hashes[p]: f for p, f in zip(to_upload, uploaded)}
+    # Registering can delete a replaced copy on Gemini: off the event loop, like the DB work
+    await asyncio.to_thread(file_cache.register, session_id, list(uploaded_by_hash.items()), db_engine)
+    await asyncio.to_thread(file_cache.touch, session_id, [hashes[p] for p in cached_files], db_engine)
+    return [cached_files.get(p) or uploaded_by_hash[hashes[p]] for p in hashes]
+
+async def _segment_files(session_id: int, planned: List[segments.Segment], db_engine, gemini_files: list, temp_files: list) -> Dict[str, Any]:
+    """
+    Gemini files for the windows of a segmented recording, by segment key. Windows still on
+    Gemini from an earlier run are reused; the rest are cut and uploaded.
+    """
+    files = await file_cache.lookup_hashes({seg.key: seg.key for seg in planned}, db_engine)
+    missing = [seg for seg in planned if seg.key not in files]
+    gemini_files.extend(files.values())
+    await asyncio.to_thread(file_cache.touch, session_id, list(files), db_engine)
+    report_stage("segmenting", {"segments": len(planned), "reused": len(files)})
+    if not missing:
+        return files
+
+    semaphore = asyncio.Semaphore(max(1, settings.GEMINI_SEGMENT_CONCURRENCY))
+
+    async def cut(seg):
+        base, _ = os.path.splitext(seg.path)
+        output = f"{base}.segment{seg.index:03d}.mp3"
+        async with semaphore:
+            await asyncio.to_thread(cut_segment, seg.path, seg.start, seg.length, output)
+        temp_files.append(output)
+        return output
+
+    cut_paths = await asyncio.gather(*(cut(seg) for seg in missing))
+    report_stage("uploading")
+    uploaded = await _upload_and_wait_for_files(list(cut_paths))
+    gemini_files.extend(uploaded)
+    await asyncio.to_thread(file_cache.register, session_id, [(seg.key, f) for seg, f in zip(missing, uploaded)], db_engine)
+    files.update({seg.key: f for seg, f in zip(missing, uploaded)})
+    return files
+
+async def _analyze_audio(session_id: int, files: List[Any], hashes: Dict[str, str], system_instruction: str, db_engine) -> Tuple[Dict[str, Any], Optional[int]]:
+    """One analysis call over all of the session's audio. Returns (analysis, id of the stored AnalysisRun)."""
+    report_stage("generating")
+    print("Sending prompt to Gemini...")
+    run_id = None
+
+    def parse(response, model):
+        nonlocal run_id
+        # Keep the raw response before parsing, so a failed save can be replayed
+        if response.text:
+            run_id = analysis_store.record_run(db_engine, session_id, "audio", model, system_instruction, list(hashes.values()), response.text)
+        return _parse_analysis(response, model)
+
+    _, _, response_data = await generate_with_fallback(
+        settings.GEMINI_ANALYSIS_MODELS,
+        contents=[types.Content(role="user", parts=[_file_part(f) for f in files])],
+        config=types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            response_mime_type="application/json",
+            response_schema=SessionAnalysisSchema
+        ),
+        parse=parse,
+        operation="analysis",
+        session_id=session_id,
+        db_engine=db_engine
+    )
+    return response_data, run_id
+
+async def _analyze_segments(session_id: int, planned: List[segments.Segment], files: Dict[str, Any], system_instruction: str, db_engine) -> Tuple[Dict[str, Any], Optional[int]]:
+    """
+    Analyses the windows of a long recording concurrently and merges the results.
+    Returns (merged analysis, id of the stored AnalysisRun).
+    """
+    report_stage("generating", {"segments": len(planned)})
+    print(f"Sending {len(planned)} segments to Gemini...")
+    semaphore = asyncio.Semaphore(max(1, settings.GEMINI_SEGMENT_CONCURRENCY))
+
+    async def analyze(seg):
+        prompt = SEGMENT_PROMPT.format(
+            number=seg.index + 1,
+            count=len(planned),
+            start=segments.format_timestamp(seg.recording_start),
+            end=segments.format_timestamp(seg.recording_end),
+            overlap=int(settings.GEMINI_SEGMENT_OVERLAP),
+        )
+        async with semaphore:
+            model, _, data = await generate_with_fallback(
+                settings.GEMINI_ANALYSIS_MODELS,
+                contents=[types.Content(role="user", parts=[_file_part(files[seg.key])])],
+                config=types.GenerateContentConfig(
+                    system_instruction=system_instruction + prompt,
+                    response_mime_type="application/json",
+                    response_schema=SessionAnalysisSchema
+                ),
+                parse=_parse_analysis,
+                operation="segment_analysis",
+                session_id=session_id,
+                db_engine=db_engine
+            )
+        return model, data
+
+    results = await _gather_or_cancel(analyze(seg) for seg in planned)
+    merged = segments.merge_analyses([(seg, data) for seg, (_, data) in zip(planned, results)])
+    merged["summary"] = await _merge_segment_summaries(session_id, [(data.get("summary") or "").strip() for _, data in results], merged["summary"], db_engine)
+    models = ",".join(sorted({model for model, _ in results}))
+    run_id = analysis_store.record_run(db_engine, session_id, "audio_segmented", models, system_instruction + SEGMENT_PROMPT, [seg.key for seg in planned], json.dumps(merged))
+    return merged, run_id
+
+async def _merge_segment_summaries(session_id: int, summaries: List[str], joined: str, db_engine) -> str:
+    """
+    One summary from the windows' summaries (in recording order), telling the overlaps once.
+    A short text-only call; if it fails, the summaries stay joined as they are.
+    """
+    summaries = [summary for summary in summaries if summary]
+    if len(summaries) < 2:
+        return joined
+    report_stage("merging", {"segments": len(summaries)})
+    parts = "\n\n".join(f"--- Part {n} of {len(summaries)} ---\n{summary}" for n, summary in enumerate(summaries, 1))
+
+    def parse(response, model):
+        text = (response.text or "").strip()
+        if not text:
+            raise ValueError("Empty merged summary")
+        return text
+
+    try:
+        _, _, merged = await generate_with_fallback(
+            settings.GEMINI_SUMMARY_MODELS,
+            contents=[SEGMENT_SUMMARY_MERGE_PROMPT.format(parts=parts)],
+            config=types.GenerateContentConfig(
+                response_mime_type="text/plain"
+            ),
+            parse=parse,
+            operation="segment_summary_merge",
+            session_id=session_id,
+            db_engine=db_engine
+        )
+        return merged
+    except Exception as e:
+        print(f"Could not merge the segment summaries, keeping them joined: {e}")
+        return joined
+
+async def _transcribe(session_id: int, planned: Optional[List[segments.Segment]], files, system_instruction: str, db_engine) -> List[Dict[str, Any]]:
+    """
+    Speaker turns for the whole recording: one call over the whole files, or one per window
+    (concurrently) merged into recording time.
+    """
+    report_stage("transcribing", {"segments": len(planned)} if planned else None)
+    config = types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        response_mime_type="application/json",
+        response_schema=TranscriptSchema
+    )
+    if not planned:
+        print("Sending transcription prompt to Gemini...")
+        _, _, lines = await generate_with_fallback(
+            settings.GEMINI_ANALYSIS_MODELS,
+            contents=[types.Content(role="user", parts=[_file_part(f) for f in files])],
+            config=config,
+            parse=_parse_transcript,
+            operation="transcription",
+            session_id=session_id,
+            db_engine=db_engine
+        )
+        return lines
+
+    print(f"Transcribing {len(planned)} segments...")
+    semaphore = asyncio.Semaphore(max(1, settings.GEMINI_SEGMENT_CONCURRENCY))
+
+    async def transcribe(seg):
+        async with semaphore:
+            _, _, lines = await generate_with_fallback(
+                settings.GEMINI_ANALYSIS_MODELS,
+                contents=[types.Content(role="user", parts=[_file_part(files[seg.key])])],
+                config=config,
+                parse=_parse_transcript,
+                operation="transcription",
+                session_id=session_id,
+                db_engine=db_engine
+            )
+        return lines
+
+    results = await _gather_or_cancel(transcribe(seg) for seg in planned)
+    return transcripts.merge_segment_lines(list(zip(planned, results)))
+
+async def _analyze_text(session_id: int, campaign_id: int, text_content: str, existing_summary: str, db_engine, source: str) -> Tuple[Dict[str, Any], Optional[int]]:
+    """Analysis of a session's text (an imported transcript or the stored one). Returns (analysis, id of the stored AnalysisRun)."""
+    # Build Prompt
+    prompt_context = ""
+    with Session(db_engine) as db:
+        prompt_context = construct_prompt_context(db, campaign_id, existing_summary=existing_summary)
+        
+    # Generate
+    report_stage("generating")
+    run_id = None
+
+    def parse(response, model):
+        nonlocal run_id
+        if response.text:
+            run_id = analysis_store.record_run(db_engine, session_id, source, model, SYSTEM_PROMPT + prompt_context, [analysis_store.sha256_text(text_content)], response.text)
+        return _parse_analysis(response, model)
+
+    _, _, response_data = await generate_with_fallback(
+        settings.GEMINI_ANALYSIS_MODELS,
+        contents=[SYSTEM_PROMPT + prompt_context, f"TRANSCRIPT:\n{text_content}"],
+        config=types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=SessionAnalysisSchema
+        ),
+        parse=parse,
+        operation="text_analysis",
+        session_id=session_id,
+        campaign_id=campaign_id,
+        db_engine=db_engine
+    )
+    return response_data, run_id
+
+def _record_pipeline_error(db_engine, session_id: int, e: Exception):
+    with Session(db_engine) as db:
+        s = db.get(DBSessionEntry, session_id)
+        if s:
+            s.status = ProcessingStatus.ERROR
+            s.error_message = str(e)
+            db.add(s)
+            db.commit()
+
+async def process_session_pipeline(session_id: int, db_engine, raise_on_error: bool = False):
+    """Main Async Pipeline. With raise_on_error the failure is re-raised after it is recorded (used by the job worker)."""
     print(f"Starting pipeline for session {session_id}", flush=True)
     
     audio_paths = []
@@ -241,15 +579,7 @@ async def process_session_pipeline(session_id: int, db_engine):
             existing_summary = s.summary
 
         # Clear existing analysis data for this session to prevent duplication (Regeneration)
-        # Using explicit fetch and delete loop for robustness
-        highlights = db.exec(select(Highlight).where(Highlight.session_id == session_id)).all()
-        for h in highlights: db.delete(h)
-        
-        moments = db.exec(select(Moment).where(Moment.session_id == session_id)).all()
-        for m in moments: db.delete(m)
-        
-        quotes = db.exec(select(Quote).where(Quote.session_id == session_id)).all()
-        for q in quotes: db.delete(q)
+        _clear_session_analysis(db, session_id)
             
         db.add(s)
         db.commit()
@@ -265,59 +595,42 @@ async def process_session_pipeline(session_id: int, db_engine):
     gemini_files = []
 
     try:
-        # 1. Prepare
-        final_paths, temp_files_cleanup = await prepare_audio_files(audio_paths)
-        
-        # 2. Upload
-        gemini_files = await _upload_and_wait_for_files(final_paths)
-        
-        # 3. Build Prompt
-        prompt_context = ""
-        with Session(db_engine) as db:
-            # Pass existing_summary here
-            prompt_context = construct_prompt_context(db, campaign_id, existing_summary=existing_summary)
-            
-        system_instruction = "You are processing an audio/video file. " + SYSTEM_PROMPT + prompt_context
-        
-        # 4. Generate
-        print("Sending prompt to Gemini...")
-        models_to_try = ["gemini-flash-latest", "gemini-3-flash-preview", "gemini-pro-latest"]
-        
-        response_data = None
-        
-        for model in models_to_try:
-            print(f"Trying model: {model}")
-            try:
-                parts = [types.Part.from_uri(file_uri=f.uri, mime_type=f.mime_type) for f in gemini_files]
-                
-                response = await asyncio.to_thread(
-                    client.models.generate_content,
-                    model=model,
-                    contents=[types.Content(role="user", parts=parts)],
-                    config=types.GenerateContentConfig(
-                        system_instruction=system_instruction,
-                        response_mime_type="application/json",
-                        response_schema=SessionAnalysisSchema
-                    )
-                )
-                
-                if response.parsed:
-                    response_data = response.parsed.model_dump()
-                else:
-                    response_data = clean_and_parse_json(response.text)
-                
-                break # Success
-            except Exception as e:
-                print(f"Model {model} failed: {e}")
-                await asyncio.sleep(5)
-                continue
+        # 1. Get the audio onto Gemini; long recordings as overlapping windows (see segments.py)
+        report_stage("preparing")
+        hashes = await file_cache.hash_files(audio_paths)
+        planned_segments = await segments.plan(hashes)
+        if planned_segments:
+            files = await _segment_files(session_id, planned_segments, db_engine, gemini_files, temp_files_cleanup)
+        else:
+            files = await _whole_files(session_id, hashes, db_engine, gemini_files, temp_files_cleanup)
+
+        if settings.GEMINI_TRANSCRIPT_FIRST:
+            # 2. Transcribe once, then analyse the stored text (regenerate with mode=transcript reuses it)
+            with Session(db_engine) as db:
+                speaker_context = construct_prompt_context(db, campaign_id)
+            lines = await _transcribe(session_id, planned_segments, files, TRANSCRIBE_PROMPT + speaker_context, db_engine)
+            if not transcripts.store(db_engine, session_id, lines):
+                raise Exception("Transcription returned no speech")
+            print(f"Stored {len(lines)} transcript lines for session {session_id}")
+            response_data, run_id = await _analyze_text(session_id, campaign_id, transcripts.format_lines(lines), existing_summary, db_engine, "transcript")
+        else:
+            # 2. Analyse the audio directly
+            prompt_context = ""
+            with Session(db_engine) as db:
+                # Pass existing_summary here; segment prompts leave it out, every part would repeat it
+                prompt_context = construct_prompt_context(db, campaign_id, existing_summary="" if planned_segments else existing_summary)
                 
-        if not response_data:
-            raise Exception("All models failed.")
+            system_instruction = "You are processing an audio/video file. " + SYSTEM_PROMPT + prompt_context
+            if planned_segments:
+                response_data, run_id = await _analyze_segments(session_id, planned_segments, files, system_instruction, db_engine)
+            else:
+                response_data, run_id = await _analyze_audio(session_id, files, hashes, system_instruction, db_engine)
             
-        # 5. Save
+        # 3. Save
+        report_stage("saving")
         with Session(db_engine) as db:
             _save_analysis_to_db(session_id, response_data, db)
+            if run_id: analysis_store.mark_saved(db, run_id)
             
         print(f"Session {session_id} completed successfully.")
 
@@ -325,28 +638,26 @@ async def process_session_pipeline(session_id: int, db_engine):
         import traceback
         traceback.print_exc()
         print(f"Pipeline Error: {e}")
-        with Session(db_engine) as db:
-            s = db.get(DBSessionEntry, session_id)
-            if s:
-                s.status = ProcessingStatus.ERROR
-                s.error_message = str(e)
-                db.add(s)
-                db.commit()
+        _record_pipeline_error(db_engine, session_id, e)
+        if raise_on_error:
+            raise
     
     finally:
-        # Cleanup
+        # Cleanup: registered files stay on Gemini for reuse until the sweeper removes them
         if gemini_files:
             for gf in gemini_files:
+                if await asyncio.to_thread(file_cache.is_cached, gf.name, db_engine): continue
                 try: 
                     await asyncio.to_thread(client.files.delete, name=gf.name)
                 except: pass
+        await file_cache.maybe_sweep(db_engine)
         
         if temp_files_cleanup:
             for tf in temp_files_cleanup:
                  try: os.remove(tf)
                  except: pass
 
-async def process_text_session_pipeline(session_id: int, db_engine):
+async def process_text_session_pipeline(session_id: int, db_engine, raise_on_error: bool = False):
     """Text Pipeline (Simplified)"""
     print(f"Starting TEXT pipeline for session {session_id}")
     
@@ -364,14 +675,7 @@ async def process_text_session_pipeline(session_id: int, db_engine):
             existing_summary = s.summary
             
         # Clear existing analysis data for this session to prevent duplication (Regeneration)
-        highlights = db.exec(select(Highlight).where(Highlight.session_id == session_id)).all()
-        for h in highlights: db.delete(h)
-        
-        moments = db.exec(select(Moment).where(Moment.session_id == session_id)).all()
-        for m in moments: db.delete(m)
-        
-        quotes = db.exec(select(Quote).where(Quote.session_id == session_id)).all()
-        for q in quotes: db.delete(q)
+        _clear_session_analysis(db, session_id)
             
         db.add(s)
         db.commit()
@@ -387,167 +691,68 @@ async def process_text_session_pipeline(session_id: int, db_engine):
             text_content = f.read()
 
     try:
-        # Build Prompt
-        prompt_context = ""
-        with Session(db_engine) as db:
-            prompt_context = construct_prompt_context(db, campaign_id, existing_summary=existing_summary)
-            
-        # Generate
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model="gemini-flash-latest",
-            contents=[SYSTEM_PROMPT + prompt_context, f"TRANSCRIPT:\n{text_content}"],
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=SessionAnalysisSchema
-            )
-        )
-        
-        if response.parsed:
-            response_data = response.parsed.model_dump()
-        else:
-            response_data = clean_and_parse_json(response.text)
+        response_data, run_id = await _analyze_text(session_id, campaign_id, text_content, existing_summary, db_engine, "text")
             
+        report_stage("saving")
         with Session(db_engine) as db:
             _save_analysis_to_db(session_id, response_data, db)
+            if run_id: analysis_store.mark_saved(db, run_id)
             
     except Exception as e:
         print(f"Text Pipeline Error: {e}")
-        with Session(db_engine) as db:
-            s = db.get(DBSessionEntry, session_id)
-            if s:
-                s.status = ProcessingStatus.ERROR
-                s.error_message = str(e)
-                db.add(s)
-                db.commit()
-
-async def generate_campaign_summary_pipeline(campaign_id: int, db_engine):
-    """
-    Pipeline to generate a summary for an entire campaign based on sessions and personas.
-    """
-    print(f"Starting Campaign Summary pipeline for campaign {campaign_id}", flush=True)
-    
-    session_context = ""
-    persona_context = ""
-    
-    with Session(db_engine) as db:
-        # Fetch Campaign
-        campaign = db.get(Campaign, campaign_id)
-        if not campaign:
-            print(f"Campaign {campaign_id} not found")
-            return
-
-        # Fetch Sessions (only completed ones with summaries)
-        sessions = db.exec(select(DBSessionEntry).where(DBSessionEntry.campaign_id == campaign_id).order_by(DBSessionEntry.created_at)).all()
-        
-        # Fetch Personas
-        personas = db.exec(select(Persona).where(Persona.campaign_id == campaign_id)).all()
+        _record_pipeline_error(db_engine, session_id, e)
+        if raise_on_error:
+            raise
 
-        if not sessions:
-            print("No sessions found for campaign summary.")
-            return
+async def process_transcript_session_pipeline(session_id: int, db_engine, raise_on_error: bool = False):
+    """Re-analyses the stored transcript of a session. No audio is uploaded or sent to Gemini."""
+    print(f"Starting TRANSCRIPT pipeline for session {session_id}")
 
-        session_context = "SESSION SUMMARIES (Chronological):\n"
-        for s in sessions:
-            session_context += f"\n--- Session: {s.name} ---\n"
-            if s.summary: session_context += f"Summary: {s.summary}\n"
-            
-            highs = [h.text for h in s.highlights if h.type == 'high']
-            if highs: session_context += "Highlights:\n" + "\n".join(['- ' + t for t in highs]) + "\n"
-            
-            lows = [h.text for h in s.highlights if h.type == 'low']
-            if lows: session_context += "Low Points:\n" + "\n".join(['- ' + t for t in lows]) + "\n"
-        
-        persona_context = "DRAMATIS PERSONAE:\n"
-        for p in personas:
-            persona_context += f"- {p.name} ({p.role}): {p.description or 'No desc'}"
-            if p.summary: persona_context += f" [Arc: {p.summary}]"
-            persona_context += "\n"
-
-    # Construct Prompt
-    prompt = f"""
-You are an expert D&D Campaign Historian. Your task is to write a comprehensive and engaging summary of the campaign so far.
-Use the provided session summaries and character data to construct a narrative overview.
-
-{session_context}
-
-{persona_context}
-
-INSTRUCTIONS:
-1.  **Tagline**: Write a short, catchy subtitle that captures the essence of this campaign.
-2.  **Narrative Arc**: Identify the main plot threads and how they have developed across sessions.
-3.  **Character Growth**: Mention key character moments or arcs if they are prominent.
-4.  **Tone**: Keep the tone epic and engaging, suitable for a "Previously on..." recap.
-5.  **Recap**: Ensure to name all the Player Characters (PCs) and their roles.
-6.  **Structure**:
-    -   **The Story So Far**: A cohesive narrative of every event encountered so far. Make this lengthy and detailed with multiple paragraphs.
-    -   **Key Events**: Important events or milestones.
-    -   **Ongoing Conflicts**: Ongoing conflicts or themes.
-    -   **PC Highlights**: Best moment of the campaign for each Player Character (PC).
-    -   **MVP (Most Valuable Persona)**: Subjectively pick a character who has been central to the plot so far based on the events and quickly justify why.
+    with Session(db_engine) as db:
+        s = db.get(DBSessionEntry, session_id)
+        if not s: return
+        s.status = ProcessingStatus.PROCESSING
+        existing_summary = s.summary or ""
 
-"""
+        # Clear existing analysis data for this session to prevent duplication (Regeneration)
+        _clear_session_analysis(db, session_id)
+
+        db.add(s)
+        db.commit()
+        campaign_id = s.campaign_id
+        text_content = transcripts.format_lines(transcripts.load(db, session_id))
 
     try:
-        if not client: raise Exception("Gemini Client not initialized")
-        
-        print("Sending Campaign Config prompt to Gemini...")
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model="gemini-flash-latest", # Fast model is fine for text summarization
-            contents=[prompt],
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=CampaignSummarySchema
-            )
-        )
-        
-        data = {}
-        if response.parsed:
-             # If parsed successfully by the SDK
-             data = response.parsed.model_dump()
-        else:
-             # Fallback
-             data = clean_and_parse_json(response.text)
-        
+        if not text_content:
+            raise LookupError(f"No transcript stored for session {session_id}")
+        response_data, run_id = await _analyze_text(session_id, campaign_id, text_content, existing_summary, db_engine, "transcript")
+
+        report_stage("saving")
         with Session(db_engine) as db:
-            c = db.get(Campaign, campaign_id)
-            if c:
-                c.description = data.get('tagline', '')
-                
-                # Format structured data into Markdown
-                md_output = f"# The Story So Far\n{data.get('summary', '')}\n\n"
-                
-                if data.get('key_events'):
-                    md_output += "## Key Events\n" + "\n".join([f"- {e}" for e in data['key_events']]) + "\n\n"
-                    
-                if data.get('ongoing_conflicts'):
-                    md_output += "## Ongoing Conflicts\n" + "\n".join([f"- {c}" for c in data['ongoing_conflicts']]) + "\n\n"
-                    
-                if data.get('pc_highlights'):
-                    md_output += "## PC Highlights\n"
-                    for h in data['pc_highlights']:
-                        # Handle both dict and object (pydantic dump)
-                        name = h.get('name') if isinstance(h, dict) else h.name
-                        text = h.get('highlight') if isinstance(h, dict) else h.highlight
-                        md_output += f"- **{name}**: {text}\n"
-                    md_output += "\n"
-                    
-                if data.get('mvp'):
-                    mvp = data['mvp']
-                    name = mvp.get('name') if isinstance(mvp, dict) else mvp.name
-                    reason = mvp.get('reason') if isinstance(mvp, dict) else mvp.reason
-                    md_output += f"## MVP: {name}\n{reason}\n"
-
-                c.summary = md_output
-                db.add(c)
-                db.commit()
-                print(f"Campaign {campaign_id} summary updated.")
+            _save_analysis_to_db(session_id, response_data, db)
+            if run_id: analysis_store.mark_saved(db, run_id)
 
+    except Exception as e:
+        print(f"Transcript Pipeline Error: {e}")
+        _record_pipeline_error(db_engine, session_id, e)
+        if raise_on_error:
+            raise
+
+async def generate_campaign_summary_pipeline(campaign_id: int, db_engine, raise_on_error: bool = False):
+    """
+    Pipeline to update the summary of an entire campaign with the sessions added since the
+    last run (see campaign_summary).
+    """
+    print(f"Starting Campaign Summary pipeline for campaign {campaign_id}", flush=True)
+    try:
+        if await campaign_summary.update_campaign_summary(campaign_id, db_engine):
+            print(f"Campaign {campaign_id} summary updated.")
     except Exception as e:
         import traceback
         traceback.print_exc()
         print(f"Campaign Summary Failed: {e}")
+        if raise_on_error:
+            raise
 
 async def refine_session_summary(session_id: int, db_engine) -> str:
     """
@@ -577,15 +782,16 @@ async def refine_session_summary(session_id: int, db_engine) -> str:
 {current_summary}
 """
 
-    if not client: raise Exception("Gemini Client not initialized")
-    
-    response = await asyncio.to_thread(
-        client.models.generate_content,
-        model="gemini-flash-latest",
+    _, response, _ = await generate_with_fallback(
+        settings.GEMINI_SUMMARY_MODELS,
         contents=[full_prompt],
         config=types.GenerateContentConfig(
             response_mime_type="text/plain"
-        )
+        ),
+        operation="refine",
+        session_id=session_id,
+        campaign_id=campaign_id,
+        db_engine=db_engine
     )
     
     new_summary = response.text.strip()
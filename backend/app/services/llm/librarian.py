@@ -0,0 +1,385 @@
+"""
+Librarian answer pipeline: scheduling, retrieval, context assembly and generation.
+Each run yields (event, data) tuples so the same pipeline can back the JSON and SSE endpoints:
+
+    ("queue", position)     while waiting for a generation slot
+    ("sources", [...])      retrieval finished
+    ("token", text)         a piece of the answer (the whole answer when not streaming)
+    ("metadata", {...})     final timing spans (embed, retrieve, pack, ttft, tokens/sec, total)
+                            and the model route taken (see model_router.py)
+    ("error", {...})        the run failed; carries an HTTP status and detail
+
+Identical concurrent requests (same campaign, same normalized history) share one run.
+`answer_batch` answers many standalone questions with one embedding call and one scoring pass.
+Plain persona attribute lookups ("what race is Grog?") are answered from the DB without
+queueing for the model at all (see lookup.py).
+A run whose subscribers have all disconnected is cancelled, which closes the Ollama
+HTTP request (aborting the generation) and releases its scheduler slot. Generation always
+uses the async Ollama client for this reason: a thread can't be cancelled, so its slot would
+be handed to the next request while Ollama was still busy.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from ...core.config import settings
+from ...core.database import engine
+from ...models.models import VectorStore
+from .coalescer import SingleFlight, Subscription, Event
+from .compression import compress_chunks
+from .entity_index import entity_index
+from .lookup import lookup_answer
+from .model_router import choose_route, fast_min_score, record_route
+from .metrics import metrics, RequestTimer
+from .ollama_client import chat_with_librarian, stream_librarian_response
+from .scheduler import scheduler, SchedulerBusyError
+from .vector_store import VectorService
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_LIMIT = 8
+# When the question names characters their chunks are pinned/boosted, so fewer are needed
+ENTITY_RETRIEVAL_LIMIT = 5
+
+flights = SingleFlight()
+
+
+def build_context(results: List[VectorStore], timer: Optional[RequestTimer] = None) -> Tuple[str, List[str]]:
+    """
+    Turn retrieved chunks into the prompt context string and a list of source ids.
+    Chunks are deduplicated and compressed first (see compression.py); the reduction is
+    recorded on `timer` when given.
+    """
+    context_parts = []
+    sources = []
+
+    if not results:
+        # Fallback to basic context if index is empty (or user hasn't indexed yet)
+        context_parts.append("No specific archives found. Answering based on general campaign knowledge if available.")
+    else:
+        blocks, sources, stats = compress_chunks(results)
+        context_parts.append(f"Found {len(blocks)} relevant entries in the archives across sessions and characters:")
+        for block in blocks:
+            context_parts.append(f"---\n{block}")
+
+        metrics.increment("context_chars_saved", stats.chars_before - stats.chars_after)
+        metrics.increment("context_tokens_saved_est", stats.tokens_saved_estimate)
+        if timer is not None:
+            for name, value in stats.as_dict().items():
+                timer.set(name, value)
+
+    return "\n".join(context_parts), sources
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def request_key(campaign_id: int, messages: List[Dict[str, str]], history_summary: str, stream: bool, tier: Optional[str] = None) -> str:
+    """Coalescing key: same campaign, same normalized conversation, same response mode and requested tier."""
+    payload = {
+        "campaign_id": campaign_id,
+        "stream": stream,
+        "tier": tier,
+        "summary": _normalize(history_summary),
+        "messages": [[m["role"], _normalize(m["content"])] for m in messages],
+    }
+    return hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()
+
+
+def _lookup(campaign_id: int, question: str) -> Optional[Dict[str, Any]]:
+    """Deterministic answer for plain attribute questions; None means ask the model."""
+    try:
+        with Session(engine) as db:
+            return lookup_answer(campaign_id, question, db)
+    except Exception as e:
+        logger.warning(f"Lookup fast path failed, falling back to RAG: {e}")
+        return None
+
+
+def _note_embedder(timer: RequestTimer, service: VectorService, campaign_id: int, embedder: str):
+    fallback = embedder != service.campaign_embedder(campaign_id)
+    if fallback:
+        timer.set("embedding_fallback", 1)
+        metrics.increment("embedding_fallbacks")
+    # The bar the retrieval score is routed against depends on the embedder that produced it
+    min_score = fast_min_score(embedder, fallback)
+    if min_score is not None:
+        timer.set("retrieval_min_score", min_score)
+
+
+def _search(campaign_id: int, query: str, timer: RequestTimer) -> List[VectorStore]:
+    with Session(engine) as db:
+        service = VectorService(db)
+        with timer.span("embed"):
+            embedder, (query_embedding,) = service.embed_queries(campaign_id, [query])
+        _note_embedder(timer, service, campaign_id, embedder)
+        with timer.span("retrieve"):
+            with timer.span("retrieve_load"):
+                chunks = service.load_chunks(campaign_id, embedder)
+            with timer.span("retrieve_entities"):
+                pinned, boosted = entity_index.chunk_targets(campaign_id, query, db)
+            with timer.span("retrieve_score"):
+                limit = ENTITY_RETRIEVAL_LIMIT if pinned or boosted else RETRIEVAL_LIMIT
+                scored = service.rank_many_scored([query_embedding], chunks, limit, [pinned], [boosted])[0]
+        timer.set("chunks_scanned", len(chunks))
+        timer.set("chunks_pinned", len(pinned))
+        if scored:
+            # Retrieval confidence, used for model routing
+            timer.set("retrieval_top_score", max(score for _, score in scored))
+        return [chunk for chunk, _ in scored]
+
+
+def _search_many(campaign_id: int, queries: List[str], timer: RequestTimer) -> List[List[Tuple[VectorStore, float]]]:
+    """
+    Retrieve for several queries with one embedding request and one matrix multiplication.
+    Each result is paired with its cosine similarity.
+    """
+    with Session(engine) as db:
+        service = VectorService(db)
+        with timer.span("embed"):
+            embedder, query_embeddings = service.embed_queries(campaign_id, queries)
+        _note_embedder(timer, service, campaign_id, embedder)
+        with timer.span("retrieve"):
+            with timer.span("retrieve_load"):
+                chunks = service.load_chunks(campaign_id, embedder)
+            with timer.span("retrieve_entities"):
+                targets = [entity_index.chunk_targets(campaign_id, q, db) for q in queries]
+            with timer.span("retrieve_score"):
+                pinned = [p for p, _ in targets]
+                boosted = [b for _, b in targets]
+                ranked = service.rank_many_scored(query_embeddings, chunks, RETRIEVAL_LIMIT, pinned, boosted)
+        timer.set("chunks_scanned", len(chunks))
+        # Questions about named characters keep a shorter context
+        return [
+            r[:ENTITY_RETRIEVAL_LIMIT] if p or b else r
+            for r, (p, b) in zip(ranked, targets)
+        ]
+
+
+def _finish_timings(timer: RequestTimer, first_token_at: float, tokens: int, stats: Dict[str, Any]) -> Dict[str, float]:
+    """Derive generation speed (preferring Ollama's own counters) and the total, and record histograms."""
+    total_ms = timer.elapsed_ms()
+    timer.set("total_ms", total_ms)
+    if first_token_at is not None:
+        timer.set("ttft_ms", first_token_at)
+
+    if stats.get("eval_count") and stats.get("eval_duration"):
+        timer.set("completion_tokens", stats["eval_count"])
+        timer.set("tokens_per_sec", stats["eval_count"] / (stats["eval_duration"] / 1e9))
+    elif first_token_at is not None and total_ms > first_token_at:
+        timer.set("completion_tokens", tokens)
+        timer.set("tokens_per_sec", tokens / ((total_ms - first_token_at) / 1000))
+    if stats.get("prompt_eval_count"):
+        timer.set("prompt_tokens", stats["prompt_eval_count"])
+
+    timings = timer.as_dict()
+    metrics.record_timings(timings)
+    return timings
+
+
+async def _run_librarian(
+    campaign_id: int,
+    messages: List[Dict[str, str]],
+    history_summary: str,
+    stream: bool,
+    tier: Optional[str] = None
+) -> AsyncGenerator[Event, None]:
+    timer = RequestTimer()
+    with timer.span("lookup"):
+        direct = await asyncio.to_thread(_lookup, campaign_id, messages[-1]["content"])
+    if direct:
+        metrics.increment("lookup_answers")
+        metrics.observe("lookup_total_ms", timer.elapsed_ms())
+        yield ("sources", direct["sources"])
+        timer.set("ttft_ms", timer.elapsed_ms())
+        yield ("token", direct["response"])
+        timer.set("total_ms", timer.elapsed_ms())
+        yield ("metadata", {"timings": timer.as_dict()})
+        return
+
+    try:
+        ticket = scheduler.enqueue(campaign_id)
+    except SchedulerBusyError as e:
+        yield ("error", {"status": 503, "detail": str(e)})
+        return
+
+    try:
+        try:
+            with timer.span("queue_wait"):
+                async for position in scheduler.wait(ticket):
+                    yield ("queue", position)
+        except SchedulerBusyError as e:
+            yield ("error", {"status": 503, "detail": str(e)})
+            return
+
+        # 1. Retrieve relevant context via Vector Search (using the last message)
+        results = await asyncio.to_thread(_search, campaign_id, messages[-1]["content"], timer)
+        with timer.span("pack"):
+            context, sources = build_context(results, timer)
+        timer.set("context_chars", len(context))
+        yield ("sources", sources)
+
+        # 2. Generate, on the model tier the question calls for
+        route = choose_route(messages, history_summary, timer.values.get("retrieval_top_score"), tier, timer.values.get("retrieval_min_score"))
+        stats: Dict[str, Any] = {}
+        first_token_at = None
+        tokens = 0
+        if stream:
+            try:
+                # Ollama streams roughly one token per chunk
+                async for chunk in stream_librarian_response(messages=messages, context=context, model=route.model, history_summary=history_summary, stats=stats):
+                    if first_token_at is None:
+                        first_token_at = timer.elapsed_ms()
+                    tokens += 1
+                    yield ("token", chunk)
+            except asyncio.CancelledError:
+                metrics.record_generation_cancelled(tokens)
+                raise
+            except RuntimeError as e:
+                # Not an answer: the stream endpoints report it and the conversation doesn't keep it
+                metrics.increment("generations_failed")
+                yield ("error", {"status": 503, "detail": str(e)})
+                return
+            metrics.record_generation_completed(tokens)
+        else:
+            try:
+                response = await chat_with_librarian(
+                    messages=messages,
+                    context=context,
+                    model=route.model,
+                    history_summary=history_summary,
+                    stats=stats
+                )
+            except RuntimeError as e:
+                metrics.increment("generations_failed")
+                yield ("error", {"status": 503, "detail": str(e)})
+                return
+            # Without streaming the first token arrives with the whole answer
+            first_token_at = timer.elapsed_ms()
+            tokens = len(response.split())
+            yield ("token", response)
+
+        timings = _finish_timings(timer, first_token_at, tokens, stats)
+        record_route(route, timings)
+        yield ("metadata", {"timings": timings, "route": route.as_dict()})
+    finally:
+        scheduler.release(ticket)
+
+
+def ask_librarian(
+    campaign_id: int,
+    messages: List[Dict[str, str]],
+    history_summary: str = "",
+    stream: bool = False,
+    tier: Optional[str] = None
+) -> Subscription:
+    """
+    Answer a librarian request, sharing the run with any identical request already in flight.
+    `tier` forces the fast or strong model instead of letting the router choose.
+    Returns a subscription (async iterator) over the run's events; close it to stop listening.
+    """
+    key = request_key(campaign_id, messages, history_summary, stream, tier)
+    return flights.join(key, lambda: _run_librarian(campaign_id, messages, history_summary, stream, tier))
+
+
+async def collect_answer(events: Subscription) -> Dict[str, Any]:
+    """Drain a run into {'response', 'sources', 'timings', 'route', 'error'} for non-streaming callers."""
+    answer = {"response": "", "sources": [], "timings": {}, "route": None, "error": None}
+    try:
+        async for event, data in events:
+            if event == "token":
+                answer["response"] += data
+            elif event == "sources":
+                answer["sources"] = data
+            elif event == "metadata":
+                answer["timings"] = data["timings"]
+                answer["route"] = data.get("route")
+            elif event == "error":
+                answer["error"] = data
+    finally:
+        events.close()
+    return answer
+
+
+async def _answer_one(
+    campaign_id: int,
+    index: int,
+    question: str,
+    scored: List[Tuple[VectorStore, float]],
+    pool: asyncio.Semaphore,
+    tier: Optional[str] = None,
+    min_score: Optional[float] = None
+) -> Dict[str, Any]:
+    timer = RequestTimer()
+    item = {"index": index, "question": question, "response": "", "sources": [], "route": None, "error": None}
+    stats: Dict[str, Any] = {}
+
+    direct = await asyncio.to_thread(_lookup, campaign_id, question)
+    if direct:
+        metrics.increment("lookup_answers")
+        item.update(response=direct["response"], sources=direct["sources"], timings=timer.as_dict())
+        return item
+
+    context, item["sources"] = build_context([chunk for chunk, _ in scored], timer)
+
+    messages = [{"role": "user", "content": question}]
+    route = choose_route(messages, top_score=max((score for _, score in scored), default=None), requested_tier=tier, min_score=min_score)
+    item["route"] = route.as_dict()
+    try:
+        async with pool:
+            async with scheduler.slot(campaign_id):
+                timer.set("queue_wait_ms", timer.elapsed_ms())
+                with timer.span("generate"):
+                    item["response"] = await chat_with_librarian(
+                        messages=messages,
+                        context=context,
+                        model=route.model,
+                        stats=stats
+                    )
+    except (SchedulerBusyError, RuntimeError) as e:
+        item["error"] = {"status": 503, "detail": str(e)}
+    timer.set("total_ms", timer.elapsed_ms())
+    item["timings"] = timer.as_dict()
+    if not item["error"]:
+        metrics.record_generation_completed(stats.get("eval_count") or len(item["response"].split()))
+        record_route(route, item["timings"])
+    return item
+
+
+async def answer_batch(campaign_id: int, questions: List[str], tier: Optional[str] = None) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Answer a list of standalone questions for one campaign, yielding each result as it completes.
+
+    All questions are embedded in one Ollama call and scored against the campaign's chunk
+    matrix in one multiplication. Generations then run at most LIBRARIAN_BATCH_CONCURRENCY
+    at a time, through the shared scheduler so interactive users still get their turn.
+    The last item is a summary: {"done": True, "count": ..., "errors": ..., "timings": {...}}.
+    """
+    timer = RequestTimer()
+    results = await asyncio.to_thread(_search_many, campaign_id, questions, timer)
+
+    pool = asyncio.Semaphore(max(1, settings.LIBRARIAN_BATCH_CONCURRENCY))
+    tasks = [
+        asyncio.create_task(_answer_one(campaign_id, i, q, r, pool, tier, timer.values.get("retrieval_min_score")))
+        for i, (q, r) in enumerate(zip(questions, results))
+    ]
+    errors = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            if item["error"]:
+                errors += 1
+            yield item
+    finally:
+        # The client went away mid-batch: don't leave generations queued behind it
+        for task in tasks:
+            task.cancel()
+
+    metrics.increment("batch_questions", len(questions))
+    timer.set("total_ms", timer.elapsed_ms())
+    yield {"done": True, "count": len(questions), "errors": errors, "timings": timer.as_dict()}
@@ -0,0 +1,116 @@
+"""
+Deterministic answers for plain persona attribute questions.
+"Who plays Grog?", "What race is Vex?", "Is Tiberius alive?" are answered straight
+from the Persona row in milliseconds; anything else falls through to RAG + Ollama.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from ...models.models import Persona
+from .entity_index import entity_index, normalize
+
+ENTITY = "<e>"
+
+# (attribute, pattern) matched against the whole normalized question with the character's
+# name replaced by ENTITY. Anything more than a bare lookup must not match.
+ATTRIBUTE_PATTERNS: List[Tuple[str, str]] = [
+    ("player_name", r"who (plays|is playing|played|runs|controls|voices) <e>"),
+    ("player_name", r"who is (the player (of|for|behind) <e>|<e> s player)"),
+    ("player_name", r"who is <e> played by"),
+    ("race", r"what (race|species|ancestry) is <e>"),
+    ("race", r"what is (<e> s|the) (race|species|ancestry)( of <e>)?"),
+    ("class_name", r"what class is <e>"),
+    ("class_name", r"what is (<e> s|the) class( of <e>)?"),
+    ("level", r"what level is <e>( at)?"),
+    ("level", r"what is (<e> s|the) level( of <e>)?"),
+    ("alignment", r"what (alignment is <e>|is (<e> s|the) alignment( of <e>)?)"),
+    ("status", r"is <e> (still )?(alive|dead|missing|around|living)"),
+    ("status", r"what is (<e> s|the) status( of <e>)?"),
+    ("faction", r"(what|which) (faction|group|organization|organisation|guild) (is|does) <e> (in|part of|with|belong to|a member of)"),
+    ("faction", r"what is (<e> s|the) (faction|group|organization|organisation|guild)( of <e>)?"),
+]
+_COMPILED = [(attribute, re.compile(pattern)) for attribute, pattern in ATTRIBUTE_PATTERNS]
+
+# Statuses that settle "is X alive/dead?". Persona.status defaults to "Alive" whether or not a
+# session ever said so, so "Alive" settles nothing; "Missing", "Captured", ... aren't a yes or no.
+DEAD_STATUSES = {"dead", "deceased", "killed", "slain"}
+
+# Politeness and filler that doesn't change the question
+_FILLER = re.compile(r"^(ioun |hey |so |please |tell me |remind me )+|( please| again| now| currently| these days)+$")
+
+
+def classify(question: str, name_span: Tuple[int, int]) -> Optional[str]:
+    """Which attribute a question asks for, given the token span of the character name."""
+    tokens = normalize(question).split()
+    start, end = name_span
+    templated = " ".join(tokens[:start] + [ENTITY] + tokens[end:])
+    templated = _FILLER.sub("", templated).strip()
+    for attribute, pattern in _COMPILED:
+        match = pattern.fullmatch(templated)
+        # "what is the race" alone has no character in it
+        if match and ENTITY in templated:
+            return attribute
+    return None
+
+
+def render_answer(persona: Persona, attribute: str, question: str) -> Optional[str]:
+    """Phrase the answer in the librarian's voice, or None if the field is empty."""
+    name = persona.name
+    value = getattr(persona, attribute, None)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+
+    if attribute == "player_name":
+        return f"The records show that {name} is played by {value}."
+    if attribute in ("race", "class_name"):
+        article = "an" if str(value)[:1].lower() in "aeiou" else "a"
+        return f"The records show that {name} is {article} {value}."
+    if attribute == "level":
+        return f"The records show that {name} is level {value}."
+    if attribute == "alignment":
+        return f"The records show that {name} is {value}."
+    if attribute == "faction":
+        return f"The records show that {name} belongs to {value}."
+    if attribute == "status":
+        asked = normalize(question).split()
+        status = normalize(str(value))
+        if status == "alive" or (status not in DEAD_STATUSES and "status" not in asked):
+            return None
+        if "alive" in asked or "living" in asked or "around" in asked:
+            return f"No. It is written that {name} is {status}."
+        if "dead" in asked:
+            return f"Yes. It is written that {name} is {status}."
+        return f"It is written that {name} is {status}."
+    return None
+
+
+def lookup_answer(campaign_id: int, question: str, db: Session) -> Optional[Dict[str, object]]:
+    """
+    Answer `question` directly from the Persona table if it is a plain attribute lookup
+    about exactly one known character. Returns {'response', 'sources', 'persona_id', 'attribute'} or None.
+    """
+    matches = entity_index.get(campaign_id, db).find(question)
+    if len(matches) != 1 or len(matches[0][2]) != 1:
+        return None
+    start, end, ids = matches[0]
+
+    attribute = classify(question, (start, end))
+    if attribute is None:
+        return None
+
+    persona_id = next(iter(ids))
+    persona = db.get(Persona, persona_id)
+    if persona is None or persona.campaign_id != campaign_id:
+        return None
+
+    response = render_answer(persona, attribute, question)
+    if response is None:
+        return None
+    return {
+        "response": response,
+        "sources": [f"persona:{persona_id}"],
+        "persona_id": persona_id,
+        "attribute": attribute,
+    }
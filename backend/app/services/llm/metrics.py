@@ -0,0 +1,142 @@
+"""
+In-process metrics.
+`metrics` covers the librarian chat path and is exposed via /api/chat/metrics;
+`pipeline_metrics` covers the session processing pipelines and is exposed via /jobs/metrics.
+Counters and histograms live for the lifetime of the process.
+"""
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Upper bounds (inclusive) for latency histograms, in milliseconds
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000]
+# Generation speed buckets, in tokens per second
+RATE_BUCKETS = [1, 2, 5, 10, 15, 20, 30, 50, 100]
+# Pipeline steps that take seconds to minutes (uploads, Gemini file processing), in milliseconds
+SLOW_BUCKETS_MS = [1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000, 600000, 1800000]
+# Upload throughput, in MB per second
+THROUGHPUT_BUCKETS_MBPS = [0.25, 0.5, 1, 2, 5, 10, 20, 50, 100]
+
+
+class Histogram:
+    """Fixed-bucket histogram; quantiles are estimated from the bucket bounds."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last bucket is +inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for idx, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets[idx] if idx < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, object]:
+        labels = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "mean": round(self.sum / self.count, 3) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class RequestTimer:
+    """
+    Collects named timing spans for one request.
+    Spans are recorded in milliseconds as `<name>_ms`; other values can be set directly.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.values: Dict[str, float] = {}
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.values[f"{name}_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    def set(self, name: str, value: float):
+        self.values[name] = round(value, 2)
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(self.values)
+
+
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.histograms: Dict[str, Histogram] = {}
+
+    def increment(self, name: str, value: float = 1):
+        self.counters[name] += value
+
+    def observe(self, name: str, value: float, buckets: List[float] = LATENCY_BUCKETS_MS):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(buckets)
+        self.histograms[name].observe(value)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "counters": dict(self.counters),
+            "histograms": {name: h.snapshot() for name, h in self.histograms.items()},
+        }
+
+
+class LibrarianMetrics(Metrics):
+    def record_timings(self, timings: Dict[str, float]):
+        """Feed one request's timings into the histograms."""
+        for name, value in timings.items():
+            if name.endswith("_ms"):
+                self.observe(name, value)
+            elif name == "tokens_per_sec":
+                self.observe(name, value, RATE_BUCKETS)
+
+    def record_generation_completed(self, tokens: int):
+        self.increment("generations_completed")
+        self.increment("generation_tokens", tokens)
+
+    def record_generation_cancelled(self, tokens_generated: int):
+        """
+        A generation was aborted because nobody was listening anymore.
+        Tokens saved is estimated from the average length of completed answers.
+        """
+        self.increment("generations_cancelled")
+        self.increment("cancelled_tokens_generated", tokens_generated)
+        self.increment("cancelled_tokens_saved_estimate", max(0, self.average_answer_tokens() - tokens_generated))
+
+    def average_answer_tokens(self) -> float:
+        completed = self.counters["generations_completed"]
+        return self.counters["generation_tokens"] / completed if completed else 0.0
+
+    def snapshot(self) -> Dict[str, object]:
+        snapshot = super().snapshot()
+        snapshot["average_answer_tokens"] = round(self.average_answer_tokens(), 1)
+        return snapshot
+
+
+metrics = LibrarianMetrics()
+pipeline_metrics = Metrics()
@@ -0,0 +1,350 @@
+"""
+Health-aware model fallback for Gemini calls.
+
+Each model has a circuit breaker over a rolling window of calls:
+  closed     - calls go through; once the window holds GEMINI_CIRCUIT_MIN_CALLS calls and
+               the error rate reaches GEMINI_CIRCUIT_ERROR_RATE, the circuit opens
+  open       - the model is skipped for GEMINI_CIRCUIT_COOLDOWN seconds
+  half_open  - after the cooldown a single trial call is let through; success closes
+               the circuit, failure opens it again
+So while flash is degraded, sessions go straight to the next model instead of paying
+for a failed attempt first. If every circuit is open, the model that will recover soonest
+is tried anyway rather than failing outright.
+
+Failures are classified (rate limit, unavailable, timeout, ...) and each class has its
+own retry count and backoff on the same model before moving on (GEMINI_RETRY_POLICY).
+Breaker state is per process: with PIPELINE_EXECUTOR=queue the calls are made, and the
+circuits opened, in the workers. Every attempt is also recorded as a GeminiUsage row by
+whichever process made it, so recorded_health() gives the same per-model numbers across
+all processes. GET /jobs/model-health shows both.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+from google.genai import errors
+from sqlmodel import Session, select
+
+from ...core.config import settings
+from ...models.models import GeminiUsage
+from .client import client
+from . import usage
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+RATE_LIMIT = "rate_limit"
+UNAVAILABLE = "unavailable"
+TIMEOUT = "timeout"
+NOT_FOUND = "not_found"
+INVALID_REQUEST = "invalid_request"
+INVALID_RESPONSE = "invalid_response"
+OTHER = "other"
+
+# Our own bad input says nothing about the model's health
+NOT_COUNTED = {INVALID_REQUEST}
+
+
+def classify_error(e: BaseException) -> str:
+    code = getattr(e, "code", None)
+    if isinstance(e, errors.APIError) and isinstance(code, int):
+        if code == 429:
+            return RATE_LIMIT
+        if code in (408, 504):
+            return TIMEOUT
+        if code == 404:
+            return NOT_FOUND
+        if code >= 500:
+            return UNAVAILABLE
+        return INVALID_REQUEST
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError, httpx.TimeoutException)):
+        return TIMEOUT
+    if isinstance(e, (ConnectionError, httpx.TransportError)):
+        return UNAVAILABLE
+    # JSON decoding and schema validation errors are ValueErrors
+    if isinstance(e, ValueError):
+        return INVALID_RESPONSE
+    return OTHER
+
+
+class RetryPolicy:
+    def __init__(self, retries: int = 0, delay: float = 0.0):
+        self.retries = int(retries)
+        self.delay = float(delay)
+
+    def backoff(self, attempt: int) -> float:
+        """Seconds to wait before retry number `attempt` (0-based): exponential with ±20% jitter."""
+        return self.delay * (2 ** attempt) * random.uniform(0.8, 1.2)
+
+
+def retry_policy(error_class: str) -> RetryPolicy:
+    policies = settings.GEMINI_RETRY_POLICY
+    return RetryPolicy(**policies.get(error_class, policies.get(OTHER, {})))
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        model: str,
+        window: float,
+        min_calls: int,
+        error_rate: float,
+        cooldown: float,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.model = model
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.clock = clock
+        # (time, ok, latency seconds, error class)
+        self.calls: Deque[Tuple[float, bool, float, Optional[str]]] = deque()
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self.trial_in_flight = False
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self.calls and now - self.calls[0][0] > self.window:
+            self.calls.popleft()
+
+    @property
+    def retry_at(self) -> float:
+        return (self.opened_at or 0.0) + self.cooldown
+
+    def allow(self) -> bool:
+        """Whether a call may go to this model now. In half-open state only one trial call is allowed."""
+        with self._lock:
+            if self.state == OPEN and self.clock() >= self.retry_at:
+                self.state = HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self, latency: float):
+        with self._lock:
+            now = self.clock()
+            if self.state != CLOSED:
+                # Recovered: forget the failures that opened the circuit
+                self.calls.clear()
+                self.state = CLOSED
+                self.trial_in_flight = False
+            self.calls.append((now, True, latency, None))
+            self._prune(now)
+
+    def record_failure(self, latency: float, error_class: str, message: str = ""):
+        with self._lock:
+            now = self.clock()
+            self.last_error = f"{error_class}: {message}"[:500]
+            if error_class in NOT_COUNTED:
+                self.trial_in_flight = False
+                return
+            self.calls.append((now, False, latency, error_class))
+            self._prune(now)
+            if self.state == HALF_OPEN:
+                self._open(now)
+            elif self.state == CLOSED:
+                failures = sum(1 for c in self.calls if not c[1])
+                if len(self.calls) >= self.min_calls and failures / len(self.calls) >= self.error_rate:
+                    self._open(now)
+
+    def abandon(self):
+        """The call let through was cancelled before it finished; allow another trial."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        self.trial_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = self.clock()
+            if self.state == OPEN and now >= self.retry_at:
+                state = HALF_OPEN
+            else:
+                state = self.state
+            self._prune(now)
+            calls = list(self.calls)
+        latencies = [c[2] for c in calls if c[1]]
+        failures = [c for c in calls if not c[1]]
+        return {
+            "model": self.model,
+            "state": state,
+            "calls": len(calls),
+            "error_rate": round(len(failures) / len(calls), 3) if calls else 0.0,
+            "errors": dict(Counter(c[3] for c in failures)),
+            "latency_p50_s": _percentile(latencies, 0.5),
+            "latency_p95_s": _percentile(latencies, 0.95),
+            "retry_in_s": round(max(0.0, self.retry_at - now), 1) if state == OPEN else None,
+            "times_opened": self.times_opened,
+            "last_error": self.last_error,
+        }
+
+
+class ModelHealth:
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(
+                    model,
+                    window=settings.GEMINI_CIRCUIT_WINDOW,
+                    min_calls=settings.GEMINI_CIRCUIT_MIN_CALLS,
+                    error_rate=settings.GEMINI_CIRCUIT_ERROR_RATE,
+                    cooldown=settings.GEMINI_CIRCUIT_COOLDOWN,
+                    clock=self.clock,
+                )
+            return self.breakers[model]
+
+    def reset(self):
+        with self._lock:
+            self.breakers.clear()
+
+    def snapshot(self, models: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        names = list(dict.fromkeys((models or []) + list(self.breakers)))
+        return [self.breaker(name).snapshot() for name in names]
+
+
+model_health = ModelHealth()
+
+
+def recorded_health(db: Session, models: List[str], window: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Per model, the calls recorded in the last `window` seconds (GEMINI_CIRCUIT_WINDOW) by any
+    process, with the error rate the breakers go by and whether it is high enough to open one.
+    """
+    window = settings.GEMINI_CIRCUIT_WINDOW if window is None else window
+    since = datetime.now() - timedelta(seconds=window)
+    rows = db.exec(
+        select(GeminiUsage.model, GeminiUsage.status, GeminiUsage.seconds, GeminiUsage.created_at)
+        .where(GeminiUsage.created_at >= since)
+        .order_by(GeminiUsage.id)
+    ).all()
+    names = list(dict.fromkeys(models + [row.model for row in rows]))
+    health = {}
+    for name in names:
+        calls = [row for row in rows if row.model == name and row.status not in NOT_COUNTED]
+        failures = [row for row in calls if row.status != "ok"]
+        error_rate = len(failures) / len(calls) if calls else 0.0
+        health[name] = {
+            "calls": len(calls),
+            "error_rate": round(error_rate, 3),
+            "errors": dict(Counter(row.status for row in failures)),
+            "latency_p50_s": _percentile([row.seconds for row in calls if row.status == "ok"], 0.5),
+            "latency_p95_s": _percentile([row.seconds for row in calls if row.status == "ok"], 0.95),
+            "failing": len(calls) >= settings.GEMINI_CIRCUIT_MIN_CALLS and error_rate >= settings.GEMINI_CIRCUIT_ERROR_RATE,
+            "last_error_at": failures[-1].created_at if failures else None,
+        }
+    return health
+
+
+async def generate_with_fallback(
+    models: List[str],
+    contents: Any,
+    config: Any,
+    parse: Optional[Callable[[Any, str], Any]] = None,
+    operation: str = "generate",
+    session_id: Optional[int] = None,
+    campaign_id: Optional[int] = None,
+    db_engine: Any = None
+) -> Tuple[str, Any, Any]:
+    """
+    Calls client.models.generate_content on the first healthy model in `models`, retrying and
+    falling back per the error class. `parse(response, model)` runs as part of the attempt, so an
+    unparseable response counts as a failure of that model.
+    With `db_engine`, every attempt's tokens and time are recorded there under `operation` for the
+    session/campaign (see usage).
+    Returns (model, response, parsed result or the response itself).
+    """
+    target = {"db_engine": db_engine, "operation": operation, "session_id": session_id, "campaign_id": campaign_id}
+    if not client:
+        raise Exception("Gemini Client not initialized")
+
+    failures = []
+    skipped = []
+    attempted = False
+    for model in models:
+        breaker = model_health.breaker(model)
+        if not breaker.allow():
+            skipped.append(model)
+            print(f"Skipping model {model}: circuit open")
+            continue
+        attempted = True
+        result = await _try_model(model, breaker, contents, config, parse, failures, target)
+        if result is not None:
+            return result
+
+    if not attempted and skipped:
+        # Every circuit is open: try the one due to recover first instead of giving up
+        model = min(skipped, key=lambda m: model_health.breaker(m).retry_at)
+        print(f"All circuits open, trying {model} anyway")
+        result = await _try_model(model, model_health.breaker(model), contents, config, parse, failures, target)
+        if result is not None:
+            return result
+
+    raise Exception("All models failed. " + "; ".join(failures))
+
+
+async def _try_model(model, breaker, contents, config, parse, failures, target) -> Optional[Tuple[str, Any, Any]]:
+    attempt = 0
+    while True:
+        print(f"Trying model: {model}")
+        started = time.perf_counter()
+        response = None
+        try:
+            response = await asyncio.to_thread(client.models.generate_content, model=model, contents=contents, config=config)
+            data = parse(response, model) if parse else response
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception as e:
+            error_class = classify_error(e)
+            elapsed = time.perf_counter() - started
+            breaker.record_failure(elapsed, error_class, str(e))
+            # An unparseable response was still generated, and billed
+            await _record_usage(model, response, elapsed, error_class, target)
+            failures.append(f"{model}: {error_class}: {e}")
+            print(f"Model {model} failed ({error_class}): {e}")
+            policy = retry_policy(error_class)
+            if attempt < policy.retries and breaker.state == CLOSED:
+                await asyncio.sleep(policy.backoff(attempt))
+                attempt += 1
+                continue
+            return None
+        elapsed = time.perf_counter() - started
+        breaker.record_success(elapsed)
+        await _record_usage(model, response, elapsed, "ok", target)
+        return model, response, data
+
+
+async def _record_usage(model: str, response: Any, seconds: float, status: str, target: Dict[str, Any]):
+    if target["db_engine"] is None:
+        return
+    await asyncio.to_thread(usage.record, model=model, response=response, seconds=seconds, status=status, **target)
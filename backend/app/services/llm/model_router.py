@@ -0,0 +1,101 @@
+"""
+Tiered model routing for the librarian.
+Short, well-grounded questions early in a conversation go to a small fast model;
+anything long, analytical, poorly matched by retrieval or deep into a conversation goes
+to the strong model (settings.OLLAMA_MODEL). Clients can force a tier.
+"""
+import re
+from typing import Dict, List, Optional
+
+from ...core.config import settings
+from .metrics import metrics
+
+FAST = "fast"
+STRONG = "strong"
+TIERS = (FAST, STRONG)
+
+# Questions that ask for reasoning over several facts rather than recalling one
+_ANALYTICAL = re.compile(
+    r"\b(why|explain|compare|comparison|summari[sz]e|summary|relationship|timeline|"
+    r"what if|how did|how does|how come|motivat\w*|theor\w*|predict|analy[sz]e)\b",
+    re.I
+)
+
+
+class Route:
+    def __init__(self, tier: str, model: str, reason: str):
+        self.tier = tier
+        self.model = model
+        self.reason = reason
+
+    def as_dict(self) -> Dict[str, str]:
+        return {"tier": self.tier, "model": self.model, "reason": self.reason}
+
+
+def model_for(tier: str) -> str:
+    if tier == FAST and settings.OLLAMA_FAST_MODEL:
+        return settings.OLLAMA_FAST_MODEL
+    return settings.OLLAMA_MODEL
+
+
+def fast_min_score(embedder: str, fallback: bool = False) -> Optional[float]:
+    """
+    The retrieval score a search with `embedder` must reach for the fast model, or None if its
+    scores can't be trusted for routing: the embedder has no ROUTER_FAST_MIN_SCORE entry, or it
+    only stood in for the campaign's own (fallback).
+    """
+    if fallback:
+        return None
+    return settings.ROUTER_FAST_MIN_SCORE.get(embedder)
+
+
+def choose_route(
+    messages: List[Dict[str, str]],
+    history_summary: str = "",
+    top_score: Optional[float] = None,
+    requested_tier: Optional[str] = None,
+    min_score: Optional[float] = None
+) -> Route:
+    """
+    Pick the tier for a request from the question length, retrieval confidence
+    (best raw cosine similarity, None if nothing was retrieved, against `min_score`, the
+    fast_min_score() of the embedder that produced it) and conversation depth.
+    """
+    if requested_tier in TIERS:
+        return Route(requested_tier, model_for(requested_tier), "requested")
+    if not settings.OLLAMA_FAST_MODEL:
+        return Route(STRONG, model_for(STRONG), "no fast model configured")
+
+    question = messages[-1]["content"] if messages else ""
+    depth = len(messages) - 1
+
+    if len(question.split()) > settings.ROUTER_FAST_MAX_WORDS:
+        return Route(STRONG, model_for(STRONG), "long question")
+    if _ANALYTICAL.search(question):
+        return Route(STRONG, model_for(STRONG), "analytical question")
+    if history_summary or depth > settings.ROUTER_FAST_MAX_DEPTH:
+        return Route(STRONG, model_for(STRONG), "deep conversation")
+    if top_score is None or top_score < (min_score if min_score is not None else float("inf")):
+        return Route(STRONG, model_for(STRONG), "low retrieval confidence")
+    return Route(FAST, model_for(FAST), "simple question")
+
+
+def record_route(route: Route, timings: Dict[str, float]):
+    """Per-tier request counts and latency histograms, reported by route_stats()."""
+    metrics.increment(f"route_{route.tier}_requests")
+    for name in ("ttft_ms", "total_ms"):
+        if name in timings:
+            metrics.observe(f"route_{route.tier}_{name}", timings[name])
+
+
+def route_stats() -> Dict[str, Dict[str, object]]:
+    stats = {}
+    for tier in TIERS:
+        stats[tier] = {
+            "model": model_for(tier),
+            "requests": int(metrics.counters.get(f"route_{tier}_requests", 0)),
+        }
+        for name in ("ttft_ms", "total_ms"):
+            histogram = metrics.histograms.get(f"route_{tier}_{name}")
+            stats[tier][name] = histogram.snapshot() if histogram else None
+    return stats
@@ -2,10 +2,14 @@
 Ollama client for local LLM chat capabilities.
 Provides a D&D campaign librarian chat agent.
 """
+import logging
+from functools import lru_cache
 from typing import List, Dict, Any, Optional, AsyncGenerator
 import ollama
 from ...core.config import settings
 
+logger = logging.getLogger(__name__)
+
 
 LIBRARIAN_SYSTEM_PROMPT = """You are Ioun, the Knowing Mistress, speaking to adventurers about their campaign:
 
@@ -16,7 +20,7 @@ LIBRARIAN_SYSTEM_PROMPT = """You are Ioun, the Knowing Mistress, speaking to adv
 Your distinct purpose is to answer questions about these specific chronicles.
 1. Search the CAMPAIGN DATA above for the answer.
 2. If the answer is found, speak it plainly in your wise voice ("The records show...", "It is written that...").
-3. Use the RECENT CONVERSATION history to know who "he", "she", or "it" refers to.
+3. Use the conversation so far (and the EARLIER CONVERSATION summary, if present) to know who "he", "she", or "it" refers to.
 4. If the answer is NOT in the chronicles, you must say: "That knowledge is not in my archives." and stop.
 5. Do not make up facts. Do not speak about D&D rules in general. Only the story above.
 6. CRITICAL: Do NOT use your internal training data to answer questions about D&D rules, lore, or characters not mentioned in the CHRONICLES.
@@ -25,9 +29,48 @@ Your distinct purpose is to answer questions about these specific chronicles.
 Be helpful, wise, and accurate, but most importantly, not too long-winded."""
 
 
+CONVERSATION_SUMMARY_PROMPT = """Condense this conversation between adventurers and Ioun, the campaign librarian, into a short running summary.
+Keep the names, places, and facts that were asked about or revealed, and what "he", "she", or "it" referred to.
+Write at most 150 words of plain prose. Do not add anything that was not said.
+
+PREVIOUS SUMMARY:
+{previous_summary}
+
+NEW TURNS:
+{transcript}
+
+UPDATED SUMMARY:"""
+
+
+@lru_cache(maxsize=None)
+def _client_for(host: str) -> ollama.Client:
+    return ollama.Client(host=host)
+
+
 def get_ollama_client() -> ollama.Client:
-    """Get an Ollama client configured with the host from settings."""
-    return ollama.Client(host=settings.OLLAMA_HOST)
+    """
+    Get an Ollama client configured with the host from settings.
+    Clients are shared per host so consecutive calls reuse the same HTTP connections.
+    """
+    return _client_for(settings.OLLAMA_HOST)
+
+
+# Generation statistics Ollama reports on the final response (durations are in nanoseconds)
+OLLAMA_STAT_FIELDS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration", "total_duration")
+
+
+def _capture_stats(response, stats: Optional[Dict[str, Any]]):
+    if stats is None:
+        return
+    for field in OLLAMA_STAT_FIELDS:
+        value = response.get(field) if hasattr(response, "get") else None
+        if value is not None:
+            stats[field] = value
+
+
+def get_async_ollama_client() -> ollama.AsyncClient:
+    """Async variant, used for streaming so the event loop is never blocked on tokens."""
+    return ollama.AsyncClient(host=settings.OLLAMA_HOST)
 
 
 def build_librarian_prompt(context: str) -> str:
@@ -35,60 +78,77 @@ def build_librarian_prompt(context: str) -> str:
     return LIBRARIAN_SYSTEM_PROMPT.format(context=context)
 
 
-def chat_with_librarian(
+def build_librarian_messages(
     messages: List[Dict[str, str]],
     context: str = "",
-    model: Optional[str] = None
+    history_summary: str = ""
+) -> List[Dict[str, str]]:
+    """
+    Assemble the full message payload for the librarian.
+
+    Every message passed in is sent verbatim: the caller (ConversationService.build_history)
+    has already left out the turns folded into `history_summary`, and compaction keeps
+    what remains bounded.
+    """
+    recent_msgs = [dict(m) for m in messages]
+
+    final_context = context
+    if history_summary:
+        final_context += f"\n\nEARLIER CONVERSATION (summary):\n{history_summary}"
+    logger.debug("Constructing prompt with context length: %d chars", len(final_context))
+
+    system_message = {
+        "role": "system",
+        "content": build_librarian_prompt(final_context)
+    }
+
+    full_messages = [system_message] + recent_msgs
+
+    # SYSTEM HACK: Append a persona reminder to the very last user message
+    # This forces the model to pay attention to the persona even if the context is long
+    if full_messages and full_messages[-1]['role'] == 'user':
+        full_messages[-1]['content'] += "\n\n(Remember: Speak as Ioun, goddess of knowledge. Be wise and mystical.)"
+
+    logger.debug("Full messages payload size: %d chars", sum(len(m['content']) for m in full_messages))
+    return full_messages
+
+
+async def chat_with_librarian(
+    messages: List[Dict[str, str]],
+    context: str = "",
+    model: Optional[str] = None,
+    history_summary: str = "",
+    stats: Optional[Dict[str, Any]] = None
 ) -> str:
     """
     Send a chat request to the local Ollama librarian.
+    Uses the async client, so cancelling the caller closes the request and Ollama stops generating.
     
     Args:
         messages: List of message dicts with 'role' and 'content' keys
         context: RAG context to inject into the system prompt
         model: Override model (uses settings.OLLAMA_MODEL by default)
+        history_summary: Rolling summary of the turns already compacted out of `messages`
+        stats: Optional dict filled with Ollama's token counts and durations
     
     Returns:
         The assistant's response content
     """
-    client = get_ollama_client()
+    client = get_async_ollama_client()
     model = model or settings.OLLAMA_MODEL
     
-    # EXPLICITLY inject history into context if available
-    # Mistral sometimes ignores separate message history when RAG context is huge
-    history_text = ""
-    if len(messages) > 1:
-        # Get last 3 turns (excluding the current user message)
-        recent_msgs = messages[:-1][-6:] 
-        history_text = "\n\nRECENT CONVERSATION:\n" + "\n".join([f"{m['role'].upper()}: {m['content']}" for m in recent_msgs])
-    
-    # Build system message with context AND history
-    final_context = context + history_text
-    print(f"DEBUG: Constructing prompt with Context Length: {len(final_context)} chars")
-    
-    system_message = {
-        "role": "system",
-        "content": build_librarian_prompt(final_context)
-    }
-    
-    # Prepend system message to conversation
-    full_messages = [system_message] + messages
-    
-    # SYSTEM HACK: Append a persona reminder to the very last user message
-    # This forces the model to pay attention to the persona even if the context is long
-    if full_messages and full_messages[-1]['role'] == 'user':
-        full_messages[-1]['content'] += "\n\n(Remember: Speak as Ioun, goddess of knowledge. Be wise and mystical.)"
-    
-    print(f"DEBUG: Full messages payload size: {sum(len(m['content']) for m in full_messages)} chars")
+    full_messages = build_librarian_messages(messages, context, history_summary)
     
     try:
-        response = client.chat(
+        response = await client.chat(
             model=model,
             messages=full_messages,
             options={
                 "num_ctx": settings.OLLAMA_CONTEXT_WINDOW
-            }
+            },
+            keep_alive=settings.OLLAMA_KEEP_ALIVE
         )
+        _capture_stats(response, stats)
         return response['message']['content']
     except Exception as e:
         raise RuntimeError(f"Ollama chat failed: {str(e)}")
@@ -97,48 +157,72 @@ def chat_with_librarian(
 async def stream_librarian_response(
     messages: List[Dict[str, str]],
     context: str = "",
-    model: Optional[str] = None
+    model: Optional[str] = None,
+    history_summary: str = "",
+    stats: Optional[Dict[str, Any]] = None
 ) -> AsyncGenerator[str, None]:
     """
     Stream a chat response from the local Ollama librarian.
     
-    Yields chunks of the response as they arrive.
+    Yields chunks of the response as they arrive. If `stats` is given it is filled
+    from the final chunk with Ollama's token counts and durations.
+    Raises RuntimeError if Ollama fails, possibly after some chunks were yielded.
     """
-    client = get_ollama_client()
+    client = get_async_ollama_client()
     model = model or settings.OLLAMA_MODEL
     
-    # EXPLICITLY inject history into context for streaming too
-    history_text = ""
-    if len(messages) > 1:
-        recent_msgs = messages[:-1][-6:] 
-        history_text = "\n\nRECENT CONVERSATION:\n" + "\n".join([f"{m['role'].upper()}: {m['content']}" for m in recent_msgs])
-    
-    system_message = {
-        "role": "system",
-        "content": build_librarian_prompt(context + history_text)
-    }
-    
-    full_messages = [system_message] + messages
-    
-    # SYSTEM HACK: Append a persona reminder to the very last user message
-    if full_messages and full_messages[-1]['role'] == 'user':
-        full_messages[-1]['content'] += "\n\n(Remember: Speak as Ioun, goddess of knowledge. Be wise and mystical.)"
+    full_messages = build_librarian_messages(messages, context, history_summary)
     
     try:
-        stream = client.chat(
+        stream = await client.chat(
             model=model,
             messages=full_messages,
             stream=True,
             options={
                 "num_ctx": settings.OLLAMA_CONTEXT_WINDOW
-            }
+            },
+            keep_alive=settings.OLLAMA_KEEP_ALIVE
         )
         
-        for chunk in stream:
+        async for chunk in stream:
             if 'message' in chunk and 'content' in chunk['message']:
                 yield chunk['message']['content']
+            if chunk.get('done'):
+                _capture_stats(chunk, stats)
+    except Exception as e:
+        raise RuntimeError(f"Ollama chat failed: {str(e)}")
+
+
+def summarize_conversation(
+    previous_summary: str,
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None
+) -> str:
+    """
+    Fold older conversation turns into the running summary.
+    Used by background compaction; raises RuntimeError if Ollama is unavailable.
+    """
+    client = get_ollama_client()
+    model = model or settings.OLLAMA_MODEL
+
+    transcript = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages)
+    prompt = CONVERSATION_SUMMARY_PROMPT.format(
+        previous_summary=previous_summary or "(none)",
+        transcript=transcript
+    )
+
+    try:
+        response = client.chat(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            options={
+                "num_ctx": settings.OLLAMA_CONTEXT_WINDOW
+            },
+            keep_alive=settings.OLLAMA_KEEP_ALIVE
+        )
+        return response['message']['content'].strip()
     except Exception as e:
-        yield f"\n[Error: {str(e)}]"
+        raise RuntimeError(f"Ollama summarization failed: {str(e)}")
 
 
 def check_ollama_status() -> Dict[str, Any]:
@@ -0,0 +1,105 @@
+"""
+Resolves the character names an analysis extracts to the campaign's personas.
+
+Built once per save from the campaign's personas and updated as new personas are
+inserted, so later personas and quote speakers in the same response find them:
+  - normalized name and alias hash maps answer exact matches in O(1)
+  - a character-trigram index narrows the substring/fuzzy fallback to the names that
+    share a trigram with the query, instead of comparing against every persona.
+Fuzzy candidates are checked with cheap upper bounds (length, SequenceMatcher's
+real_quick_ratio/quick_ratio) before the full ratio is computed.
+"""
+import difflib
+import json
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlmodel import Session, select
+
+from ...models.models import Persona
+from .entity_index import normalize
+
+logger = logging.getLogger(__name__)
+
+FUZZY_THRESHOLD = 0.83
+
+
+def trigrams(key: str) -> Set[str]:
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+def persona_aliases(persona: Persona) -> List[str]:
+    try:
+        aliases = json.loads(persona.aliases) if persona.aliases else []
+    except (ValueError, TypeError):
+        return []
+    return [a for a in aliases if isinstance(a, str)] if isinstance(aliases, list) else []
+
+
+class PersonaResolver:
+    def __init__(self, personas: Iterable[Persona] = ()):
+        # Personas in insertion order; the index positions keep fuzzy matching deterministic
+        self.personas: List[Persona] = []
+        self.keys: List[str] = []
+        self.by_name: Dict[str, Persona] = {}
+        self.by_alias: Dict[str, Persona] = {}
+        self.grams: Dict[str, Set[int]] = {}
+        # Names too short to have a trigram, compared directly
+        self.short: List[int] = []
+        for persona in personas:
+            self.add(persona)
+
+    @classmethod
+    def for_campaign(cls, db: Session, campaign_id: int) -> "PersonaResolver":
+        return cls(db.exec(select(Persona).where(Persona.campaign_id == campaign_id).order_by(Persona.id)).all())
+
+    def add(self, persona: Persona):
+        """Index a persona (also one that isn't flushed yet). The first persona with a given name or alias wins."""
+        position = len(self.personas)
+        key = normalize(persona.name)
+        self.personas.append(persona)
+        self.keys.append(key)
+        self.by_name.setdefault(key, persona)
+        for alias in persona_aliases(persona):
+            self.by_alias.setdefault(normalize(alias), persona)
+        grams = trigrams(key)
+        if not grams:
+            self.short.append(position)
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(position)
+
+    def exact(self, name: str) -> Optional[Persona]:
+        """Persona whose name, or failing that one of whose aliases, equals `name` after normalization."""
+        key = normalize(name)
+        return self.by_name.get(key) or self.by_alias.get(key)
+
+    def resolve(self, name: str) -> Optional[Persona]:
+        """Exact name or alias, then the first persona whose name contains or is contained in `name` or is a close fuzzy match."""
+        persona = self.exact(name)
+        if persona is not None:
+            return persona
+        key = normalize(name)
+        if not key:
+            return None
+
+        for position in self._candidates(key):
+            other = self.keys[position]
+            if key in other or other in key:
+                return self.personas[position]
+            matcher = difflib.SequenceMatcher(None, key, other)
+            if matcher.real_quick_ratio() > FUZZY_THRESHOLD and matcher.quick_ratio() > FUZZY_THRESHOLD:
+                ratio = matcher.ratio()
+                if ratio > FUZZY_THRESHOLD:
+                    logger.info("Fuzzy match: %s ~= %s (%.2f)", name, self.personas[position].name, ratio)
+                    return self.personas[position]
+        return None
+
+    def _candidates(self, key: str) -> List[int]:
+        grams = trigrams(key)
+        if not grams:
+            # A name shorter than a trigram can only be a substring of another: check them all
+            return list(range(len(self.personas)))
+        candidates = set(self.short)
+        for gram in grams:
+            candidates |= self.grams.get(gram, set())
+        return sorted(candidates)
@@ -141,6 +141,68 @@ CRITICAL SPEAKER IDENTIFICATION INSTRUCTIONS:
     return context_instruction
     return context_instruction
 
+TRANSCRIBE_PROMPT = """
+You are an expert D&D session transcriber. Transcribe the game session audio into speaker turns.
+
+CRITICAL INSTRUCTION: You MUST transcribe the audio from the very beginning to the very end. Do not summarize or skip.
+
+-   **Turns**: Start a new line whenever the speaker changes; merge consecutive sentences of one speaker into one line.
+-   **Speakers**: Listen for names being said and keep each distinct voice attributed to the same speaker throughout. Use the known personas below, if any. Use the character's name for in-character speech and the player's or DM's name for table talk.
+-   **Text**: Keep what was said verbatim, dropping only filler words (um, uh) and crosstalk you cannot make out.
+-   **Timestamps**: HH:MM:SS from the start of the audio where the turn begins. If several files are given, they are consecutive parts of one recording.
+"""
+
+SEGMENT_PROMPT = """
+### RECORDING SEGMENT
+This audio is part {number} of {count} of a longer session recording, covering {start} to {end} of the full recording.
+Neighbouring parts overlap by about {overlap} seconds and are analysed separately, then combined.
+-   Process this part from its beginning to its end.
+-   **Summary**: Summarize only what happens in this part; the 1000-word minimum does not apply.
+-   **Moments**: Give each moment's `timestamp` as HH:MM:SS from the start of THIS audio file.
+"""
+
+SEGMENT_SUMMARY_MERGE_PROMPT = """
+You are an expert D&D session chronicler. The summaries below cover consecutive parts of one session recording, in order.
+Neighbouring parts overlap by a few minutes, so the end of one part and the start of the next often narrate the same events.
+-   **Merge**: Write them as one continuous summary of the whole session, in order, telling the events of each overlap only once.
+-   **Preserve**: Keep every other detail and all names exactly as written. Do not add events.
+-   **Format**: Plain prose paragraphs only, no headings and no bold text.
+
+{parts}
+"""
+
+SESSION_DIGEST_PROMPT = """
+You are an expert D&D Campaign Historian. Condense the session below into a digest that will stand in for it in the campaign summary.
+
+-   **Length**: At most {words} words.
+-   **Content**: Plot facts only: where the party went, who they met or fought, what they learned or decided, who died or changed, and which threads were left open.
+-   **Names**: Keep character, place and faction names exactly as written.
+-   **Highlights**: Mention a highlight only if it matters to the story.
+
+{material}
+"""
+
+CAMPAIGN_SUMMARY_PROMPT = """
+You are an expert D&D Campaign Historian. Your task is to write a comprehensive and engaging summary of the campaign so far.
+{story_context}
+{session_context}
+
+{persona_context}
+
+INSTRUCTIONS:
+1.  **Tagline**: Write a short, catchy subtitle that captures the essence of this campaign.
+2.  **Narrative Arc**: Identify the main plot threads and how they have developed across sessions.
+3.  **Character Growth**: Mention key character moments or arcs if they are prominent.
+4.  **Tone**: Keep the tone epic and engaging, suitable for a "Previously on..." recap.
+5.  **Recap**: Ensure to name all the Player Characters (PCs) and their roles.
+6.  **Structure**:
+    -   **The Story So Far**: A cohesive narrative of every event encountered so far, in multiple paragraphs. Keep it under {words} words: tell recent sessions in detail and condense older events.
+    -   **Key Events**: Important events or milestones, at most {max_items}.
+    -   **Ongoing Conflicts**: Ongoing conflicts or themes, at most {max_items}; drop those that have been resolved.
+    -   **PC Highlights**: Best moment of the campaign for each Player Character (PC).
+    -   **MVP (Most Valuable Persona)**: Subjectively pick a character who has been central to the plot so far based on the events and quickly justify why.
+"""
+
 REFINE_SUMMARY_PROMPT = """
 You are an expert editor for D&D session summaries. 
 Your task is to refine the provided session summary text.
@@ -0,0 +1,164 @@
+"""
+Admission control for librarian generations.
+A CPU-only Ollama host slows to a crawl with more than a couple of concurrent
+generations, so requests take a slot from a fixed pool and wait in per-campaign
+queues that are served round-robin. Waiters that sit past the timeout are rejected.
+"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Deque, Dict, Optional
+
+from ...core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerBusyError(RuntimeError):
+    """Raised when a generation cannot be admitted (queue full or wait timed out)."""
+
+
+class QueueFullError(SchedulerBusyError):
+    pass
+
+
+class QueueTimeoutError(SchedulerBusyError):
+    pass
+
+
+class Ticket:
+    """A single request's place in the scheduler."""
+
+    def __init__(self, campaign_id: int):
+        self.campaign_id = campaign_id
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.position: int = 0  # 0 once a slot is held
+        self.changed = asyncio.Event()
+        self.released = False
+
+
+class GenerationScheduler:
+    def __init__(self, slots: int, max_queue: int, queue_timeout: float):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        # campaign_id -> waiting tickets; the campaign at the front is served next
+        self._queues: "OrderedDict[int, Deque[Ticket]]" = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def enqueue(self, campaign_id: int) -> Ticket:
+        """
+        Admit a request. The ticket is granted immediately if a slot is free,
+        otherwise it joins its campaign's queue. Raises QueueFullError if the queue is full.
+        """
+        if self._active >= self.slots and self.queued >= self.max_queue:
+            raise QueueFullError("The librarian is busy, please try again shortly.")
+
+        ticket = Ticket(campaign_id)
+        self._queues.setdefault(campaign_id, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket: Ticket) -> AsyncGenerator[int, None]:
+        """
+        Wait for the ticket to be granted, yielding its queue position whenever it changes.
+        Raises QueueTimeoutError (and gives up the place) after the queue timeout.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        last_position = None
+
+        while not ticket.granted.done():
+            if ticket.position != last_position:
+                last_position = ticket.position
+                yield ticket.position
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.release(ticket)
+                raise QueueTimeoutError(f"Timed out after {self.queue_timeout:.0f}s waiting for the librarian.")
+
+            ticket.changed.clear()
+            changed = asyncio.ensure_future(ticket.changed.wait())
+            try:
+                await asyncio.wait({ticket.granted, changed}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                changed.cancel()
+
+    def release(self, ticket: Ticket):
+        """Give back a slot (or a place in the queue). Safe to call more than once."""
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if ticket.granted.done():
+            self._active -= 1
+        else:
+            ticket.granted.cancel()
+            queue = self._queues.get(ticket.campaign_id)
+            if queue is not None:
+                try:
+                    queue.remove(ticket)
+                except ValueError:
+                    pass
+                if not queue:
+                    del self._queues[ticket.campaign_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, campaign_id: int):
+        """Hold a generation slot for the duration of the block."""
+        ticket = self.enqueue(campaign_id)
+        try:
+            async for _ in self.wait(ticket):
+                pass
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "slots": self.slots,
+            "active": self._active,
+            "queued": self.queued,
+            "queued_by_campaign": {cid: len(q) for cid, q in self._queues.items()},
+        }
+
+    def _dispatch(self):
+        """Grant free slots round-robin across campaigns, then refresh queue positions."""
+        while self._active < self.slots and self._queues:
+            campaign_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(campaign_id)
+            else:
+                del self._queues[campaign_id]
+
+            self._active += 1
+            ticket.position = 0
+            ticket.granted.set_result(True)
+            ticket.changed.set()
+
+        # Positions follow the same round-robin order the queues will be served in
+        position = 0
+        depth = max((len(q) for q in self._queues.values()), default=0)
+        for round_idx in range(depth):
+            for queue in self._queues.values():
+                if round_idx < len(queue):
+                    position += 1
+                    ticket = queue[round_idx]
+                    if ticket.position != position:
+                        ticket.position = position
+                        ticket.changed.set()
+
+
+scheduler = GenerationScheduler(
+    slots=settings.LIBRARIAN_MAX_CONCURRENT_GENERATIONS,
+    max_queue=settings.LIBRARIAN_MAX_QUEUE,
+    queue_timeout=settings.LIBRARIAN_QUEUE_TIMEOUT,
+)
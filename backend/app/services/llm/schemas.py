@@ -29,6 +29,7 @@ class PersonaSchema(BaseModel):
 class MomentSchema(BaseModel):
     title: str
     description: str
+    timestamp: Optional[str] = Field(default=None, description="When it happens, as HH:MM:SS from the start of the recording")
 
 class SessionAnalysisSchema(BaseModel):
     summary: str = Field(description="A detailed narrative summary (at least 1000 words).")
@@ -38,6 +39,17 @@ class SessionAnalysisSchema(BaseModel):
     personas: List[PersonaSchema] = Field(description="List of all characters identified.")
     moments: List[MomentSchema] = Field(description="Key epic or funny moments.")
 
+class TranscriptLineSchema(BaseModel):
+    timestamp: str = Field(description="When the turn starts, as HH:MM:SS from the start of the audio")
+    speaker: str = Field(description="Name of the character speaking in character, or of the player/DM for table talk. Infer from context.")
+    text: str = Field(description="What was said, verbatim except for filler words")
+
+class TranscriptSchema(BaseModel):
+    lines: List[TranscriptLineSchema] = Field(description="Every speaker turn, in order.")
+
+class SessionDigestSchema(BaseModel):
+    digest: str = Field(description="The plot of the session condensed into a few sentences of facts.")
+
 class MVPSchema(BaseModel):
     name: str = Field(description="Name of the MVP character")
     reason: str = Field(description="Reason why they are the MVP")
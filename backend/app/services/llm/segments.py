@@ -0,0 +1,193 @@
+"""
+Segmented analysis of long recordings.
+
+A 5-6 hour session sent as one generate_content call is slow, can time out and loses
+detail towards the end. In segmented mode (GEMINI_SEGMENTED_ANALYSIS) the recording is
+cut into overlapping windows; process_session_pipeline analyses them concurrently
+with SessionAnalysisSchema, and merge_analyses() combines the results:
+  - part summaries are joined in recording order; the pipeline then has them rewritten as
+    one with a short text-only call, so events in an overlap are told once
+  - quotes, highlights and moments seen in two overlapping windows are kept once
+  - personas are combined by normalized name (fuzzy matches are left to the save stage's
+    PersonaResolver)
+  - moment timestamps are shifted from window time to recording time
+Each window is keyed by its source file hash and cut, so a regeneration reuses the
+windows still on Gemini through file_cache.
+"""
+import asyncio
+import difflib
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from ...core.config import settings
+from ..audio import probe_duration, segment_windows
+from .analysis_store import sha256_text
+from .entity_index import normalize
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cut changes (e.g. encoding), so cached windows are not reused
+SEGMENT_VERSION = "mp3-32k-mono-1"
+# Moments this close in time with similar titles are the same moment seen by two windows
+MOMENT_MERGE_SECONDS = 90.0
+MOMENT_TITLE_SIMILARITY = 0.6
+
+PERSONA_FIELDS = ["player_name", "voice_description", "gender", "race", "class_name", "alignment", "level", "faction"]
+
+
+class Segment:
+    def __init__(self, index: int, path: str, content_hash: str, start: float, length: float, offset: float):
+        self.index = index
+        self.path = path
+        self.content_hash = content_hash
+        # Position within the source file, and of the source file within the whole recording
+        self.start = start
+        self.length = length
+        self.offset = offset
+        self.key = sha256_text(f"{content_hash}:{start:.3f}:{length:.3f}:{SEGMENT_VERSION}")
+
+    @property
+    def recording_start(self) -> float:
+        return self.offset + self.start
+
+    @property
+    def recording_end(self) -> float:
+        return self.offset + self.start + self.length
+
+
+def plan_segments(durations: Dict[str, float], hashes: Dict[str, str], length: float, overlap: float) -> List[Segment]:
+    """Windows over every source file in order; windows don't cross file boundaries."""
+    segments = []
+    offset = 0.0
+    for path, duration in durations.items():
+        for start, window in segment_windows(duration, length, overlap):
+            segments.append(Segment(len(segments), path, hashes[path], start, window, offset))
+        offset += duration
+    return segments
+
+
+async def plan(hashes: Dict[str, str]) -> Optional[List[Segment]]:
+    """Segments to analyse for {source path: content hash}, or None to analyse the files whole."""
+    mode = settings.GEMINI_SEGMENTED_ANALYSIS
+    if mode == "off" or not hashes:
+        return None
+    try:
+        durations = dict(zip(hashes, await asyncio.gather(*(asyncio.to_thread(probe_duration, p) for p in hashes))))
+    except Exception as e:
+        if mode == "always":
+            raise
+        logger.warning("Could not read recording durations, analysing the files whole: %s", e)
+        return None
+
+    total = sum(durations.values())
+    if mode == "auto" and total <= settings.GEMINI_SEGMENT_THRESHOLD:
+        return None
+    segments = plan_segments(durations, hashes, settings.GEMINI_SEGMENT_LENGTH, settings.GEMINI_SEGMENT_OVERLAP)
+    print(f"Recording is {format_timestamp(total)} long: analysing {len(segments)} segments")
+    return segments
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """Seconds from "HH:MM:SS", "MM:SS" or "SS" (fractions and brackets allowed); None if it isn't one."""
+    if value is None:
+        return None
+    match = re.fullmatch(r"\[?\s*(?:(\d+):)?(?:(\d+):)?(\d+(?:\.\d+)?)\s*\]?", str(value).strip())
+    if not match:
+        return None
+    parts = [float(p) for p in match.groups() if p is not None]
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def format_timestamp(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _highlight_key(item: Any) -> str:
+    if isinstance(item, str):
+        return normalize(item)
+    return normalize(item.get("highlight") or item.get("text") or "")
+
+
+def _dedupe(items: List[Any], key) -> List[Any]:
+    seen = set()
+    kept = []
+    for item in items:
+        k = key(item)
+        if k in seen:
+            continue
+        seen.add(k)
+        kept.append(item)
+    return kept
+
+
+def _merge_persona(merged: Dict[str, Any], other: Dict[str, Any]):
+    for field in PERSONA_FIELDS:
+        if not merged.get(field) and other.get(field):
+            merged[field] = other[field]
+    if len(other.get("description") or "") > len(merged.get("description") or ""):
+        merged["description"] = other["description"]
+    # The latest window knows how the character ended the session
+    if other.get("status"):
+        merged["status"] = other["status"]
+    for field in ("highlights", "low_points"):
+        merged[field] = _dedupe((merged.get(field) or []) + (other.get(field) or []), _highlight_key)
+
+
+def _same_moment(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    title_a, title_b = normalize(a.get("title") or ""), normalize(b.get("title") or "")
+    if title_a == title_b:
+        return True
+    ta, tb = parse_timestamp(a.get("timestamp")), parse_timestamp(b.get("timestamp"))
+    if ta is None or tb is None or abs(ta - tb) > MOMENT_MERGE_SECONDS:
+        return False
+    return difflib.SequenceMatcher(None, title_a, title_b).ratio() >= MOMENT_TITLE_SIMILARITY
+
+
+def merge_analyses(parts: List[Tuple[Segment, Dict[str, Any]]]) -> Dict[str, Any]:
+    """Combine per-window SessionAnalysisSchema results (in any order) into one for the whole recording."""
+    parts = sorted(parts, key=lambda part: part[0].index)
+    merged: Dict[str, Any] = {"summary": "", "highlights": [], "low_points": [], "memorable_quotes": [], "personas": [], "moments": []}
+
+    merged["summary"] = "\n\n".join(data["summary"].strip() for _, data in parts if (data.get("summary") or "").strip())
+    for field in ("highlights", "low_points"):
+        merged[field] = _dedupe([item for _, data in parts for item in data.get(field) or []], _highlight_key)
+
+    quotes: Dict[str, Dict[str, Any]] = {}
+    for _, data in parts:
+        for q in data.get("memorable_quotes") or []:
+            key = normalize(q.get("quote") or "")
+            kept = quotes.get(key)
+            if kept is None:
+                quotes[key] = dict(q)
+            elif normalize(kept.get("speaker") or "") in ("", "unknown") and q.get("speaker"):
+                # A window that heard more of the conversation may know who said it
+                kept["speaker"], kept["reasoning"] = q["speaker"], q.get("reasoning", kept.get("reasoning"))
+    merged["memorable_quotes"] = list(quotes.values())
+
+    personas: Dict[str, Dict[str, Any]] = {}
+    for _, data in parts:
+        for p in data.get("personas") or []:
+            key = normalize(p.get("name") or "")
+            if key in personas:
+                _merge_persona(personas[key], p)
+            else:
+                personas[key] = {**p, "highlights": _dedupe(p.get("highlights") or [], _highlight_key), "low_points": _dedupe(p.get("low_points") or [], _highlight_key)}
+    merged["personas"] = list(personas.values())
+
+    moments: List[Dict[str, Any]] = []
+    for segment, data in parts:
+        for m in data.get("moments") or []:
+            m = dict(m)
+            seconds = parse_timestamp(m.get("timestamp"))
+            if seconds is not None:
+                m["timestamp"] = format_timestamp(segment.recording_start + min(seconds, segment.length))
+            if not any(_same_moment(m, kept) for kept in moments):
+                moments.append(m)
+    # Recording order; moments without a timestamp keep their place after the timed ones
+    merged["moments"] = sorted(moments, key=lambda m: (parse_timestamp(m.get("timestamp")) is None, parse_timestamp(m.get("timestamp")) or 0.0))
+    return merged
@@ -0,0 +1,70 @@
+"""
+Stored session transcripts.
+
+With GEMINI_TRANSCRIPT_FIRST (off by default), process_session_pipeline first transcribes the
+audio into speaker-attributed, timestamped turns (Transcript rows) and then analyses that text.
+Regenerating with mode=transcript re-runs only the analysis on the stored text, so the
+audio is not uploaded or sent to Gemini again.
+"""
+from typing import Any, Dict, List
+
+from sqlalchemy import insert
+from sqlmodel import Session, select, delete
+
+from ...models.models import Transcript
+from .segments import Segment, format_timestamp, parse_timestamp
+
+
+def store(db_engine, session_id: int, lines: List[Dict[str, Any]]) -> int:
+    """Replace the session's transcript with `lines` ({speaker, text, timestamp}) in one transaction."""
+    rows = [
+        {"session_id": session_id, "speaker": (line.get("speaker") or "").strip(), "text": line["text"].strip(), "timestamp": line.get("timestamp") or ""}
+        for line in lines if (line.get("text") or "").strip()
+    ]
+    with Session(db_engine) as db:
+        db.exec(delete(Transcript).where(Transcript.session_id == session_id))
+        if rows:
+            db.execute(insert(Transcript), rows)
+        db.commit()
+    return len(rows)
+
+
+def load(db: Session, session_id: int) -> List[Transcript]:
+    return list(db.exec(select(Transcript).where(Transcript.session_id == session_id).order_by(Transcript.id)).all())
+
+
+def format_lines(lines: List[Any]) -> str:
+    """The text the analysis prompt gets: one "[HH:MM:SS] Speaker: text" line per turn."""
+    formatted = []
+    for line in lines:
+        get = line.get if isinstance(line, dict) else lambda key: getattr(line, key)
+        prefix = f"[{get('timestamp')}] " if get("timestamp") else ""
+        formatted.append(f"{prefix}{get('speaker') or 'Unknown'}: {get('text')}")
+    return "\n".join(formatted)
+
+
+def merge_segment_lines(parts: List[tuple]) -> List[Dict[str, Any]]:
+    """
+    Join per-window transcripts [(Segment, lines)] into one in recording time. Where two
+    windows of a file overlap, each keeps the turns before/after the middle of the overlap.
+    """
+    parts = sorted(parts, key=lambda part: part[0].index)
+    merged = []
+    for i, (segment, lines) in enumerate(parts):
+        lower = _cut(parts[i - 1][0], segment) if i > 0 else None
+        upper = _cut(segment, parts[i + 1][0]) if i + 1 < len(parts) else None
+        for line in lines:
+            seconds = parse_timestamp(line.get("timestamp"))
+            if seconds is not None:
+                seconds = segment.recording_start + min(seconds, segment.length)
+                if (lower is not None and seconds < lower) or (upper is not None and seconds >= upper):
+                    continue
+            merged.append({**line, "timestamp": format_timestamp(seconds) if seconds is not None else ""})
+    return merged
+
+
+def _cut(earlier: Segment, later: Segment):
+    """Recording time splitting the overlap of two consecutive windows (None if they don't overlap)."""
+    if earlier.path != later.path or later.recording_start >= earlier.recording_end:
+        return None
+    return (later.recording_start + earlier.recording_end) / 2
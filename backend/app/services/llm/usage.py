@@ -0,0 +1,108 @@
+"""
+Gemini token and latency accounting.
+
+generate_with_fallback records every generate_content attempt, failed ones included, as a
+GeminiUsage row: the operation it was for (analysis, transcription, digest, ...), the
+session and/or campaign, the model, the token counts from the response's usage_metadata
+and the wall-clock seconds. summarize() aggregates them for the usage endpoints, and
+heaviest() lists single calls, so heavy prompts and the cost of a session can be found.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import case, func
+from sqlmodel import Session, select
+
+from ...models.models import GeminiUsage, Session as DBSessionEntry
+
+logger = logging.getLogger(__name__)
+
+# GeminiUsage column <- usage_metadata attribute
+TOKEN_FIELDS = {
+    "input_tokens": "prompt_token_count",
+    "output_tokens": "candidates_token_count",
+    "thinking_tokens": "thoughts_token_count",
+    "cached_tokens": "cached_content_token_count",
+    "total_tokens": "total_token_count",
+}
+GROUPS = ("operation", "model", "session_id", "campaign_id")
+
+
+def token_counts(response: Any) -> Dict[str, int]:
+    usage = getattr(response, "usage_metadata", None)
+    return {column: getattr(usage, attribute, None) or 0 for column, attribute in TOKEN_FIELDS.items()}
+
+
+def record(db_engine, operation: str, model: str, response: Any, seconds: float, status: str = "ok",
+           session_id: Optional[int] = None, campaign_id: Optional[int] = None):
+    """
+    Store one call in the pipeline's database. Blocking; generate_with_fallback runs it in a thread.
+    Best effort: accounting must never fail the pipeline making the call.
+    """
+    try:
+        with Session(db_engine) as db:
+            if campaign_id is None and session_id is not None:
+                session = db.get(DBSessionEntry, session_id)
+                campaign_id = session.campaign_id if session else None
+            db.add(GeminiUsage(
+                operation=operation,
+                session_id=session_id,
+                campaign_id=campaign_id,
+                model=model,
+                status=status,
+                seconds=seconds,
+                **token_counts(response),
+            ))
+            db.commit()
+    except Exception as e:
+        logger.warning("Could not record Gemini usage for %s (%s): %s", operation, model, e)
+
+
+def _filtered(query, session_id: Optional[int], campaign_id: Optional[int], operation: Optional[str], since: Optional[datetime]):
+    if session_id is not None:
+        query = query.where(GeminiUsage.session_id == session_id)
+    if campaign_id is not None:
+        query = query.where(GeminiUsage.campaign_id == campaign_id)
+    if operation:
+        query = query.where(GeminiUsage.operation == operation)
+    if since:
+        query = query.where(GeminiUsage.created_at >= since)
+    return query
+
+
+def _totals_columns():
+    return [
+        func.count(GeminiUsage.id).label("calls"),
+        func.sum(case((GeminiUsage.status != "ok", 1), else_=0)).label("failed_calls"),
+        *(func.sum(getattr(GeminiUsage, column)).label(column) for column in TOKEN_FIELDS),
+        func.sum(GeminiUsage.seconds).label("seconds"),
+        func.max(GeminiUsage.seconds).label("max_seconds"),
+    ]
+
+
+def _view(row) -> Dict[str, Any]:
+    # Sums are NULL over no rows; grouping columns (e.g. a None session_id) are kept as they are
+    view = {key: value if key in GROUPS else value or 0 for key, value in row._mapping.items()}
+    view["seconds"] = round(view["seconds"], 3)
+    view["max_seconds"] = round(view["max_seconds"], 3)
+    view["avg_seconds"] = round(view["seconds"] / view["calls"], 3) if view["calls"] else 0.0
+    return view
+
+
+def summarize(db: Session, group_by: List[str], session_id: Optional[int] = None, campaign_id: Optional[int] = None,
+              operation: Optional[str] = None, since: Optional[datetime] = None) -> Dict[str, Any]:
+    """Totals for the matching calls, plus the same totals per value of each `group_by` column (most tokens first)."""
+    result = {"totals": _view(db.exec(_filtered(select(*_totals_columns()), session_id, campaign_id, operation, since)).one())}
+    for group in group_by:
+        column = getattr(GeminiUsage, group)
+        query = _filtered(select(column, *_totals_columns()), session_id, campaign_id, operation, since)
+        rows = db.exec(query.group_by(column).order_by(func.sum(GeminiUsage.total_tokens).desc())).all()
+        result[f"by_{group}"] = [_view(row) for row in rows]
+    return result
+
+
+def heaviest(db: Session, order_by: str = "input_tokens", limit: int = 20, session_id: Optional[int] = None,
+             campaign_id: Optional[int] = None, operation: Optional[str] = None, since: Optional[datetime] = None) -> List[GeminiUsage]:
+    query = _filtered(select(GeminiUsage), session_id, campaign_id, operation, since)
+    return list(db.exec(query.order_by(getattr(GeminiUsage, order_by).desc(), GeminiUsage.id.desc()).limit(limit)).all())
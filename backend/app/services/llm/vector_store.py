@@ -1,95 +1,229 @@
 
 import json
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set, Tuple
 import numpy as np
-from sqlmodel import Session, select
-import ollama
+from sqlmodel import Session, select, delete
 
 from ...core.config import settings
 from ...models.models import VectorStore, Campaign, Session as DBSession, Persona, Highlight, Quote, Moment
+from .embedders import get_embedder, hashing_stats, OLLAMA, HASHING
+from .entity_index import entity_index, invalidate_on_commit
 
 logger = logging.getLogger(__name__)
 
+# Score added to chunks that mention a character named in the query
+ENTITY_BOOST = 0.15
+PIN_SCORE = 2.0
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row; all-zero rows stay zero (similarity 0)."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
 class VectorService:
     def __init__(self, db: Session):
         self.db = db
         self.model = settings.OLLAMA_MODEL
 
-    def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for a single text string using Ollama."""
+    def campaign_embedder(self, campaign_id: int) -> str:
+        """The embedder a campaign's index is searched with (see embedders.py)."""
+        campaign = self.db.get(Campaign, campaign_id)
+        return campaign.embedder if campaign and campaign.embedder else OLLAMA
+
+    def index_embedders(self, campaign_id: int) -> List[str]:
+        """Embedders every chunk is indexed with: the campaign's, plus the hashing fallback."""
+        primary = self.campaign_embedder(campaign_id)
+        if settings.EMBEDDING_FALLBACK and primary != HASHING:
+            return [HASHING, primary]
+        return [primary]
+
+    def generate_embedding(self, text: str, embedder: str = OLLAMA) -> List[float]:
+        """Generate embedding for a single text string (with Ollama unless told otherwise)."""
         try:
-            response = ollama.embeddings(model=self.model, prompt=text)
-            return response['embedding']
+            return get_embedder(embedder).embed_documents([text])[0]
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             # Return empty list or raise? raising is better to catch failures
             raise e
 
+    def generate_embeddings(self, texts: List[str], embedder: str = OLLAMA) -> List[List[float]]:
+        """Embed several texts with a single call."""
+        if not texts:
+            return []
+        try:
+            return get_embedder(embedder).embed_documents(texts)
+        except Exception as e:
+            logger.error(f"Error generating embeddings: {e}")
+            raise e
+
+    def embed_queries(self, campaign_id: int, queries: List[str]) -> Tuple[str, List[List[float]]]:
+        """
+        Embed search queries for a campaign with its embedder.
+        If that fails (e.g. Ollama is down) and the campaign has a hashing fallback index,
+        the hashing embedder is used instead. Returns (embedder used, embeddings).
+        """
+        embedder = self.campaign_embedder(campaign_id)
+        try:
+            return embedder, get_embedder(embedder).embed_queries(queries, campaign_id, self.db)
+        except Exception as e:
+            if embedder == HASHING or not settings.EMBEDDING_FALLBACK:
+                logger.error(f"Error generating query embeddings: {e}")
+                raise e
+            logger.warning(f"{embedder} embeddings unavailable ({e}); searching the hashing index instead")
+            return HASHING, get_embedder(HASHING).embed_queries(queries, campaign_id, self.db)
+
     def save_chunk(self, campaign_id: int, source_type: str, source_id: int, text: str):
-        """Generate embedding and save chunk to VectorStore."""
+        """
+        Generate embeddings and save the chunk to VectorStore, once per index embedder.
+        If only the fallback embedding could be made (Ollama down) the chunk is still saved.
+        """
         if not text or len(text.strip()) < 10:
             return  # Skip empty or too short chunks
 
-        embedding = self.generate_embedding(text)
-        
-        # Check if exists to update instead of duplicate
-        existing = self.db.exec(
-            select(VectorStore)
+        embedders = self.index_embedders(campaign_id)
+        for embedder in embedders:
+            # Check if exists to update instead of duplicate
+            existing = self.db.exec(
+                select(VectorStore)
+                .where(VectorStore.campaign_id == campaign_id)
+                .where(VectorStore.source_type == source_type)
+                .where(VectorStore.source_id == source_id)
+                .where(VectorStore.embedder == embedder)
+                .where(VectorStore.text_content == text) # Simple dedup
+            ).first()
+
+            if existing:
+                continue
+
+            try:
+                embedding = self.generate_embedding(text, embedder)
+            except Exception:
+                if len(embedders) > 1:
+                    logger.warning(f"Indexed {source_type}:{source_id} with the fallback embedder only")
+                    continue
+                raise
+
+            vector_entry = VectorStore(
+                campaign_id=campaign_id,
+                source_type=source_type,
+                source_id=source_id,
+                text_content=text,
+                embedding_json=json.dumps(embedding),
+                embedder=embedder
+            )
+            self.db.add(vector_entry)
+            self.db.commit()
+
+    def delete_chunks(self, campaign_id: int, source_type: str, source_ids) -> int:
+        """
+        Delete the campaign's chunks of one source type in a single statement. `source_ids` may be
+        a list or a select of ids. The caller commits; returns the number of rows deleted.
+        """
+        result = self.db.exec(
+            delete(VectorStore)
             .where(VectorStore.campaign_id == campaign_id)
             .where(VectorStore.source_type == source_type)
-            .where(VectorStore.source_id == source_id)
-            .where(VectorStore.text_content == text) # Simple dedup
-        ).first()
-
-        if existing:
-            return
-
-        vector_entry = VectorStore(
-            campaign_id=campaign_id,
-            source_type=source_type,
-            source_id=source_id,
-            text_content=text,
-            embedding_json=json.dumps(embedding)
+            .where(VectorStore.source_id.in_(source_ids))
         )
-        self.db.add(vector_entry)
-        self.db.commit()
+        if result.rowcount:
+            # A bulk DELETE skips the mapper events that keep these caches current
+            invalidate_on_commit(self.db, campaign_id)
+            hashing_stats.invalidate(campaign_id)
+        return result.rowcount
 
     def search(self, query: str, campaign_id: int, limit: int = 5) -> List[VectorStore]:
         """
         Semantic search for relevant chunks.
         Loads all campaign vectors (fine for small <10k chunks) and computes cosine similarity.
+        Chunks about characters named in the query are pinned/boosted (see entity_index).
         """
-        query_embedding = self.generate_embedding(query)
-        q_vec = np.array(query_embedding)
-        q_norm = np.linalg.norm(q_vec)
+        embedder, (query_embedding,) = self.embed_queries(campaign_id, [query])
+        chunks = self.load_chunks(campaign_id, embedder)
+        pinned, boosted = entity_index.chunk_targets(campaign_id, query, self.db)
+        return self.rank(query_embedding, chunks, limit, pinned, boosted)
 
+    def load_chunks(self, campaign_id: int, embedder: str = OLLAMA) -> List[VectorStore]:
+        """Fetch every chunk of a campaign indexed with `embedder`."""
         # distinct selection to avoid massive memory usage if we had millions, 
         # but here we fetch all for the campaign.
         # OPTIMIZATION: In production, use pgvector or separate vector DB. 
         # For local < 1GB text, in-memory numpy is insanely fast.
-        
-        chunks = self.db.exec(
-            select(VectorStore).where(VectorStore.campaign_id == campaign_id)
+        return self.db.exec(
+            select(VectorStore)
+            .where(VectorStore.campaign_id == campaign_id)
+            .where(VectorStore.embedder == embedder)
         ).all()
 
+    def rank(
+        self,
+        query_embedding: List[float],
+        chunks: List[VectorStore],
+        limit: int = 5,
+        pinned: Optional[Set[int]] = None,
+        boosted: Optional[Set[int]] = None
+    ) -> List[VectorStore]:
+        """
+        Order chunks by cosine similarity to the query embedding and keep the top `limit`.
+        Chunk ids in `pinned` always come first; those in `boosted` get ENTITY_BOOST added to their score.
+        """
+        return self.rank_many([query_embedding], chunks, limit, [pinned or set()], [boosted or set()])[0]
+
+    def rank_many(
+        self,
+        query_embeddings: List[List[float]],
+        chunks: List[VectorStore],
+        limit: int = 5,
+        pinned: Optional[List[Set[int]]] = None,
+        boosted: Optional[List[Set[int]]] = None
+    ) -> List[List[VectorStore]]:
+        """
+        Rank chunks for several queries at once.
+        All cosine similarities come from one (queries x chunks) matrix multiplication;
+        `pinned` and `boosted` optionally give per-query chunk ids to favour (see rank()).
+        """
+        return [
+            [chunk for chunk, _ in row]
+            for row in self.rank_many_scored(query_embeddings, chunks, limit, pinned, boosted)
+        ]
+
+    def rank_many_scored(
+        self,
+        query_embeddings: List[List[float]],
+        chunks: List[VectorStore],
+        limit: int = 5,
+        pinned: Optional[List[Set[int]]] = None,
+        boosted: Optional[List[Set[int]]] = None
+    ) -> List[List[Tuple[VectorStore, float]]]:
+        """Like rank_many, but pairs each chunk with its raw cosine similarity (before any boost)."""
         if not chunks:
+            return [[] for _ in query_embeddings]
+        if not query_embeddings:
             return []
 
-        scores = []
-        for chunk in chunks:
-            vec = np.array(json.loads(chunk.embedding_json))
-            denom = (np.linalg.norm(vec) * q_norm)
-            if denom == 0:
-                similarity = 0
-            else:
-                similarity = np.dot(vec, q_vec) / denom
-            scores.append((similarity, chunk))
-
-        # Sort by similarity desc
-        scores.sort(key=lambda x: x[0], reverse=True)
-        
-        return [s[1] for s in scores[:limit]]
+        matrix = _normalize_rows(np.array([json.loads(c.embedding_json) for c in chunks], dtype=float))
+        queries = _normalize_rows(np.array(query_embeddings, dtype=float))
+        similarities = queries @ matrix.T
+        scores = similarities.copy()
+
+        if pinned or boosted:
+            column = {c.id: i for i, c in enumerate(chunks)}
+            for row, (pin_ids, boost_ids) in enumerate(zip(pinned or [set()] * len(queries), boosted or [set()] * len(queries))):
+                boost_cols = [column[i] for i in boost_ids if i in column]
+                pin_cols = [column[i] for i in pin_ids if i in column]
+                scores[row, boost_cols] += ENTITY_BOOST
+                # Cosine similarity is at most 1, so this puts pinned chunks above everything else
+                scores[row, pin_cols] += PIN_SCORE
+
+        # Stable sort keeps insertion order among equal scores
+        top = np.argsort(-scores, axis=1, kind="stable")[:, :limit]
+        return [
+            [(chunks[i], float(similarities[row, i])) for i in cols]
+            for row, cols in enumerate(top)
+        ]
 
     def reindex_campaign(self, campaign_id: int):
         """
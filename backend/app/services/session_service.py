@@ -1,18 +1,27 @@
 from fastapi import HTTPException, BackgroundTasks
 from sqlmodel import Session as DBSession
 import json
+import time
 
 from ..models.models import Session
 from ..models.enums import ProcessingStatus
-from ..services.llm.generators import process_session_pipeline, process_text_session_pipeline
+from ..services.llm.generators import process_session_pipeline, process_text_session_pipeline, process_transcript_session_pipeline, replay_session_analysis
+from ..services.llm import transcripts
 from ..core.database import engine
+from . import jobs
 
 class SessionService:
     @staticmethod
-    def regenerate_session(session_id: int, db: DBSession, background_tasks: BackgroundTasks) -> dict:
+    def regenerate_session(session_id: int, db: DBSession, background_tasks: BackgroundTasks, mode: str = "full", run_id: int = None) -> dict:
         session = db.get(Session, session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
+
+        if mode == "replay":
+            return SessionService.replay_session(session_id, run_id)
+
+        if mode == "transcript" and not transcripts.load(db, session_id):
+            raise HTTPException(status_code=404, detail=f"No transcript stored for session {session_id}")
             
         # Determine paths (check new relation first, then fallback)
         paths = []
@@ -31,9 +40,27 @@ class SessionService:
         
         # Logic for text vs audio pipeline
         # Naive check: if first file ends with .txt, assume text session
-        if paths and paths[0].endswith(".txt"):
-             background_tasks.add_task(process_text_session_pipeline, session.id, engine)
+        if mode == "transcript":
+             job = jobs.dispatch(jobs.TRANSCRIPT_SESSION, session.id, db, background_tasks, process_transcript_session_pipeline)
+        elif paths and paths[0].endswith(".txt"):
+             job = jobs.dispatch(jobs.TEXT_SESSION, session.id, db, background_tasks, process_text_session_pipeline)
         else:
-             background_tasks.add_task(process_session_pipeline, session.id, engine)
+             job = jobs.dispatch(jobs.SESSION, session.id, db, background_tasks, process_session_pipeline)
 
-        return {"ok": True, "status": ProcessingStatus.PROCESSING}
+        return {"ok": True, "status": ProcessingStatus.PROCESSING, "job_id": job.id if job else None}
+
+    @staticmethod
+    def replay_session(session_id: int, run_id: int = None) -> dict:
+        """Re-saves a stored analysis response without calling Gemini."""
+        started = time.perf_counter()
+        try:
+            run = replay_session_analysis(session_id, engine, run_id)
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        return {
+            "ok": True,
+            "status": ProcessingStatus.COMPLETED,
+            "mode": "replay",
+            "analysis_run_id": run.id,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
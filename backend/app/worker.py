@@ -0,0 +1,138 @@
+"""
+Standalone worker for queued session pipelines (settings.PIPELINE_EXECUTOR = "queue").
+
+    python -m app.worker --slots 4
+
+Each slot claims a job from the Job table, runs its pipeline while renewing the lease,
+and records success or a failed attempt. Several workers can share one database.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import uuid
+from typing import Optional
+
+from sqlmodel import Session
+
+from .core.config import settings
+from .core.database import engine, create_db_and_tables
+from .models.models import Job
+from .services import jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    def __init__(
+        self,
+        slots: Optional[int] = None,
+        worker_id: Optional[str] = None,
+        poll_interval: Optional[float] = None,
+        lease_seconds: Optional[int] = None
+    ):
+        self.slots = slots or settings.WORKER_SLOTS
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.poll_interval = poll_interval if poll_interval is not None else settings.WORKER_POLL_INTERVAL
+        self.lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+        self.stopping = asyncio.Event()
+
+    async def run(self):
+        logger.info("Worker %s starting with %s slots", self.worker_id, self.slots)
+        await asyncio.gather(*(self._slot(i) for i in range(self.slots)))
+        logger.info("Worker %s stopped", self.worker_id)
+
+    def stop(self):
+        """Stop claiming new jobs; running pipelines are allowed to finish."""
+        self.stopping.set()
+
+    async def _slot(self, index: int):
+        while not self.stopping.is_set():
+            try:
+                ran = await self.run_one()
+            except Exception:
+                logger.exception("Slot %s: unexpected error", index)
+                ran = False
+            if not ran:
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_one(self) -> bool:
+        """Claim and run a single job. Returns False if nothing was due."""
+        with Session(engine) as db:
+            job = jobs.claim(db, self.worker_id, self.lease_seconds)
+        if not job:
+            return False
+        await self._execute(job)
+        return True
+
+    async def _execute(self, job: Job):
+        logger.info("Running %s job %s for %s (attempt %s/%s)", job.kind, job.id, job.target_id, job.attempts, job.max_attempts)
+        token = jobs._current_job.set(job.id)
+        lease = None
+        try:
+            pipeline = jobs.pipeline_for(job.kind)
+            run = asyncio.create_task(pipeline(job.target_id, engine, raise_on_error=True))
+            lease = asyncio.create_task(self._keep_lease(job.id, run))
+            try:
+                await run
+            finally:
+                lease.cancel()
+        except asyncio.CancelledError:
+            if not (lease and lease.done() and not lease.cancelled() and lease.result()):
+                raise
+            # Our lease expired and another worker claimed the job; it owns it now
+            logger.warning("Job %s: lease lost, abandoning this run", job.id)
+            return
+        except Exception as e:
+            with Session(engine) as db:
+                jobs.fail(db, job.id, self.worker_id, str(e) or type(e).__name__)
+            return
+        finally:
+            jobs._current_job.reset(token)
+
+        with Session(engine) as db:
+            jobs.complete(db, job.id, self.worker_id)
+        logger.info("Job %s succeeded", job.id)
+
+    async def _keep_lease(self, job_id: int, run: asyncio.Task) -> bool:
+        """Heartbeat until the run finishes. Returns True if the lease was lost and the run cancelled."""
+        interval = max(1.0, self.lease_seconds / 3)
+        while not run.done():
+            await asyncio.sleep(interval)
+            with Session(engine) as db:
+                still_ours = jobs.heartbeat(db, job_id, self.worker_id, self.lease_seconds)
+            if not still_ours:
+                run.cancel()
+                return True
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued session processing jobs.")
+    parser.add_argument("--slots", type=int, default=settings.WORKER_SLOTS, help="Jobs to run concurrently")
+    parser.add_argument("--poll-interval", type=float, default=settings.WORKER_POLL_INTERVAL)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    create_db_and_tables()
+    worker = Worker(slots=args.slots, poll_interval=args.poll_interval)
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, worker.stop)
+            except NotImplementedError:  # Windows
+                pass
+        await worker.run()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark for the save stage of the analysis pipeline (_save_analysis_to_db).
+
+Builds a throwaway SQLite database with a campaign that already has many personas and a
+session that already has rows, then saves a large synthetic analysis payload into it and
+reports wall time and the number of SQL statements issued. No model or network is used
+(the payload has no summary, so nothing is sent to the embedder).
+
+    python backend/scripts/bench_save_analysis.py --personas 200 --existing 400 --quotes 500 --moments 300
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Add backend to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from sqlalchemy import event
+from sqlmodel import SQLModel, Session, create_engine, func, select
+
+from backend.app.models.models import Campaign, Persona, Highlight, Quote, Moment, Session as DBSessionEntry
+from backend.app.services.llm.generators import _save_analysis_to_db
+
+SYLLABLES = ["ka", "ren", "vel", "tho", "mir", "sa", "dun", "el", "gor", "ith", "la", "vex", "ny", "bra", "zul"]
+
+
+def fake_name(rng: random.Random) -> str:
+    first = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+    last = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+    return f"{first} {last}"
+
+
+def build_payload(rng: random.Random, known: list, personas: int, quotes: int, moments: int, highlights: int) -> dict:
+    # Half the extracted personas are already known (sometimes with different casing), half are new
+    names = [rng.choice(known).upper() if i % 4 == 0 else rng.choice(known) for i in range(personas // 2)]
+    names += [fake_name(rng) for _ in range(personas - len(names))]
+    return {
+        "summary": "",
+        "personas": [
+            {
+                "name": name,
+                "role": "NPC",
+                "description": f"{name} was met on the road.",
+                "race": rng.choice(["Elf", "Human", "Dwarf", None]),
+                "highlights": [f"{name} did something memorable #{j}" for j in range(highlights)],
+                "low_points": [f"{name} fumbled #{j}" for j in range(highlights // 2)],
+            }
+            for name in names
+        ],
+        # Quotes repeat now and then, as they do in real responses
+        "memorable_quotes": [
+            {"speaker": rng.choice(names + ["Unknown"]), "quote": f"Line {rng.randint(0, quotes)} of the night", "reasoning": ""}
+            for _ in range(quotes)
+        ],
+        "moments": [{"title": f"Moment {rng.randint(0, moments)}", "description": "Something happened."} for _ in range(moments)],
+        "highlights": [{"name": None, "highlight": f"Session highlight {i}"} for i in range(highlights * 10)],
+        "low_points": [{"name": None, "highlight": f"Session low point {i}"} for i in range(highlights * 5)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--existing", type=int, default=400, help="personas already in the campaign")
+    parser.add_argument("--personas", type=int, default=200, help="personas in the payload")
+    parser.add_argument("--quotes", type=int, default=500)
+    parser.add_argument("--moments", type=int, default=300)
+    parser.add_argument("--highlights", type=int, default=4, help="highlights per persona")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        SQLModel.metadata.create_all(db_engine)
+
+        with Session(db_engine) as db:
+            campaign = Campaign(name="Bench Campaign")
+            db.add(campaign)
+            db.commit()
+            session = DBSessionEntry(name="Bench Session", campaign_id=campaign.id, audio_file_paths="[]")
+            db.add(session)
+            db.commit()
+            known = []
+            for i in range(args.existing):
+                name = fake_name(rng)
+                known.append(name)
+                db.add(Persona(name=name, role="NPC", description="", campaign_id=campaign.id, aliases=json.dumps([f"{name.split()[0]} the {i}"])))
+            # Rows left from an earlier save, which the payload partly repeats
+            for i in range(50):
+                db.add(Highlight(text=f"Session highlight {i}", type="high", session_id=session.id, campaign_id=campaign.id))
+                db.add(Quote(text=f"Line {i} of the night", session_id=session.id, campaign_id=campaign.id))
+                db.add(Moment(title=f"Moment {i}", description="", session_id=session.id))
+            db.commit()
+            session_id = session.id
+
+        payload = build_payload(rng, known, args.personas, args.quotes, args.moments, args.highlights)
+
+        statements = []
+        event.listen(db_engine, "before_cursor_execute", lambda *a: statements.append(1))
+        started = time.perf_counter()
+        with Session(db_engine) as db:
+            _save_analysis_to_db(session_id, payload, db)
+        elapsed = time.perf_counter() - started
+
+        with Session(db_engine) as db:
+            counts = {
+                model.__tablename__: db.exec(select(func.count()).select_from(model)).one()
+                for model in (Persona, Highlight, Quote, Moment)
+            }
+        db_engine.dispose()
+
+    print(json.dumps({
+        "payload": {k: len(v) for k, v in payload.items() if isinstance(v, list)},
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "sql_statements": len(statements),
+        "rows_after": counts,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
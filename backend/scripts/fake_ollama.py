@@ -0,0 +1,261 @@
+"""
+Local stand-in for the Ollama HTTP API, for benchmarks and regression tests.
+
+Implements /api/embeddings, /api/embed, /api/chat (streaming and non-streaming) and /api/tags.
+Embeddings are deterministic hashed bag-of-words vectors (texts sharing words land close together,
+so retrieval behaves sensibly), and answers are deterministic token streams with configurable delays.
+
+Usage:
+    python backend/scripts/fake_ollama.py --port 11435 --token-delay 0.02
+    OLLAMA_HOST=http://127.0.0.1:11435 poetry run uvicorn app.main:app
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+WORD_RE = re.compile(r"\w+")
+
+ANSWER_TEMPLATE = "The records show that {subject} is written of in the archives. It is written that the tale continues."
+
+
+def hash_embedding(text: str, dim: int) -> List[float]:
+    """Deterministic, L2-normalized hashed bag-of-words embedding."""
+    vec = [0.0] * dim
+    for word in WORD_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        idx = int.from_bytes(digest[:4], "little") % dim
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vec[idx] += sign
+    norm = sum(v * v for v in vec) ** 0.5
+    if norm == 0:
+        # Empty text: a fixed unit vector so cosine similarity stays defined
+        vec[0] = 1.0
+        return vec
+    return [v / norm for v in vec]
+
+
+def fake_answer_tokens(messages: List[dict], max_tokens: int) -> List[str]:
+    """A deterministic answer derived from the last user message, split into word tokens."""
+    question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    # Drop the persona reminder the librarian appends to the last user message
+    question = question.split("\n\n(Remember:")[0]
+    words = WORD_RE.findall(question)
+    subject = " ".join(words[-3:]) if words else "this"
+    tokens = [w + " " for w in ANSWER_TEMPLATE.format(subject=subject).split()]
+    return tokens[:max_tokens]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOllama/0.1"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # --- helpers ---
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b"{}"
+        return json.loads(body or b"{}")
+
+    def _send_json(self, payload: dict, status: int = 200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _now(self) -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    # --- routes ---
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self._send_json({"models": [
+                {"name": name, "model": name, "modified_at": self._now(), "size": 0, "digest": hashlib.sha256(name.encode()).hexdigest(), "details": {}}
+                for name in self.server.models
+            ]})
+        elif self.path in ("/", ""):
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+        except json.JSONDecodeError:
+            self._send_json({"error": "invalid JSON"}, status=400)
+            return
+
+        path = self.path.rstrip("/")
+        with self.server.lock:
+            self.server.calls[path] += 1
+        if path == "/api/embeddings":
+            time.sleep(self.server.embed_delay)
+            self._send_json({"embedding": hash_embedding(payload.get("prompt", ""), self.server.dim)})
+        elif path == "/api/embed":
+            inputs = payload.get("input", "")
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep(self.server.embed_delay)
+            self._send_json({
+                "model": payload.get("model", ""),
+                "embeddings": [hash_embedding(text, self.server.dim) for text in inputs],
+            })
+        elif path == "/api/chat":
+            self._chat(payload)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _chat(self, payload: dict):
+        server = self.server
+        model = payload.get("model", "")
+        messages = payload.get("messages", [])
+        prompt_chars = sum(len(m.get("content", "")) for m in messages)
+        tokens = fake_answer_tokens(messages, server.max_tokens)
+        stats = {
+            "total_duration": 0,
+            "prompt_eval_count": max(1, prompt_chars // 4),
+            "prompt_eval_duration": int(server.first_token_delay * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": max(1, int(len(tokens) * server.token_delay * 1e9)),
+        }
+        started = time.perf_counter()
+        time.sleep(server.first_token_delay)
+
+        # Ollama streams unless told otherwise
+        if not payload.get("stream", True):
+            time.sleep(server.token_delay * len(tokens))
+            stats["total_duration"] = int((time.perf_counter() - started) * 1e9)
+            self._send_json({
+                "model": model,
+                "created_at": self._now(),
+                "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                "done": True,
+                "done_reason": "stop",
+                **stats,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(server.token_delay)
+                self._write_chunk({"model": model, "created_at": self._now(), "message": {"role": "assistant", "content": token}, "done": False})
+            stats["total_duration"] = int((time.perf_counter() - started) * 1e9)
+            self._write_chunk({"model": model, "created_at": self._now(), "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop", **stats})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-answer (e.g. cancelled generation)
+            with server.lock:
+                server.aborted_streams += 1
+
+    def _write_chunk(self, obj: dict):
+        data = (json.dumps(obj) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        dim: int = 256,
+        token_delay: float = 0.0,
+        first_token_delay: float = 0.0,
+        embed_delay: float = 0.0,
+        max_tokens: int = 64,
+        models: List[str] = None,
+        verbose: bool = False,
+    ):
+        super().__init__((host, port), FakeOllamaHandler)
+        self.dim = dim
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.embed_delay = embed_delay
+        self.max_tokens = max_tokens
+        self.models = models or ["phi4:latest"]
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.aborted_streams = 0
+        self.calls = Counter()  # POST path -> request count
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllamaServer":
+        """Serve from a background thread (for tests and in-process benchmarks)."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a deterministic fake Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed tokens")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="Seconds before the first token (prompt eval)")
+    parser.add_argument("--embed-delay", type=float, default=0.01, help="Seconds per embedding request")
+    parser.add_argument("--max-tokens", type=int, default=64, help="Maximum tokens per answer")
+    parser.add_argument("--model", action="append", dest="models", help="Model name to advertise (repeatable)")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(
+        host=args.host,
+        port=args.port,
+        dim=args.dim,
+        token_delay=args.token_delay,
+        first_token_delay=args.first_token_delay,
+        embed_delay=args.embed_delay,
+        max_tokens=args.max_tokens,
+        models=args.models,
+        verbose=args.verbose,
+    )
+    print(f"Fake Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Load-test harness for the librarian chat and indexing endpoints.
+
+Drives /api/chat/librarian (or /api/chat/librarian/stream) with N concurrent clients,
+optionally re-indexes the campaign via /api/chat/index/{id} first, and reports
+p50/p95/p99 latency and throughput. Pair it with scripts/fake_ollama.py for
+deterministic, model-free runs:
+
+    python backend/scripts/fake_ollama.py --port 11435 &
+    OLLAMA_HOST=http://127.0.0.1:11435 poetry run uvicorn app.main:app --port 8000 &
+    python backend/scripts/load_test.py --seed --requests 200 --concurrency 8 --stream
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+DEFAULT_QUESTIONS = [
+    "Who is {name}?",
+    "What race is {name}?",
+    "What happened in {session}?",
+    "Who plays {name}?",
+    "What did {name} do in {session}?",
+    "Is {name} still alive?",
+    "Summarize {session}.",
+]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile: the smallest value with at least pct% of the values at or below it."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(label: str, latencies: List[float], errors: int, wall_seconds: float, extra: Dict[str, List[float]] = None) -> Dict[str, object]:
+    report = {
+        "label": label,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+    }
+    for name, values in {"latency_ms": latencies, **(extra or {})}.items():
+        if values:
+            report[name] = {
+                "p50": round(percentile(values, 50), 1),
+                "p95": round(percentile(values, 95), 1),
+                "p99": round(percentile(values, 99), 1),
+                "mean": round(statistics.fmean(values), 1),
+                "max": round(max(values), 1),
+            }
+    return report
+
+
+async def seed_campaign(client: httpx.AsyncClient, personas: int, sessions: int) -> Dict[str, object]:
+    """Create a synthetic campaign with personas and summarized sessions."""
+    res = await client.post("/campaigns/", json={"name": f"Load Test {int(time.time())}", "description": "Synthetic load-test campaign"})
+    res.raise_for_status()
+    campaign_id = res.json()["id"]
+
+    races = ["Human", "Elf", "Dwarf", "Tiefling", "Goliath", "Halfling"]
+    classes = ["Wizard", "Fighter", "Rogue", "Cleric", "Barbarian", "Ranger"]
+    names = [f"Hero{i}" for i in range(personas)]
+    for i, name in enumerate(names):
+        res = await client.post("/personas/", json={
+            "name": name,
+            "role": "PC" if i < 4 else "NPC",
+            "description": f"{name} is a {races[i % len(races)]} {classes[i % len(classes)]} with a long and storied past.",
+            "race": races[i % len(races)],
+            "class_name": classes[i % len(classes)],
+            "campaign_id": campaign_id,
+        })
+        res.raise_for_status()
+
+    session_names = [f"Session {i + 1}" for i in range(sessions)]
+    for i, name in enumerate(session_names):
+        a, b = names[i % len(names)], names[(i + 1) % len(names)]
+        res = await client.post("/sessions/", json={
+            "name": name,
+            "campaign_id": campaign_id,
+            "status": "completed",
+            "summary": f"In {name}, {a} and {b} explored the ruins beneath the city, fought a band of cultists and recovered an ancient relic.",
+        })
+        res.raise_for_status()
+
+    return {"campaign_id": campaign_id, "names": names, "sessions": session_names}
+
+
+async def run_index(client: httpx.AsyncClient, campaign_id: int, runs: int) -> Dict[str, object]:
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        try:
+            res = await client.post(f"/api/chat/index/{campaign_id}")
+            res.raise_for_status()
+            latencies.append((time.perf_counter() - t0) * 1000)
+        except httpx.HTTPError:
+            errors += 1
+    return summarize("index", latencies, errors, time.perf_counter() - started)
+
+
+async def one_chat(client: httpx.AsyncClient, campaign_id: int, question: str, stream: bool) -> Dict[str, float]:
+    payload = {"campaign_id": campaign_id, "messages": [{"role": "user", "content": question}]}
+    t0 = time.perf_counter()
+    if not stream:
+        res = await client.post("/api/chat/librarian", json=payload)
+        res.raise_for_status()
+        return {"latency_ms": (time.perf_counter() - t0) * 1000}
+
+    ttft = None
+    async with client.stream("POST", "/api/chat/librarian/stream", json=payload) as res:
+        res.raise_for_status()
+        event = None
+        async for line in res.aiter_lines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                if event == "error":
+                    raise httpx.HTTPError(line[5:].strip())
+                if event is None and ttft is None and line[5:].strip() != "[DONE]":
+                    ttft = (time.perf_counter() - t0) * 1000
+            elif not line:
+                event = None
+    result = {"latency_ms": (time.perf_counter() - t0) * 1000}
+    if ttft is not None:
+        result["ttft_ms"] = ttft
+    return result
+
+
+async def run_chat(client: httpx.AsyncClient, campaign_id: int, questions: List[str], requests: int, concurrency: int, stream: bool) -> Dict[str, object]:
+    latencies, ttfts, errors = [], [], 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(questions[i % len(questions)])
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                question = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                result = await one_chat(client, campaign_id, question, stream)
+                latencies.append(result["latency_ms"])
+                if "ttft_ms" in result:
+                    ttfts.append(result["ttft_ms"])
+            except httpx.HTTPError:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    label = "librarian/stream" if stream else "librarian"
+    return summarize(label, latencies, errors, time.perf_counter() - started, {"ttft_ms": ttfts})
+
+
+async def main_async(args):
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+        campaign_id = args.campaign_id
+        names, session_names = ["the villain"], ["the last session"]
+        if args.seed:
+            seeded = await seed_campaign(client, args.seed_personas, args.seed_sessions)
+            campaign_id = seeded["campaign_id"]
+            names, session_names = seeded["names"], seeded["sessions"]
+            print(f"Seeded campaign {campaign_id}")
+        if campaign_id is None:
+            raise SystemExit("Pass --campaign-id or --seed")
+
+        if args.questions:
+            with open(args.questions, "r", encoding="utf-8") as f:
+                questions = [line.strip() for line in f if line.strip()]
+        else:
+            rng = random.Random(args.random_seed)
+            questions = [
+                rng.choice(DEFAULT_QUESTIONS).format(name=rng.choice(names), session=rng.choice(session_names))
+                for _ in range(max(args.requests, 1))
+            ]
+
+        reports = []
+        if args.index_runs or args.seed:
+            reports.append(await run_index(client, campaign_id, max(args.index_runs, 1)))
+        if args.requests:
+            reports.append(await run_chat(client, campaign_id, questions, args.requests, args.concurrency, args.stream))
+
+        print(json.dumps(reports, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the librarian chat and indexing endpoints.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--campaign-id", type=int)
+    parser.add_argument("--seed", action="store_true", help="Create a synthetic campaign (and index it) first")
+    parser.add_argument("--seed-personas", type=int, default=12)
+    parser.add_argument("--seed-sessions", type=int, default=20)
+    parser.add_argument("--index-runs", type=int, default=0, help="Times to call /api/chat/index before chatting")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--stream", action="store_true", help="Use the SSE endpoint and also report time-to-first-token")
+    parser.add_argument("--questions", help="File with one question per line")
+    parser.add_argument("--random-seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,549 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import json
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from backend.app.main import app
+from backend.app.core.config import settings
+from backend.app.services.llm import librarian
+from backend.app.services.llm.librarian import ask_librarian, collect_answer
+from backend.app.services.llm.metrics import metrics, LibrarianMetrics, Histogram, LATENCY_BUCKETS_MS
+from backend.app.services.llm.ollama_client import build_librarian_messages
+from backend.app.services.llm.scheduler import scheduler
+from backend.app.core.database import engine
+from backend.app.models.models import Persona
+from sqlmodel import Session
+from backend.scripts.fake_ollama import FakeOllamaServer
+from backend.scripts.load_test import percentile
+
+client = TestClient(app)
+
+
+def _create_campaign(name: str) -> int:
+    mutation = f"""
+    mutation {{
+        create_campaign(name: "{name}", description: "Test") {{
+            id
+        }}
+    }}
+    """
+    res = client.post("/graphql", json={"query": mutation})
+    return res.json()["data"]["create_campaign"]["id"]
+
+
+def test_librarian_conversation_is_persisted_and_compacted():
+    campaign_id = _create_campaign("Chat Test Campaign")
+    prompts = []
+
+    def fake_chat(messages, context="", model=None, history_summary="", stats=None):
+        prompts.append((list(messages), history_summary))
+        return f"Answer {len(prompts)}"
+
+    with patch("backend.app.services.llm.librarian.chat_with_librarian", side_effect=fake_chat), \
+         patch("backend.app.services.llm.librarian._search", return_value=[]), \
+         patch("backend.app.services.llm.conversations.summarize_conversation", return_value="They asked about Grog.") as mock_summarize, \
+         patch.object(settings, "CHAT_HISTORY_WINDOW", 2), \
+         patch.object(settings, "CHAT_COMPACTION_THRESHOLD", 3):
+
+        res = client.post("/api/chat/librarian", json={
+            "campaign_id": campaign_id,
+            "messages": [{"role": "user", "content": "Who is Grog?"}]
+        })
+        assert res.status_code == 200
+        conversation_id = res.json()["conversation_id"]
+        timings = res.json()["timings"]
+        assert {"queue_wait_ms", "pack_ms", "ttft_ms", "total_ms"} <= set(timings)
+
+        # Follow-ups only send the new message
+        for question in ["What race is he?", "Is he alive?"]:
+            res = client.post("/api/chat/librarian", json={
+                "campaign_id": campaign_id,
+                "conversation_id": conversation_id,
+                "messages": [{"role": "user", "content": question}]
+            })
+            assert res.status_code == 200
+            assert res.json()["conversation_id"] == conversation_id
+
+        # Messages are sent verbatim until they are folded into the summary, so the prompt stays bounded
+        assert all(len(messages) <= 3 for messages, _ in prompts)
+        assert prompts[-1][1] == "They asked about Grog."
+        assert prompts[-1][0][-1]["content"] == "Is he alive?"
+
+        mock_summarize.assert_called()
+        res = client.get(f"/api/chat/conversations/{conversation_id}")
+        data = res.json()
+        assert len(data["messages"]) == 6
+        assert data["summary"] == "They asked about Grog."
+        assert data["compacted_count"] == 4
+
+
+def test_early_turns_stay_in_the_prompt_until_compacted():
+    campaign_id = _create_campaign("Chat Window Campaign")
+    prompts = []
+
+    def fake_chat(messages, context="", model=None, history_summary="", stats=None):
+        prompts.append(list(messages))
+        return f"Answer {len(prompts)}"
+
+    with patch("backend.app.services.llm.librarian.chat_with_librarian", side_effect=fake_chat), \
+         patch("backend.app.services.llm.librarian._search", return_value=[]), \
+         patch("backend.app.services.llm.conversations.summarize_conversation") as mock_summarize, \
+         patch.object(settings, "CHAT_HISTORY_WINDOW", 6), \
+         patch.object(settings, "CHAT_COMPACTION_THRESHOLD", 12):
+        conversation_id = None
+        for question in ["Who is Grog?", "What race is he?", "Is he alive?", "Who is his friend?"]:
+            res = client.post("/api/chat/librarian", json={
+                "campaign_id": campaign_id,
+                "conversation_id": conversation_id,
+                "messages": [{"role": "user", "content": question}]
+            })
+            assert res.status_code == 200
+            conversation_id = res.json()["conversation_id"]
+
+    # 7 messages sent, more than the window but below the threshold: none was dropped
+    mock_summarize.assert_not_called()
+    assert [m["content"] for m in prompts[-1]] == [
+        "Who is Grog?", "Answer 1", "What race is he?", "Answer 2", "Is he alive?", "Answer 3", "Who is his friend?"
+    ]
+    assert len(client.get(f"/api/chat/conversations/{conversation_id}").json()["messages"]) == 8
+
+    # ...and none is dropped on the way to Ollama either
+    with patch.object(settings, "CHAT_HISTORY_WINDOW", 6):
+        payload = build_librarian_messages(prompts[-1], context="CONTEXT")
+    assert payload[0]["role"] == "system" and "CONTEXT" in payload[0]["content"]
+    assert [m["content"] for m in payload[1:-1]] == [m["content"] for m in prompts[-1][:-1]]
+    assert payload[-1]["content"].startswith("Who is his friend?")
+
+
+def test_librarian_rejects_unknown_conversation():
+    campaign_id = _create_campaign("Chat Missing Conversation")
+    res = client.post("/api/chat/librarian", json={
+        "campaign_id": campaign_id,
+        "conversation_id": 999999,
+        "messages": [{"role": "user", "content": "Hello?"}]
+    })
+    assert res.status_code == 404
+
+
+def test_identical_concurrent_requests_share_one_generation():
+    generations = []
+
+    async def fake_stream(messages, context="", model=None, history_summary="", stats=None):
+        generations.append(messages[-1]["content"])
+        for token in ["The ", "records ", "show..."]:
+            await asyncio.sleep(0.01)
+            yield token
+
+    async def scenario():
+        first = ask_librarian(1, [{"role": "user", "content": "Who is Grog?"}], stream=True)
+        # Same question modulo case/whitespace joins the same run
+        second = ask_librarian(1, [{"role": "user", "content": "  who is   grog? "}], stream=True)
+        other_campaign = ask_librarian(2, [{"role": "user", "content": "Who is Grog?"}], stream=True)
+        return await asyncio.gather(collect_answer(first), collect_answer(second), collect_answer(other_campaign))
+
+    with patch("backend.app.services.llm.librarian._search", return_value=[]), \
+         patch("backend.app.services.llm.librarian.stream_librarian_response", side_effect=fake_stream):
+        first, second, other = asyncio.run(scenario())
+
+    assert len(generations) == 2
+    assert first["response"] == second["response"] == other["response"] == "The records show..."
+
+
+def test_generation_is_cancelled_when_every_subscriber_leaves():
+    aborted = []
+
+    async def endless_stream(messages, context="", model=None, history_summary="", stats=None):
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield "more "
+        finally:
+            aborted.append(True)
+
+    async def scenario():
+        events = ask_librarian(1, [{"role": "user", "content": "Tell me everything"}], stream=True)
+        tokens = 0
+        async for event, _ in events:
+            if event == "token":
+                tokens += 1
+                if tokens == 3:
+                    break
+        events.close()
+        await asyncio.sleep(0.05)
+        return scheduler.stats()["active"]
+
+    cancelled_before = metrics.counters["generations_cancelled"]
+    with patch("backend.app.services.llm.librarian._search", return_value=[]), \
+         patch("backend.app.services.llm.librarian.stream_librarian_response", side_effect=endless_stream):
+        active = asyncio.run(scenario())
+
+    assert aborted == [True]
+    assert active == 0
+    assert metrics.counters["generations_cancelled"] == cancelled_before + 1
+
+
+def test_failed_stream_sends_an_error_event_and_is_not_persisted():
+    campaign_id = _create_campaign("Chat Failure Campaign")
+
+    async def failing_stream(messages, context="", model=None, history_summary="", stats=None):
+        yield "The records "
+        raise RuntimeError("Ollama chat failed: connection reset")
+
+    completed_before = metrics.counters["generations_completed"]
+    with patch("backend.app.services.llm.librarian._search", return_value=[]), \
+         patch("backend.app.services.llm.librarian.stream_librarian_response", side_effect=failing_stream):
+        with client.stream("POST", "/api/chat/librarian/stream", json={
+            "campaign_id": campaign_id,
+            "messages": [{"role": "user", "content": "Who is Grog?"}]
+        }) as res:
+            body = "".join(res.iter_text())
+
+    assert "event: error" in body and "connection reset" in body
+    assert "[Error" not in body and "data: [DONE]" not in body
+    assert metrics.counters["generations_completed"] == completed_before
+    conversation_id = int(body.split("event: conversation\ndata: ")[1].split("\n")[0])
+    # The question is kept only with its answer, so a retry doesn't send it twice
+    assert client.get(f"/api/chat/conversations/{conversation_id}").json()["messages"] == []
+
+    # Retried (without streaming): the prompt and the conversation hold the question once
+    prompts = []
+
+    def fake_chat(messages, context="", model=None, history_summary="", stats=None):
+        prompts.append(list(messages))
+        return "Grog is a goliath."
+
+    with patch("backend.app.services.llm.librarian._search", return_value=[]), \
+         patch("backend.app.services.llm.librarian.chat_with_librarian", side_effect=fake_chat):
+        res = client.post("/api/chat/librarian", json={
+            "campaign_id": campaign_id,
+            "conversation_id": conversation_id,
+            "messages": [{"role": "user", "content": "Who is Grog?"}]
+        })
+    assert res.status_code == 200
+    assert prompts == [[{"role": "user", "content": "Who is Grog?"}]]
+    messages = client.get(f"/api/chat/conversations/{conversation_id}").json()["messages"]
+    assert [(m["role"], m["content"]) for m in messages] == [("user", "Who is Grog?"), ("assistant", "Grog is a goliath.")]
+
+
+def test_stream_ends_with_a_timings_event():
+    campaign_id = _create_campaign("Chat Timings Campaign")
+
+    async def counted_stream(messages, context="", model=None, history_summary="", stats=None):
+        for token in ["The ", "records ", "show..."]:
+            yield token
+        # Ollama's final chunk: 40 tokens in 2 seconds
+        stats.update(eval_count=40, eval_duration=2_000_000_000, prompt_eval_count=300)
+
+    with patch("backend.app.services.llm.librarian._search", return_value=[]), \
+         patch("backend.app.services.llm.librarian.stream_librarian_response", side_effect=counted_stream):
+        with client.stream("POST", "/api/chat/librarian/stream", json={
+            "campaign_id": campaign_id,
+            "messages": [{"role": "user", "content": "Who is Grog?"}]
+        }) as res:
+            body = "".join(res.iter_text())
+
+    assert body.rstrip().endswith("data: [DONE]")
+    metadata = json.loads(body.split("event: metadata\ndata: ")[1].split("\n")[0])
+    timings = metadata["timings"]
+    assert timings["tokens_per_sec"] == 20.0
+    assert (timings["completion_tokens"], timings["prompt_tokens"]) == (40, 300)
+    assert {"queue_wait_ms", "pack_ms", "ttft_ms", "total_ms"} <= set(timings)
+    assert timings["ttft_ms"] <= timings["total_ms"]
+    assert metadata["route"]["model"]
+
+
+def test_metrics_snapshot_reports_bucket_percentiles():
+    assert Histogram(LATENCY_BUCKETS_MS).snapshot()["p50"] is None
+
+    recorded = LibrarianMetrics()
+    for ms in range(1, 101):
+        recorded.record_timings({"total_ms": ms, "tokens_per_sec": 12.0, "context_chars": 5000})
+    recorded.record_generation_completed(30)
+    recorded.record_generation_completed(50)
+    snapshot = recorded.snapshot()
+
+    total = snapshot["histograms"]["total_ms"]
+    # Quantiles are the upper bound of the bucket they fall in
+    assert (total["count"], total["p50"], total["p95"], total["p99"]) == (100, 50, 100, 100)
+    assert total["buckets"]["5"] == 5 and total["buckets"]["+Inf"] == 0
+    assert snapshot["histograms"]["tokens_per_sec"]["p50"] == 15
+    assert "context_chars" not in snapshot["histograms"]
+    assert snapshot["average_answer_tokens"] == 40.0
+
+    recorded.record_timings({"total_ms": 500000})
+    assert recorded.snapshot()["histograms"]["total_ms"]["buckets"]["+Inf"] == 1
+
+
+def test_load_test_percentiles_are_nearest_rank():
+    assert percentile([], 50) is None
+    assert percentile(list(range(1, 11)), 50) == 5
+    assert percentile(list(range(1, 7)), 50) == 3
+    assert [percentile(list(range(1, 201)), p) for p in (50, 95, 99, 100)] == [100, 190, 198, 200]
+    assert percentile([7.0], 0) == 7.0
+
+
+def test_index_and_answer_against_fake_ollama():
+    campaign_id = _create_campaign("Fake Ollama Campaign")
+    res = client.post("/personas/", json={
+        "name": "Grog Strongjaw",
+        "role": "PC",
+        "description": "A goliath barbarian who loves a good fight.",
+        "race": "Goliath",
+        "campaign_id": campaign_id,
+    })
+    assert res.status_code == 200
+    persona_id = res.json()["id"]
+
+    with FakeOllamaServer() as server, patch.object(settings, "OLLAMA_HOST", server.url):
+        res = client.post(f"/api/chat/index/{campaign_id}")
+        assert res.status_code == 200
+
+        res = client.post("/api/chat/librarian", json={
+            "campaign_id": campaign_id,
+            "messages": [{"role": "user", "content": "Who is Grog Strongjaw?"}]
+        })
+        assert res.status_code == 200
+        data = res.json()
+        assert data["response"] == "The records show that is Grog Strongjaw is written of in the archives. It is written that the tale continues."
+        assert data["context_sources"][0] == f"persona:{persona_id}"
+
+        with client.stream("POST", "/api/chat/librarian/stream", json={
+            "campaign_id": campaign_id,
+            "messages": [{"role": "user", "content": "What race is Grog?"}]
+        }) as res:
+            body = "".join(res.iter_text())
+        assert "event: sources" in body
+        assert "data: [DONE]" in body
+
+
+def test_batch_questions_share_one_embedding_call():
+    campaign_id = _create_campaign("Batch Campaign")
+    for name, race in [("Grog Strongjaw", "Goliath"), ("Vex'ahlia", "Half-Elf")]:
+        res = client.post("/personas/", json={
+            "name": name, "role": "PC", "description": f"{name} is a {race} adventurer.",
+            "race": race, "campaign_id": campaign_id,
+        })
+        assert res.status_code == 200
+
+    questions = ["Who is Grog Strongjaw?", "What race is Vex'ahlia?", "Who leads the party?"]
+    with FakeOllamaServer() as server, patch.object(settings, "OLLAMA_HOST", server.url):
+        assert client.post(f"/api/chat/index/{campaign_id}").status_code == 200
+        server.calls.clear()
+
+        res = client.post("/api/chat/librarian/batch", json={"campaign_id": campaign_id, "questions": questions})
+        assert res.status_code == 200
+        lines = [json.loads(line) for line in res.text.splitlines()]
+
+        assert server.calls["/api/embed"] == 1
+        assert server.calls["/api/embeddings"] == 0
+        # The race question is a plain lookup answered without the model
+        assert server.calls["/api/chat"] == len(questions) - 1
+
+    answers, summary = lines[:-1], lines[-1]
+    assert sorted(a["index"] for a in answers) == [0, 1, 2]
+    assert all(a["response"] and a["error"] is None for a in answers)
+    assert next(a for a in answers if a["index"] == 1)["response"] == "The records show that Vex'ahlia is a Half-Elf."
+    assert summary["done"] and summary["count"] == 3 and summary["errors"] == 0
+
+    assert client.post("/api/chat/librarian/batch", json={"campaign_id": campaign_id, "questions": [" "]}).status_code == 400
+
+
+def test_persona_lookups_are_answered_without_the_model():
+    campaign_id = _create_campaign("Lookup Campaign")
+    res = client.post("/personas/", json={
+        "name": "Vex'ahlia", "role": "PC", "description": "A half-elf ranger.",
+        "race": "Half-Elf", "class_name": "Ranger", "player_name": "Laura",
+        "aliases": '["Vex", "Lady Vex"]', "campaign_id": campaign_id,
+    })
+    persona_id = res.json()["id"]
+
+    def no_model(*args, **kwargs):
+        raise AssertionError("lookup questions must not reach the model")
+
+    cases = {
+        "Who plays Vex?": "The records show that Vex'ahlia is played by Laura.",
+        "what race is vex'ahlia": "The records show that Vex'ahlia is a Half-Elf.",
+        "What is Lady Vex's class?": "The records show that Vex'ahlia is a Ranger.",
+    }
+    with patch("backend.app.services.llm.librarian.chat_with_librarian", side_effect=no_model), \
+         patch("backend.app.services.llm.librarian._search", side_effect=no_model):
+        for question, expected in cases.items():
+            res = client.post("/api/chat/librarian", json={
+                "campaign_id": campaign_id,
+                "messages": [{"role": "user", "content": question}]
+            })
+            assert res.status_code == 200, question
+            assert res.json()["response"] == expected
+            assert res.json()["context_sources"] == [f"persona:{persona_id}"]
+
+    def set_status(status):
+        with Session(engine) as db:
+            persona = db.get(Persona, persona_id)
+            persona.status = status
+            db.add(persona)
+            db.commit()
+
+    def ask(question):
+        return client.post("/api/chat/librarian", json={
+            "campaign_id": campaign_id,
+            "messages": [{"role": "user", "content": question}]
+        }).json()["response"]
+
+    with patch("backend.app.services.llm.librarian.chat_with_librarian", return_value="From the archives") as mock_chat, \
+         patch("backend.app.services.llm.librarian._search", return_value=[]):
+        # "Alive" is also the default of a status nobody recorded: the model answers from the sessions
+        assert ask("Is Vex still alive?") == "From the archives"
+
+        # Edits are picked up immediately
+        set_status("Dead")
+        assert ask("Is Vex alive?") == "No. It is written that Vex'ahlia is dead."
+        assert ask("Is Vex dead?") == "Yes. It is written that Vex'ahlia is dead."
+
+        # Neither alive nor dead is no answer to a yes/no question, but is one to "what is her status"
+        set_status("Missing")
+        assert ask("Is Vex alive?") == "From the archives"
+        assert ask("What is Vex's status?") == "It is written that Vex'ahlia is missing."
+        assert mock_chat.call_count == 2
+        mock_chat.reset_mock()
+
+        # Anything beyond a bare lookup goes to the model
+        res = client.post("/api/chat/librarian", json={
+            "campaign_id": campaign_id,
+            "messages": [{"role": "user", "content": "What race is Vex and why did she leave home?"}]
+        })
+        assert res.json()["response"] == "From the archives"
+        mock_chat.assert_called_once()
+
+
+def test_model_routing_by_question_and_forced_tier():
+    from backend.app.services.llm.model_router import choose_route, fast_min_score
+
+    with patch.object(settings, "OLLAMA_FAST_MODEL", "tiny"), patch.object(settings, "OLLAMA_MODEL", "big"):
+        ask = lambda q: [{"role": "user", "content": q}]
+        bar = fast_min_score("ollama")
+        assert choose_route(ask("Where did we leave the cart?"), top_score=0.8, min_score=bar).model == "tiny"
+        assert choose_route(ask("Where did we leave the cart?"), top_score=0.1, min_score=bar).reason == "low retrieval confidence"
+        # Scores from the hashing embedder, as a fallback or without a bar of its own, aren't trusted
+        assert fast_min_score("ollama", fallback=True) is None and fast_min_score("hashing") is None
+        assert choose_route(ask("Where did we leave the cart?"), top_score=0.8, min_score=None).tier == "strong"
+        assert choose_route(ask("Why did the party betray the duke?"), top_score=0.9).tier == "strong"
+        assert choose_route(ask("word " * 40), top_score=0.9).reason == "long question"
+        assert choose_route(ask("And then?"), history_summary="Earlier turns", top_score=0.9).reason == "deep conversation"
+        assert choose_route(ask("Why?"), top_score=0.0, requested_tier="fast").model == "tiny"
+
+        campaign_id = _create_campaign("Routing Campaign")
+        models_used = []
+
+        def fake_chat(messages, context="", model=None, history_summary="", stats=None):
+            models_used.append(model)
+            return "Answer"
+
+        with patch("backend.app.services.llm.librarian.chat_with_librarian", side_effect=fake_chat), \
+             patch("backend.app.services.llm.librarian._search", return_value=[]):
+            res = client.post("/api/chat/librarian", json={
+                "campaign_id": campaign_id,
+                "messages": [{"role": "user", "content": "Where did we leave the cart?"}]
+            })
+            # Nothing retrieved: not confident enough for the fast model
+            assert res.json()["route"] == {"tier": "strong", "model": "big", "reason": "low retrieval confidence"}
+
+            res = client.post("/api/chat/librarian", json={
+                "campaign_id": campaign_id,
+                "tier": "fast",
+                "messages": [{"role": "user", "content": "Where did we leave the cart?"}]
+            })
+            assert res.json()["route"]["tier"] == "fast"
+            assert models_used == ["big", "tiny"]
+
+        stats = client.get("/api/chat/routes").json()
+        assert stats["fast"]["model"] == "tiny"
+        assert stats["fast"]["requests"] >= 1
+        assert stats["fast"]["total_ms"]["count"] >= 1
+
+
+def test_websocket_multiplexes_and_cancels_streams():
+    campaign_id = _create_campaign("Socket Campaign")
+    aborted = []
+
+    async def fake_stream(messages, context="", model=None, history_summary="", stats=None):
+        if "forever" in messages[-1]["content"]:
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield "more "
+            finally:
+                aborted.append(True)
+        for token in ["The ", "records ", "show..."]:
+            yield token
+
+    with patch("backend.app.services.llm.librarian._search", return_value=[]), \
+         patch("backend.app.services.llm.librarian.stream_librarian_response", side_effect=fake_stream), \
+         patch.object(scheduler, "slots", 2), \
+         client.websocket_connect("/api/chat/ws") as ws:
+        ws.send_json({"type": "ask", "id": "long", "campaign_id": campaign_id,
+                      "messages": [{"role": "user", "content": "Talk forever"}]})
+        ws.send_json({"type": "ask", "id": "short", "campaign_id": campaign_id,
+                      "messages": [{"role": "user", "content": "Who is Grog?"}]})
+
+        frames = {"long": [], "short": []}
+        cancelled = False
+        while not (frames["short"] and frames["short"][-1]["type"] == "done"
+                   and frames["long"] and frames["long"][-1]["type"] == "cancelled"):
+            frame = ws.receive_json()
+            frames[frame["id"]].append(frame)
+            if not cancelled and frame["id"] == "long" and frame["type"] == "token":
+                ws.send_json({"type": "cancel", "id": "long"})
+                cancelled = True
+
+        short_types = [f["type"] for f in frames["short"]]
+        assert short_types[:2] == ["conversation", "sources"]
+        assert short_types.index("sources") < short_types.index("token")
+        assert "".join(f["content"] for f in frames["short"] if f["type"] == "token") == "The records show..."
+        assert short_types[-2:] == ["metadata", "done"]
+
+        ws.send_json({"type": "bogus", "id": "x"})
+        assert ws.receive_json()["status"] == 400
+
+    assert aborted == [True]
+
+
+def test_cancelled_batch_aborts_generation_before_freeing_its_slot():
+    campaign_id = _create_campaign("Batch Cancel Campaign")
+    client.post("/personas/", json={
+        "name": "Grog Strongjaw", "role": "PC", "description": "A goliath barbarian.",
+        "race": "Goliath", "campaign_id": campaign_id,
+    })
+    generating = []
+    aborted = []
+
+    async def slow_chat(messages, context="", model=None, history_summary="", stats=None):
+        generating.append(scheduler.stats()["active"])
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # The slot must still be held while the generation is being aborted
+            aborted.append(scheduler.stats()["active"])
+            raise
+        return "never"
+
+    async def scenario():
+        results = librarian.answer_batch(campaign_id, ["What race is Grog?", "Who leads the party?"])
+        first = await anext(results)
+        await asyncio.sleep(0.05)
+        await results.aclose()
+        await asyncio.sleep(0.05)
+        return first
+
+    with patch("backend.app.services.llm.librarian._search_many", side_effect=lambda cid, qs, timer: [[] for _ in qs]), \
+         patch("backend.app.services.llm.librarian.chat_with_librarian", side_effect=slow_chat), \
+         patch("backend.app.services.llm.librarian.build_context", wraps=librarian.build_context) as packed:
+        first = asyncio.run(scenario())
+
+    # The lookup answered the race question without packing a context for it
+    assert first["index"] == 0 and first["response"] == "The records show that Grog Strongjaw is a Goliath."
+    assert packed.call_count == 1
+    assert generating == [1] and aborted == [1]
+    assert scheduler.stats()["active"] == 0
@@ -0,0 +1,132 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from sqlmodel import Session
+from backend.app.core.config import settings
+from backend.app.core.database import engine, create_db_and_tables
+from backend.app.models.enums import JobStatus
+from backend.app.models.models import Job
+from backend.app.services import jobs
+from backend.app.services.jobs import report_stage
+from backend.app.worker import Worker
+from backend.app.main import app
+from fastapi.testclient import TestClient
+
+client = TestClient(app)
+
+
+def _make_due(job_id: int):
+    with Session(engine) as db:
+        job = db.get(Job, job_id)
+        job.run_after = datetime.now() - timedelta(seconds=1)
+        db.add(job)
+        db.commit()
+
+
+def test_claim_lease_expiry_and_backoff():
+    create_db_and_tables()
+    with Session(engine) as db:
+        job = jobs.enqueue(db, jobs.SESSION, 990001, max_attempts=2)
+        # Queueing the same target again reuses the waiting job
+        assert jobs.enqueue(db, jobs.SESSION, 990001).id == job.id
+
+        claimed = jobs.claim(db, "worker-a", lease_seconds=60)
+        while claimed.id != job.id:  # Skip jobs left over by other tests
+            jobs.complete(db, claimed.id, "worker-a")
+            claimed = jobs.claim(db, "worker-a", lease_seconds=60)
+        assert claimed.status == JobStatus.RUNNING and claimed.attempts == 1
+        assert jobs.heartbeat(db, job.id, "worker-a")
+
+        # worker-a dies: once its lease runs out, worker-b takes the job over
+        claimed.lease_expires_at = datetime.now() - timedelta(seconds=1)
+        db.add(claimed)
+        db.commit()
+        reclaimed = jobs.claim(db, "worker-b", lease_seconds=60)
+        assert reclaimed.id == job.id and reclaimed.attempts == 2
+        assert not jobs.heartbeat(db, job.id, "worker-a")
+
+        # A failed attempt is requeued with exponential backoff, until attempts run out
+        with patch.object(settings, "JOB_RETRY_BASE_DELAY", 10.0):
+            assert jobs.retry_delay(1) == 10.0 and jobs.retry_delay(3) == 40.0
+            reclaimed.max_attempts = 3
+            db.add(reclaimed)
+            db.commit()
+            failed = jobs.fail(db, job.id, "worker-b", "boom")
+        assert failed.status == JobStatus.QUEUED
+        assert failed.run_after > datetime.now() + timedelta(seconds=15)
+
+        _make_due(job.id)
+        db.expire_all()
+        assert jobs.claim(db, "worker-b").id == job.id
+        failed = jobs.fail(db, job.id, "worker-b", "boom again")
+        assert failed.status == JobStatus.FAILED and failed.last_error == "boom again"
+
+    res = client.post(f"/jobs/{job.id}/retry")
+    assert res.status_code == 200
+    assert res.json()["status"] == "queued" and res.json()["attempts"] == 0
+    assert client.post(f"/jobs/{job.id}/retry").status_code == 400
+    with Session(engine) as db:
+        db.delete(db.get(Job, job.id))
+        db.commit()
+
+
+def test_worker_runs_queued_pipeline_with_retries_and_stages():
+    res = client.post("/graphql", json={"query": 'mutation { create_campaign(name: "Queue Campaign", description: "Test") { id } }'})
+    campaign_id = res.json()["data"]["create_campaign"]["id"]
+
+    calls = []
+
+    async def flaky_pipeline(session_id, db_engine, raise_on_error=False):
+        calls.append((session_id, raise_on_error))
+        report_stage("generating")
+        if len(calls) == 1:
+            raise RuntimeError("model overloaded")
+        report_stage("saving")
+
+    with patch.object(settings, "PIPELINE_EXECUTOR", "queue"), \
+         patch("backend.app.services.llm.generators.process_text_session_pipeline", flaky_pipeline):
+        res = client.post("/import_session_text/", json={"name": "Queued Session", "content": "Text", "campaign_id": campaign_id})
+        assert res.status_code == 200
+        session_id, job_id = res.json()["session_id"], res.json()["job_id"]
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "queued"
+
+        async def drain():
+            worker = Worker(slots=1, worker_id="test-worker", lease_seconds=30)
+            while await worker.run_one():
+                job = client.get(f"/jobs/{job_id}").json()
+                if job["status"] == "queued":
+                    _make_due(job_id)
+            return worker
+
+        asyncio.run(drain())
+
+    assert calls == [(session_id, True), (session_id, True)]
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "succeeded" and job["attempts"] == 2
+    assert job["stage"] == "saving" and job["last_error"] is None
+    assert [(h["stage"], h["attempt"]) for h in job["stage_history"]] == [("generating", 1), ("generating", 2), ("saving", 2)]
+    assert job["lease_owner"] is None
+
+    stats = client.get("/jobs/stats").json()
+    assert stats["counts"]["succeeded"] >= 1
+
+
+def test_rest_campaign_summary_is_queued_as_a_job():
+    res = client.post("/graphql", json={"query": 'mutation { create_campaign(name: "Queued Summary Campaign", description: "Test") { id } }'})
+    campaign_id = res.json()["data"]["create_campaign"]["id"]
+
+    with patch.object(settings, "PIPELINE_EXECUTOR", "queue"), \
+         patch("backend.app.api.routers.campaigns.generate_campaign_summary_pipeline") as pipeline:
+        res = client.post(f"/campaigns/{campaign_id}/generate_summary")
+    assert res.status_code == 200
+    job = client.get(f"/jobs/{res.json()['job_id']}").json()
+    assert (job["kind"], job["target_id"], job["status"]) == (jobs.CAMPAIGN_SUMMARY, campaign_id, "queued")
+    # Nothing ran in the API process
+    pipeline.assert_not_called()
+    with Session(engine) as db:
+        db.delete(db.get(Job, job["id"]))
+        db.commit()
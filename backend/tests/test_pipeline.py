@@ -0,0 +1,684 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+from google.genai import errors, types
+import pytest
+from sqlalchemy import create_engine, event
+from sqlmodel import SQLModel, Session, select
+from backend.app.core.config import settings
+from backend.app.core.database import engine, create_db_and_tables
+from backend.app.models.enums import ProcessingStatus
+from backend.app.models.models import Campaign, SessionDigest, GeminiFile, GeminiUsage, AnalysisRun, Highlight, Moment, Persona, Quote, VectorStore, Session as DBSessionEntry
+from backend.app.services import audio
+from backend.app.services.llm import generators, file_cache, model_health, segments, analysis_store, transcripts
+from backend.app.services.llm.metrics import pipeline_metrics
+from backend.app.services.llm.persona_resolver import PersonaResolver
+from backend.app.services.llm.schemas import TranscriptSchema, SessionDigestSchema, CampaignSummarySchema
+from backend.app.main import app
+from fastapi.testclient import TestClient
+
+client = TestClient(app)
+
+
+class FakeFiles:
+    """Stands in for client.files: uploads take a while, files become ACTIVE after a few polls."""
+
+    def __init__(self, upload_seconds=0.05, polls_until_active=2, fail_path=None):
+        self.upload_seconds = upload_seconds
+        self.polls_until_active = polls_until_active
+        self.fail_path = fail_path
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.polls = {}
+        self.deleted = []
+        self.display_names = {}
+        self.created = {}
+
+    def upload(self, file, config):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.upload_seconds)
+            if file == self.fail_path:
+                raise RuntimeError("upload failed")
+            name = f"files/{os.path.basename(file)}"
+            self.polls[name] = 0
+            self.display_names[name] = config.get("display_name")
+            self.created[name] = datetime.now().astimezone()
+            return SimpleNamespace(name=name, uri=f"https://gemini/{name}", mime_type=config["mime_type"], state="PROCESSING")
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def get(self, name):
+        if name in self.deleted:
+            raise RuntimeError(f"{name} not found")
+        with self.lock:
+            self.polls[name] += 1
+            state = "ACTIVE" if self.polls[name] >= self.polls_until_active else "PROCESSING"
+        return SimpleNamespace(name=name, uri=f"https://gemini/{name}", mime_type="audio/mpeg", state=state)
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+    def list(self):
+        return [
+            SimpleNamespace(name=name, display_name=self.display_names.get(name), create_time=self.created.get(name))
+            for name in self.polls if name not in self.deleted
+        ]
+
+
+ANALYSIS = {
+    "summary": "The party met in a tavern.",
+    "personas": [],
+    "memorable_quotes": [{"speaker": "Grog", "quote": "I would like to rage.", "reasoning": "Named by the DM."}],
+    "moments": [{"title": "Tavern brawl", "description": "Grog threw a chair."}],
+    "highlights": [{"name": None, "highlight": "The party met in a tavern"}],
+    "low_points": [],
+}
+
+
+TRANSCRIPT = {"lines": [
+    {"timestamp": "00:00:05", "speaker": "DM", "text": "You enter the tavern."},
+    {"timestamp": "00:00:09", "speaker": "Grog", "text": "I would like to rage."},
+]}
+
+
+CAMPAIGN_SUMMARY = {
+    "tagline": "A tale of taverns",
+    "summary": "The party keeps meeting in taverns.",
+    "key_events": ["The tavern brawl"],
+    "ongoing_conflicts": [],
+    "pc_highlights": [{"name": "Grog", "highlight": "Threw a chair"}],
+    "mvp": {"name": "Grog", "reason": "Chairs."},
+}
+
+
+class FakeModels:
+    def __init__(self):
+        self.calls = []
+
+    def generate_content(self, model, contents, config):
+        uris = [p.file_data.file_uri for c in contents if not isinstance(c, str) for p in c.parts]
+        self.calls.append({"model": model, "uris": uris, "text": "\n".join(c for c in contents if isinstance(c, str))})
+        if config.response_schema is TranscriptSchema:
+            return self._response(TRANSCRIPT)
+        if config.response_schema is SessionDigestSchema:
+            return self._response({"digest": f"Digest #{len(self.calls)}"})
+        if config.response_schema is CampaignSummarySchema:
+            return self._response(CAMPAIGN_SUMMARY)
+        return self._response(ANALYSIS)
+
+    def _response(self, data):
+        usage = SimpleNamespace(prompt_token_count=1000, candidates_token_count=200, thoughts_token_count=50, cached_content_token_count=None, total_token_count=1250)
+        return SimpleNamespace(parsed=None, text=json.dumps(data), usage_metadata=usage)
+
+
+def _fake_gemini(files):
+    return SimpleNamespace(files=files, models=FakeModels())
+
+
+def _audio_files(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"part{i}.mp3"
+        path.write_bytes(bytes([i]) * 1024 * 64)
+        paths.append(str(path))
+    return paths
+
+
+def test_uploads_run_concurrently_and_poll_together(tmp_path):
+    files = FakeFiles()
+    paths = _audio_files(tmp_path, 5)
+    with patch.object(generators, "client", SimpleNamespace(files=files)), \
+         patch.object(settings, "GEMINI_UPLOAD_CONCURRENCY", 3), \
+         patch.object(settings, "GEMINI_POLL_INITIAL_DELAY", 0.01), \
+         patch.object(settings, "GEMINI_POLL_MAX_DELAY", 0.02):
+        started = time.perf_counter()
+        result = asyncio.run(generators._upload_and_wait_for_files(paths))
+        elapsed = time.perf_counter() - started
+
+    assert [f.name for f in result] == [f"files/part{i}.mp3" for i in range(5)]
+    # Bounded pool: never more than 3 at once, and much faster than 5 sequential uploads
+    assert files.max_in_flight == 3
+    assert elapsed < 5 * files.upload_seconds
+    # Every file was polled in the same rounds until it was ACTIVE
+    assert set(files.polls.values()) == {files.polls_until_active}
+    snapshot = pipeline_metrics.snapshot()["histograms"]
+    assert snapshot["gemini_upload_throughput_mbps"]["count"] >= 5
+    assert snapshot["gemini_time_to_active_ms"]["count"] >= 5
+
+
+def test_failed_upload_deletes_the_files_already_uploaded(tmp_path):
+    paths = _audio_files(tmp_path, 3)
+    files = FakeFiles(fail_path=paths[2], upload_seconds=0.02)
+    with patch.object(generators, "client", SimpleNamespace(files=files)), \
+         patch.object(settings, "GEMINI_UPLOAD_CONCURRENCY", 1):
+        with pytest.raises(RuntimeError):
+            asyncio.run(generators._upload_and_wait_for_files(paths))
+    assert sorted(files.deleted) == ["files/part0.mp3", "files/part1.mp3"]
+
+
+def _create_session(name, paths):
+    create_db_and_tables()
+    with Session(engine) as db:
+        campaign = Campaign(name=f"{name} Campaign")
+        db.add(campaign)
+        db.commit()
+        session = DBSessionEntry(name=name, campaign_id=campaign.id, audio_file_paths=json.dumps(paths))
+        db.add(session)
+        db.commit()
+        return session.id
+
+
+def test_regeneration_reuses_files_already_on_gemini(tmp_path):
+    paths = _audio_files(tmp_path, 2)
+    session_id = _create_session("Reuse Session", paths)
+
+    files = FakeFiles(polls_until_active=1)
+    gemini = _fake_gemini(files)
+    model_health.model_health.reset()
+    with patch.object(generators, "client", gemini), patch.object(file_cache, "client", gemini), \
+         patch.object(model_health, "client", gemini), patch.object(settings, "GEMINI_POLL_INITIAL_DELAY", 0.01):
+        asyncio.run(generators.process_session_pipeline(session_id, engine))
+        uploads_after_first_run = dict(files.polls)
+        asyncio.run(generators.process_session_pipeline(session_id, engine))
+
+        # The second run found both files in the registry: no new uploads, same URIs, nothing deleted
+        assert len(uploads_after_first_run) == 2
+        assert files.polls.keys() == uploads_after_first_run.keys()
+        audio_calls = [c["uris"] for c in gemini.models.calls if c["uris"]]
+        assert len(audio_calls) == 2 and audio_calls[0] == audio_calls[1]
+        assert files.deleted == []
+        with Session(engine) as db:
+            assert db.get(DBSessionEntry, session_id).status == ProcessingStatus.COMPLETED
+            rows = db.exec(select(GeminiFile).where(GeminiFile.session_id == session_id)).all()
+            assert sorted(r.content_hash for r in rows) == sorted(file_cache.file_hash(p) for p in paths)
+
+            # One entry expires, then the session goes away: the sweeper removes both files
+            rows[0].expires_at = datetime.now() - timedelta(minutes=1)
+            db.add(rows[0])
+            db.commit()
+            expired_name, orphan_name = rows[0].name, rows[1].name
+            assert file_cache.sweep() == {"expired": 1, "orphaned": 0, "untracked": 0}
+            db.delete(db.get(DBSessionEntry, session_id))
+            db.commit()
+            assert file_cache.sweep()["orphaned"] == 1
+            assert files.deleted == [orphan_name]
+            assert db.exec(select(GeminiFile).where(GeminiFile.session_id == session_id)).all() == []
+        assert expired_name not in files.deleted  # Gemini already dropped it on its own
+
+
+def test_sweeper_only_deletes_untracked_files_this_app_uploaded(tmp_path):
+    files = FakeFiles(polls_until_active=1, upload_seconds=0)
+    gemini = SimpleNamespace(files=files)
+    with patch.object(generators, "client", gemini), patch.object(file_cache, "client", gemini), \
+         patch.object(settings, "GEMINI_POLL_INITIAL_DELAY", 0.01):
+        (ours,) = asyncio.run(generators._upload_and_wait_for_files(_audio_files(tmp_path, 1)))
+        # Uploaded by someone else on the same key
+        files.polls["files/theirs"] = 1
+        files.display_names["files/theirs"] = "their-recording.mp3"
+        for name in files.created:
+            files.created[name] -= timedelta(days=1)
+        files.created["files/theirs"] = datetime.now().astimezone() - timedelta(days=1)
+
+        assert ours.name in files.display_names and files.display_names[ours.name].startswith(settings.GEMINI_FILE_DISPLAY_PREFIX)
+        # Off by default
+        assert file_cache.sweep()["untracked"] == 0
+        with patch.object(settings, "GEMINI_FILE_ORPHAN_GRACE", 3600.0):
+            assert file_cache.sweep()["untracked"] == 1
+    assert ours.name in files.deleted and "files/theirs" not in files.deleted
+
+
+def test_failed_save_is_replayed_from_the_stored_response(tmp_path):
+    transcript = tmp_path / "session.txt"
+    transcript.write_text("DM: You enter the tavern.", encoding="utf-8")
+    session_id = _create_session("Replay Session", [str(transcript)])
+
+    gemini = _fake_gemini(FakeFiles())
+    model_health.model_health.reset()
+    with patch.object(generators, "client", gemini), patch.object(model_health, "client", gemini), \
+         patch.object(generators, "_save_analysis_to_db", side_effect=RuntimeError("persona matching bug")):
+        asyncio.run(generators.process_text_session_pipeline(session_id, engine))
+
+    with Session(engine) as db:
+        assert db.get(DBSessionEntry, session_id).status == ProcessingStatus.ERROR
+        run = db.exec(select(AnalysisRun).where(AnalysisRun.session_id == session_id)).one()
+        assert run.source == "text" and run.model == "gemini-flash-latest" and run.saved_at is None
+        assert json.loads(run.input_hashes) == [file_cache.file_hash(str(transcript))]
+
+    # Replay needs no model at all
+    with patch.object(generators, "client", None):
+        res = client.post(f"/sessions/{session_id}/regenerate", params={"mode": "replay"})
+        assert res.status_code == 200
+        assert res.json()["status"] == "completed" and res.json()["analysis_run_id"] == run.id
+        # Replaying again replaces the rows instead of duplicating them
+        assert client.post(f"/sessions/{session_id}/regenerate", params={"mode": "replay"}).status_code == 200
+
+    with Session(engine) as db:
+        session = db.get(DBSessionEntry, session_id)
+        assert session.status == ProcessingStatus.COMPLETED and session.summary == ANALYSIS["summary"]
+        assert [q.text for q in db.exec(select(Quote).where(Quote.session_id == session_id)).all()] == ["I would like to rage."]
+        assert len(db.exec(select(Highlight).where(Highlight.session_id == session_id)).all()) == 1
+
+    runs = client.get(f"/sessions/{session_id}/analysis-runs").json()
+    assert runs[0]["saved_at"] is not None and runs[0]["current_schema"]
+
+    other_id = _create_session("Never Analysed", [str(transcript)])
+    assert client.post(f"/sessions/{other_id}/regenerate", params={"mode": "replay"}).status_code == 404
+
+
+def test_circuit_opens_on_errors_and_recovers_after_a_trial_call():
+    now = [0.0]
+    breaker = model_health.CircuitBreaker("flash", window=60, min_calls=2, error_rate=0.5, cooldown=30, clock=lambda: now[0])
+    assert breaker.allow()
+    breaker.record_success(1.0)
+    breaker.record_failure(0.1, model_health.INVALID_REQUEST)  # our fault, not the model's
+    breaker.record_failure(0.1, model_health.UNAVAILABLE)
+    assert breaker.state == model_health.OPEN and not breaker.allow()
+    assert breaker.snapshot()["retry_in_s"] == 30
+
+    # After the cooldown exactly one trial goes through; it fails and the circuit reopens
+    now[0] = 31
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure(0.1, model_health.TIMEOUT)
+    assert breaker.state == model_health.OPEN and breaker.times_opened == 2
+
+    now[0] = 62
+    assert breaker.allow()
+    breaker.record_success(2.0)
+    snapshot = breaker.snapshot()
+    assert snapshot["state"] == model_health.CLOSED and snapshot["calls"] == 1 and snapshot["error_rate"] == 0.0
+
+
+class FlakyModels(FakeModels):
+    def __init__(self, down):
+        super().__init__()
+        self.down = down
+
+    def generate_content(self, model, contents, config):
+        if model in self.down:
+            self.calls.append({"model": model, "uris": []})
+            raise errors.ServerError(503, {"error": {"code": 503, "message": "overloaded", "status": "UNAVAILABLE"}})
+        return super().generate_content(model, contents, config)
+
+
+def test_fallback_skips_a_model_whose_circuit_is_open(tmp_path):
+    transcript = tmp_path / "session.txt"
+    transcript.write_text("DM: Roll for initiative.", encoding="utf-8")
+    session_id = _create_session("Fallback Session", [str(transcript)])
+
+    models = settings.GEMINI_ANALYSIS_MODELS
+    gemini = SimpleNamespace(files=FakeFiles(), models=FlakyModels(down={models[0]}))
+    model_health.model_health.reset()
+    with patch.object(generators, "client", gemini), patch.object(model_health, "client", gemini), \
+         patch.object(settings, "GEMINI_CIRCUIT_MIN_CALLS", 2), \
+         patch.object(settings, "GEMINI_RETRY_POLICY", {"unavailable": {"retries": 1, "delay": 0}}):
+        asyncio.run(generators.process_text_session_pipeline(session_id, engine))
+        # Retried once on the first model, which opened its circuit, then the next model answered
+        assert [c["model"] for c in gemini.models.calls] == [models[0], models[0], models[1]]
+
+        asyncio.run(generators.process_text_session_pipeline(session_id, engine))
+        assert [c["model"] for c in gemini.models.calls[3:]] == [models[1]]
+
+    with Session(engine) as db:
+        assert db.get(DBSessionEntry, session_id).status == ProcessingStatus.COMPLETED
+        assert db.exec(select(AnalysisRun).where(AnalysisRun.session_id == session_id)).first().model == models[1]
+
+    health = {m["model"]: m for m in client.get("/jobs/model-health").json()}
+    assert health[models[0]]["state"] == "open" and health[models[0]]["errors"] == {"unavailable": 2}
+    assert health[models[1]]["state"] == "closed" and health[models[1]]["latency_p50_s"] is not None
+    model_health.model_health.reset()
+
+    # A process that made none of the calls, like the API with PIPELINE_EXECUTOR=queue, still sees them
+    health = {m["model"]: m for m in client.get("/jobs/model-health").json()}
+    assert health[models[0]]["state"] == "closed" and health[models[0]]["calls"] == 0
+    assert health[models[0]]["all_processes"]["errors"]["unavailable"] >= 2
+    assert health[models[1]]["all_processes"]["latency_p50_s"] is not None
+
+
+def test_save_links_personas_and_skips_duplicates_in_one_pass():
+    session_id = _create_session("Bulk Save Session", [])
+    with Session(engine) as db:
+        campaign_id = db.get(DBSessionEntry, session_id).campaign_id
+        db.add(Persona(name="Grog Strongjaw", role="PC", description="", campaign_id=campaign_id, aliases=json.dumps(["The Big Guy"])))
+        db.add(Quote(text="I would like to rage.", session_id=session_id, campaign_id=campaign_id))
+        db.commit()
+
+    data = {
+        "summary": "",
+        "personas": [
+            {"name": "grog strongjaw", "role": "PC", "description": "", "race": "Goliath", "highlights": ["Grog lifted the cart", "Grog lifted the cart"]},
+            {"name": "Pike", "role": "PC", "description": "", "low_points": ["Pike missed"]},
+        ],
+        "memorable_quotes": [
+            {"speaker": "Grog Strongjaw", "quote": "I would like to rage."},
+            {"speaker": "PIKE", "quote": "Sarenrae, guide me."},
+            {"speaker": "Stranger", "quote": "Who goes there?"},
+        ],
+        "moments": [{"title": "Cart", "description": "."}, {"title": "Cart", "description": "again"}],
+        "highlights": ["Grog lifted the cart", "The party rested"],
+        "low_points": [],
+    }
+    with Session(engine) as db:
+        generators._save_analysis_to_db(session_id, data, db)
+
+    with Session(engine) as db:
+        personas = {p.name: p for p in db.exec(select(Persona).where(Persona.campaign_id == campaign_id)).all()}
+        assert sorted(personas) == ["Grog Strongjaw", "Pike"] and personas["Grog Strongjaw"].race == "Goliath"
+        highlights = db.exec(select(Highlight).where(Highlight.session_id == session_id)).all()
+        assert sorted((h.text, h.type, h.persona_id) for h in highlights) == [
+            ("Grog lifted the cart", "high", personas["Grog Strongjaw"].id),
+            ("Pike missed", "low", personas["Pike"].id),
+            ("The party rested", "high", None),
+        ]
+        quotes = {q.text: q.persona_id for q in db.exec(select(Quote).where(Quote.session_id == session_id)).all()}
+        assert quotes == {"I would like to rage.": None, "Sarenrae, guide me.": personas["Pike"].id, "Who goes there?": None}
+        assert [m.description for m in db.exec(select(Moment).where(Moment.session_id == session_id)).all()] == ["."]
+
+
+def test_persona_resolver_matches_names_aliases_and_near_misses():
+    resolver = PersonaResolver([
+        Persona(id=1, name="Vex'ahlia", role="PC", description="", campaign_id=1, aliases=json.dumps(["Lady Briarwood"])),
+        Persona(id=2, name="Scanlan Shorthalt", role="PC", description="", campaign_id=1, aliases="not json"),
+        Persona(id=3, name="Kash", role="NPC", description="", campaign_id=1),
+    ])
+    assert resolver.resolve("VEX AHLIA").id == 1
+    assert resolver.resolve("lady briarwood").id == 1
+    assert resolver.resolve("Scanlan").id == 2         # substring
+    assert resolver.resolve("Scanlan Shorthault").id == 2  # fuzzy
+    assert resolver.resolve("Keyleth") is None
+    assert resolver.exact("Scanlan") is None          # quote speakers only link on exact name or alias
+
+    # Personas added during a save are found by the ones that follow
+    resolver.add(Persona(name="Keyleth", role="PC", description="", campaign_id=1))
+    assert resolver.resolve("keyleth").name == "Keyleth"
+    assert resolver.resolve("Ka").id == 3  # shorter than a trigram: compared directly
+
+
+def test_clearing_a_session_deletes_its_rows_and_index_chunks_in_bulk():
+    session_id = _create_session("Clear Session", [])
+    other_id = _create_session("Other Session", [])
+    with Session(engine) as db:
+        campaign_id = db.get(DBSessionEntry, session_id).campaign_id
+        other_campaign_id = db.get(DBSessionEntry, other_id).campaign_id
+        for sid, cid in ((session_id, campaign_id), (other_id, other_campaign_id)):
+            generators._save_analysis_to_db(sid, {**ANALYSIS, "summary": ""}, db)
+        rows = {
+            (source_type, sid): db.exec(select(model.id).where(model.session_id == sid)).one()
+            for source_type, model in (("highlight", Highlight), ("quote", Quote), ("moment", Moment))
+            for sid in (session_id, other_id)
+        }
+        for (source_type, sid), row_id in rows.items():
+            cid = campaign_id if sid == session_id else other_campaign_id
+            db.add(VectorStore(campaign_id=cid, source_type=source_type, source_id=row_id, text_content="chunk", embedding_json="[]", embedder="hashing"))
+        db.add(VectorStore(campaign_id=campaign_id, source_type="session_summary", source_id=session_id, text_content="chunk", embedding_json="[]"))
+        db.commit()
+
+        statements = []
+        listener = lambda *a: statements.append(a[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            generators._clear_session_analysis(db, session_id)
+            db.commit()
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        assert sum(s.lstrip().upper().startswith("DELETE") for s in statements) == 6
+
+        for model in (Highlight, Quote, Moment):
+            assert db.exec(select(model).where(model.session_id == session_id)).all() == []
+            assert len(db.exec(select(model).where(model.session_id == other_id)).all()) == 1
+        assert [v.source_type for v in db.exec(select(VectorStore).where(VectorStore.campaign_id == campaign_id)).all()] == ["session_summary"]
+        assert len(db.exec(select(VectorStore).where(VectorStore.campaign_id == other_campaign_id)).all()) == 3
+
+
+def test_windows_overlap_and_merge_shifts_timestamps_and_dedupes():
+    assert audio.segment_windows(100, 120, 10) == [(0.0, 100)]
+    assert audio.segment_windows(250, 100, 10) == [(0.0, 100), (90.0, 100), (180.0, 70)]
+
+    planned = segments.plan_segments({"a.mp3": 150, "b.mp3": 60}, {"a.mp3": "ha", "b.mp3": "hb"}, 100, 20)
+    assert [(s.path, s.start, s.recording_start) for s in planned] == [("a.mp3", 0.0, 0.0), ("a.mp3", 80.0, 80.0), ("b.mp3", 0.0, 150.0)]
+    assert len({s.key for s in planned}) == 3
+
+    first = {
+        "summary": "They met.",
+        "highlights": [{"name": None, "highlight": "The gates opened"}],
+        "low_points": [],
+        "memorable_quotes": [{"speaker": "Unknown", "quote": "Run!", "reasoning": ""}],
+        "personas": [{"name": "Grog", "role": "PC", "description": "Big", "status": "Alive", "highlights": [{"highlight": "lifted the cart"}], "low_points": []}],
+        "moments": [{"title": "Chair fight", "description": "", "timestamp": "01:15"}],
+    }
+    second = {
+        "summary": "They fought.",
+        "highlights": [{"name": None, "highlight": "the gates opened!"}],
+        "low_points": [],
+        "memorable_quotes": [{"speaker": "Pike", "quote": "Run!", "reasoning": "Her voice"}],
+        "personas": [{"name": "GROG", "role": "PC", "description": "Big and loud", "race": "Goliath", "status": "Unconscious", "highlights": [{"highlight": "Lifted the cart"}, {"highlight": "fell over"}], "low_points": []}],
+        "moments": [{"title": "The chair fight", "description": "", "timestamp": "0:00:00"}, {"title": "Dragon", "description": "", "timestamp": "00:30"}, {"title": "Untimed", "description": ""}],
+    }
+    merged = segments.merge_analyses([(planned[1], second), (planned[0], first)])
+    assert merged["summary"] == "They met.\n\nThey fought."
+    assert len(merged["highlights"]) == 1
+    assert merged["memorable_quotes"] == [{"speaker": "Pike", "quote": "Run!", "reasoning": "Her voice"}]
+    (grog,) = merged["personas"]
+    assert (grog["description"], grog["race"], grog["status"]) == ("Big and loud", "Goliath", "Unconscious")
+    assert [h["highlight"] for h in grog["highlights"]] == ["lifted the cart", "fell over"]
+    # Window 2 starts at 80s: its "chair fight" at 0s is the one window 1 saw at 75s
+    assert [(m["title"], m.get("timestamp")) for m in merged["moments"]] == [("Chair fight", "00:01:15"), ("Dragon", "00:01:50"), ("Untimed", None)]
+
+
+class SegmentModels(FakeModels):
+    def generate_content(self, model, contents, config):
+        super().generate_content(model, contents, config)
+        if config.response_mime_type == "text/plain":
+            return SimpleNamespace(parsed=None, text="The whole session, told once.", usage_metadata=None)
+        number = int(config.system_instruction.split("This audio is part ")[1].split(" ")[0])
+        return SimpleNamespace(parsed=None, text=json.dumps({
+            **ANALYSIS,
+            "summary": f"Part {number}.",
+            "moments": [{"title": f"Moment {number}", "description": "", "timestamp": "00:10:00"}],
+        }))
+
+
+def test_long_recording_is_analysed_in_concurrent_segments(tmp_path):
+    paths = _audio_files(tmp_path, 1)
+    session_id = _create_session("Long Session", paths)
+    cuts = []
+
+    def fake_cut(path, start, length, output):
+        cuts.append((start, length))
+        with open(output, "wb") as f:
+            f.write(f"{start}:{length}".encode())
+        return output
+
+    gemini = SimpleNamespace(files=FakeFiles(polls_until_active=1), models=SegmentModels())
+    model_health.model_health.reset()
+    with patch.object(generators, "client", gemini), patch.object(file_cache, "client", gemini), patch.object(model_health, "client", gemini), \
+         patch.object(segments, "probe_duration", lambda path: 5.5 * 3600), patch.object(generators, "cut_segment", fake_cut), \
+         patch.object(settings, "GEMINI_POLL_INITIAL_DELAY", 0.01):
+        asyncio.run(generators.process_session_pipeline(session_id, engine))
+        assert len(cuts) == 8 and cuts[1][0] == 2700 - 120
+        *windows, merge = gemini.models.calls
+        assert len(windows) == 8 and all(len(c["uris"]) == 1 for c in windows)
+        # The part summaries are merged by one text-only call, each part in it once and in order
+        assert not merge["uris"] and [merge["text"].count(f"Part {n}.") for n in range(1, 9)] == [1] * 8
+        assert merge["text"].index("Part 1.") < merge["text"].index("Part 8.")
+
+        # Regenerating reuses the windows already on Gemini
+        asyncio.run(generators.process_session_pipeline(session_id, engine))
+        assert len(cuts) == 8 and len(gemini.models.calls) == 18
+
+    with Session(engine) as db:
+        session = db.get(DBSessionEntry, session_id)
+        assert session.status == ProcessingStatus.COMPLETED
+        assert session.summary == "The whole session, told once."
+        # Every window saw the same highlight and quote; they are saved once
+        assert len(db.exec(select(Highlight).where(Highlight.session_id == session_id)).all()) == 1
+        moments = db.exec(select(Moment).where(Moment.session_id == session_id).order_by(Moment.id)).all()
+        assert [m.timestamp for m in moments][:2] == ["00:10:00", "00:53:00"]
+        assert len(db.exec(select(Quote).where(Quote.session_id == session_id)).all()) == 1
+        run = analysis_store.latest_run(db, session_id)
+        assert run.source == "audio_segmented" and len(json.loads(run.input_hashes)) == 8
+    assert not [p for p in os.listdir(tmp_path) if ".segment" in p]
+
+
+def test_audio_is_transcribed_once_and_regenerated_from_the_transcript(tmp_path):
+    paths = _audio_files(tmp_path, 1)
+    session_id = _create_session("Transcript Session", paths)
+
+    windows = segments.plan_segments({"x": 200.0}, {"x": "h"}, 120, 40)
+    assert [(s.start, s.length) for s in windows] == [(0.0, 120), (80.0, 120)]
+    # The windows overlap from 80s to 120s: each keeps its side of 100s
+    merged = transcripts.merge_segment_lines([
+        (windows[0], [{"timestamp": "00:01:35", "speaker": "A", "text": "early"}, {"timestamp": "00:01:50", "speaker": "A", "text": "late"}]),
+        (windows[1], [{"timestamp": "00:00:15", "speaker": "A", "text": "early"}, {"timestamp": "00:00:30", "speaker": "A", "text": "late"}, {"timestamp": "?", "speaker": "B", "text": "undated"}]),
+    ])
+    assert [(line["timestamp"], line["text"]) for line in merged] == [("00:01:35", "early"), ("00:01:50", "late"), ("", "undated")]
+
+    gemini = _fake_gemini(FakeFiles(polls_until_active=1))
+    model_health.model_health.reset()
+    with patch.object(generators, "client", gemini), patch.object(file_cache, "client", gemini), patch.object(model_health, "client", gemini), \
+         patch.object(settings, "GEMINI_POLL_INITIAL_DELAY", 0.01), patch.object(settings, "GEMINI_TRANSCRIPT_FIRST", True):
+        asyncio.run(generators.process_session_pipeline(session_id, engine))
+        transcription, analysis = gemini.models.calls
+        assert transcription["uris"] and not analysis["uris"]
+        assert "[00:00:09] Grog: I would like to rage." in analysis["text"]
+
+        with patch.object(settings, "PIPELINE_EXECUTOR", "background"):
+            res = client.post(f"/sessions/{session_id}/regenerate", params={"mode": "transcript"})
+        assert res.status_code == 200
+        # Only the text analysis ran again: nothing uploaded, no audio sent
+        assert len(gemini.models.calls) == 3 and not gemini.models.calls[2]["uris"]
+        assert len(gemini.files.polls) == 1
+
+    with Session(engine) as db:
+        session = db.get(DBSessionEntry, session_id)
+        assert session.status == ProcessingStatus.COMPLETED
+        assert [run.source for run in db.exec(select(AnalysisRun).where(AnalysisRun.session_id == session_id)).all()] == ["transcript", "transcript"]
+    lines = client.get(f"/sessions/{session_id}/transcript").json()
+    assert [(line["speaker"], line["timestamp"]) for line in lines] == [("DM", "00:00:05"), ("Grog", "00:00:09")]
+
+    other_id = _create_session("No Transcript", paths)
+    assert client.post(f"/sessions/{other_id}/regenerate", params={"mode": "transcript"}).status_code == 404
+
+
+def test_campaign_summary_folds_in_only_the_sessions_that_changed():
+    create_db_and_tables()
+    with Session(engine) as db:
+        campaign = Campaign(name="Long Campaign")
+        db.add(campaign)
+        db.commit()
+        campaign_id = campaign.id
+        for i in range(3):
+            db.add(DBSessionEntry(name=f"Chapter {i}", campaign_id=campaign_id, summary=f"Events of chapter {i}.", created_at=datetime(2026, 1, 1 + i)))
+        db.add(DBSessionEntry(name="Unprocessed", campaign_id=campaign_id, created_at=datetime(2026, 1, 10)))
+        db.commit()
+
+    gemini = _fake_gemini(FakeFiles())
+    model_health.model_health.reset()
+
+    def run():
+        gemini.models.calls.clear()
+        asyncio.run(generators.generate_campaign_summary_pipeline(campaign_id, engine, raise_on_error=True))
+        return gemini.models.calls
+
+    with patch.object(model_health, "client", gemini), patch.object(settings, "GEMINI_CAMPAIGN_FOLD_BATCH", 2):
+        # First run: a digest per session with content, then the story in batches of 2
+        calls = run()
+        assert sum("Condense the session" in c["text"] for c in calls) == 3
+        folds = [c["text"] for c in calls if "Campaign Historian. Your task" in c["text"]]
+        assert len(folds) == 2
+        assert "THE STORY SO FAR" not in folds[0] and "THE STORY SO FAR" in folds[1]
+        assert "Chapter 2" in folds[1] and "Chapter 0" not in folds[1]
+        with Session(engine) as db:
+            campaign = db.get(Campaign, campaign_id)
+            assert campaign.description == "A tale of taverns"
+            assert campaign.summary.startswith("# The Story So Far\nThe party keeps meeting in taverns.")
+            assert len(json.loads(campaign.summary_sessions)) == 3
+
+        # Nothing changed: no calls at all
+        assert run() == []
+
+        # A new session: one digest, one fold carrying the stored story instead of the old sessions
+        with Session(engine) as db:
+            db.add(DBSessionEntry(name="Chapter 3", campaign_id=campaign_id, summary="Events of chapter 3.", created_at=datetime(2026, 1, 4)))
+            db.commit()
+        calls = run()
+        assert len(calls) == 2
+        assert "Chapter 3" in calls[1]["text"] and "Chapter 1" not in calls[1]["text"]
+        assert "The party keeps meeting in taverns." in calls[1]["text"]
+
+        # An earlier session changed: only it is digested again, the story is rebuilt from the digests
+        with Session(engine) as db:
+            first = db.exec(select(DBSessionEntry).where(DBSessionEntry.campaign_id == campaign_id, DBSessionEntry.name == "Chapter 0")).one()
+            first.summary = "Chapter 0, retold."
+            db.add(first)
+            db.commit()
+        calls = run()
+        digests = [c for c in calls if "Condense the session" in c["text"]]
+        assert len(digests) == 1 and "Chapter 0, retold." in digests[0]["text"]
+        assert len(calls) == 3 and "THE STORY SO FAR" not in calls[1]["text"]
+
+    with Session(engine) as db:
+        ids = [s.id for s in db.exec(select(DBSessionEntry).where(DBSessionEntry.campaign_id == campaign_id)).all()]
+        assert len(db.exec(select(SessionDigest).where(SessionDigest.session_id.in_(ids))).all()) == 4
+
+
+def test_gemini_calls_are_accounted_per_session_and_campaign(tmp_path):
+    transcript = tmp_path / "session.txt"
+    transcript.write_text("DM: Roll for initiative.", encoding="utf-8")
+    session_id = _create_session("Usage Session", [str(transcript)])
+
+    models = settings.GEMINI_ANALYSIS_MODELS
+    gemini = SimpleNamespace(files=FakeFiles(), models=FlakyModels(down={models[0]}))
+    model_health.model_health.reset()
+    with patch.object(generators, "client", gemini), patch.object(model_health, "client", gemini), \
+         patch.object(settings, "GEMINI_RETRY_POLICY", {"unavailable": {"retries": 0, "delay": 0}}):
+        asyncio.run(generators.process_text_session_pipeline(session_id, engine))
+
+    res = client.get(f"/sessions/{session_id}/usage")
+    assert res.status_code == 200
+    view = res.json()
+    # The failed attempt on the first model is counted too, without tokens
+    assert view["totals"]["calls"] == 2 and view["totals"]["failed_calls"] == 1
+    assert (view["totals"]["input_tokens"], view["totals"]["output_tokens"], view["totals"]["thinking_tokens"], view["totals"]["total_tokens"]) == (1000, 200, 50, 1250)
+    assert [(o["operation"], o["calls"]) for o in view["by_operation"]] == [("text_analysis", 2)]
+    assert {m["model"]: m["input_tokens"] for m in view["by_model"]} == {models[0]: 0, models[1]: 1000}
+
+    with Session(engine) as db:
+        campaign_id = db.get(DBSessionEntry, session_id).campaign_id
+    campaign_view = client.get(f"/campaigns/{campaign_id}/usage").json()
+    assert [(s["session_id"], s["total_tokens"]) for s in campaign_view["by_session_id"]] == [(session_id, 1250)]
+
+    calls = client.get("/jobs/usage/calls", params={"session_id": session_id, "order_by": "input_tokens"}).json()
+    assert [(c["model"], c["status"]) for c in calls] == [(models[1], "ok"), (models[0], "unavailable")]
+    assert client.get("/jobs/usage", params={"operation": "text_analysis"}).json()["totals"]["calls"] >= 2
+    assert client.get("/sessions/999999/usage").status_code == 404
+
+
+def test_usage_is_recorded_in_the_callers_database(tmp_path):
+    own_engine = create_engine(f"sqlite:///{tmp_path / 'own.db'}")
+    SQLModel.metadata.create_all(own_engine)
+    gemini = _fake_gemini(FakeFiles())
+    model_health.model_health.reset()
+    with patch.object(model_health, "client", gemini):
+        asyncio.run(model_health.generate_with_fallback(
+            settings.GEMINI_SUMMARY_MODELS, contents=["Hello"], config=types.GenerateContentConfig(),
+            operation="probe", campaign_id=424242, db_engine=own_engine,
+        ))
+
+    with Session(own_engine) as db:
+        rows = db.exec(select(GeminiUsage)).all()
+        assert [(r.operation, r.campaign_id, r.input_tokens) for r in rows] == [("probe", 424242, 1000)]
+    with Session(engine) as db:
+        assert db.exec(select(GeminiUsage).where(GeminiUsage.operation == "probe")).all() == []
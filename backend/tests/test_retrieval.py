@@ -0,0 +1,130 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from unittest.mock import patch
+from sqlmodel import Session, select
+from backend.app.core.config import settings
+from backend.app.core.database import engine, create_db_and_tables
+from backend.app.models.models import Campaign, Persona, VectorStore
+from backend.app.services.llm import librarian
+from backend.app.services.llm.compression import compress_chunks
+from backend.app.services.llm.metrics import RequestTimer
+from backend.app.services.llm.entity_index import entity_index
+from backend.app.services.llm.vector_store import VectorService
+from backend.scripts.fake_ollama import FakeOllamaServer
+from backend.app.main import app
+from fastapi.testclient import TestClient
+
+client = TestClient(app)
+
+
+def _setup_campaign(db: Session) -> Campaign:
+    campaign = Campaign(name="Retrieval Campaign")
+    db.add(campaign)
+    db.commit()
+    db.refresh(campaign)
+    for name, aliases in [("Scanlan Shorthalt", '["Scan"]'), ("Pike Trickfoot", "[]")]:
+        db.add(Persona(name=name, role="PC", description=f"{name} of Vox Machina", aliases=aliases, campaign_id=campaign.id))
+    db.commit()
+    return campaign
+
+
+def test_named_characters_pin_and_boost_their_chunks():
+    create_db_and_tables()
+    with FakeOllamaServer() as server, patch.object(settings, "OLLAMA_HOST", server.url), Session(engine) as db:
+        campaign = _setup_campaign(db)
+        scanlan = db.exec(select(Persona).where(Persona.campaign_id == campaign.id, Persona.name == "Scanlan Shorthalt")).one()
+        service = VectorService(db)
+
+        service.save_chunk(campaign.id, "persona", scanlan.id, "Character: Scanlan Shorthalt. Role: PC. A gnome bard.")
+        for i in range(6):
+            service.save_chunk(campaign.id, "moment", 100 + i, f"Moment {i}: the tavern brawl number {i}")
+
+        # Build the index, then save a chunk mentioning him: the postings must pick it up
+        entity_index.get(campaign.id, db)
+        service.save_chunk(campaign.id, "quote", 200, "Quote in Session 3 by Scanlan: I'm going to sing a song")
+
+        results = service.search("What happened with Scan at the party?", campaign.id, limit=3)
+        assert [(r.source_type, r.source_id) for r in results][:2] == [("persona", scanlan.id), ("quote", 200)]
+
+        # Without a named character, plain cosine order applies
+        results = service.search("What happened in the tavern brawl?", campaign.id, limit=3)
+        assert all(r.source_type == "moment" for r in results)
+
+        # Deleted chunks leave the postings
+        quote = db.exec(select(VectorStore).where(
+            VectorStore.campaign_id == campaign.id, VectorStore.source_type == "quote", VectorStore.embedder == "ollama"
+        )).one()
+        db.delete(quote)
+        db.commit()
+        pinned, boosted = entity_index.chunk_targets(campaign.id, "Scanlan?", db)
+        assert quote.id not in boosted
+        profile_ids = db.exec(select(VectorStore.id).where(VectorStore.source_type == "persona", VectorStore.source_id == scanlan.id)).all()
+        assert pinned == set(profile_ids)
+
+        # A chunk rolled back after its flush leaves no posting for SQLite to hand its id to again
+        ghost = VectorStore(campaign_id=campaign.id, source_type="quote", source_id=201, embedding_json="[]",
+                            text_content="Quote by Scanlan: this line never happened", embedder="ollama")
+        db.add(ghost)
+        db.flush()
+        ghost_id = ghost.id
+        db.rollback()
+        assert ghost_id not in entity_index.chunk_targets(campaign.id, "Scanlan?", db)[1]
+
+
+def test_compression_drops_duplicates_and_merges_by_session():
+    chunks = [
+        VectorStore(id=1, campaign_id=1, source_type="session_summary", source_id=1, embedding_json="[]",
+                    text_content="Session Session 1 Summary: The party fought the dragon. Grog lost his axe."),
+        VectorStore(id=2, campaign_id=1, source_type="highlight", source_id=7, embedding_json="[]",
+                    text_content="Highlight in Session 1: The party fought the dragon."),
+        VectorStore(id=3, campaign_id=1, source_type="moment", source_id=8, embedding_json="[]",
+                    text_content="Moment in Session 1: Axe lost - Grog lost his axe in the dragon's lair while the party fought"),
+        VectorStore(id=4, campaign_id=1, source_type="moment", source_id=9, embedding_json="[]",
+                    text_content="Moment in Session 1: Axe lost - Grog lost his axe in the dragon's lair while the party fought!"),
+        VectorStore(id=5, campaign_id=1, source_type="quote", source_id=3, embedding_json="[]",
+                    text_content="Quote in Session 2 by Scanlan: I'm going to sing a song"),
+    ]
+    blocks, sources, stats = compress_chunks(chunks)
+
+    assert blocks == [
+        "Session 1:\n- The party fought the dragon. Grog lost his axe.\n- Axe lost - Grog lost his axe in the dragon's lair while the party fought",
+        'Session 2:\n- Scanlan: "I\'m going to sing a song"',
+    ]
+    # The highlight only repeated a sentence; the second moment is a near-duplicate
+    assert sources == ["session_summary:1", "moment:8", "quote:3"]
+    assert stats.near_duplicates == 2
+    assert stats.chars_after < stats.chars_before
+    assert stats.as_dict()["context_tokens_saved_est"] > 0
+
+
+def test_search_falls_back_to_hashing_embedder_when_ollama_is_down():
+    create_db_and_tables()
+    # Nothing listens on this port
+    with patch.object(settings, "OLLAMA_HOST", "http://127.0.0.1:9"), patch.object(settings, "EMBEDDING_FALLBACK", True), Session(engine) as db:
+        campaign = Campaign(name="Offline Campaign")
+        db.add(campaign)
+        db.commit()
+        service = VectorService(db)
+
+        service.save_chunk(campaign.id, "moment", 1, "Moment in Session 1: Grog drank the whole keg of dwarven ale")
+        service.save_chunk(campaign.id, "moment", 2, "Moment in Session 2: Keyleth opened a portal to the elemental plane of air")
+        assert service.load_chunks(campaign.id, "ollama") == []
+        assert len(service.load_chunks(campaign.id, "hashing")) == 2
+
+        results = service.search("Who drank the ale?", campaign.id, limit=1)
+        assert results[0].source_id == 1
+        # Fallback scores aren't on the scale of the campaign's embedder: no fast-model bar is set
+        timer = RequestTimer()
+        assert librarian._search(campaign.id, "Who drank the ale?", timer)[0].source_id == 1
+        assert timer.values["embedding_fallback"] == 1 and "retrieval_min_score" not in timer.values
+
+        # A campaign can also use the hashing embedder outright
+        res = client.put(f"/api/chat/embedder/{campaign.id}", json={"embedder": "hashing"})
+        assert res.status_code == 200
+        db.refresh(campaign)
+        service.save_chunk(campaign.id, "moment", 2, "Moment in Session 2: Keyleth opened a portal to the elemental plane of air")
+        assert service.index_embedders(campaign.id) == ["hashing"]
+        assert service.search("portal to the air plane", campaign.id, limit=1)[0].source_id == 2
+        assert client.put(f"/api/chat/embedder/{campaign.id}", json={"embedder": "nope"}).status_code == 400
@@ -0,0 +1,50 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import pytest
+from backend.app.services.llm.scheduler import GenerationScheduler, QueueFullError, QueueTimeoutError
+
+
+def test_slots_are_granted_round_robin_across_campaigns():
+    async def scenario():
+        scheduler = GenerationScheduler(slots=1, max_queue=10, queue_timeout=5)
+        running = scheduler.enqueue(1)
+        assert running.granted.done()
+
+        # Campaign 1 floods the queue, campaign 2 asks once
+        a1, a2, a3 = (scheduler.enqueue(1) for _ in range(3))
+        b1 = scheduler.enqueue(2)
+        assert [t.position for t in (a1, b1, a2, a3)] == [1, 2, 3, 4]
+
+        order = []
+        for _ in range(4):
+            scheduler.release(running)
+            running = next(t for t in (a1, a2, a3, b1) if t.granted.done() and t not in order)
+            order.append(running)
+        assert order == [a1, b1, a2, a3]
+        assert scheduler.stats()["active"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_queue_full_and_timeout():
+    async def scenario():
+        scheduler = GenerationScheduler(slots=1, max_queue=1, queue_timeout=0.05)
+        held = scheduler.enqueue(1)
+        waiting = scheduler.enqueue(2)
+        with pytest.raises(QueueFullError):
+            scheduler.enqueue(3)
+
+        positions = []
+        with pytest.raises(QueueTimeoutError):
+            async for position in scheduler.wait(waiting):
+                positions.append(position)
+        assert positions == [1]
+        assert scheduler.queued == 0
+
+        scheduler.release(held)
+        assert scheduler.stats()["active"] == 0
+
+    asyncio.run(scenario())
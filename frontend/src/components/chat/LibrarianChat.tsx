@@ -13,6 +13,7 @@ interface LibrarianChatProps {
 export default function LibrarianChat({ campaignId }: LibrarianChatProps) {
   const [isOpen, setIsOpen] = useState(false);
   const [messages, setMessages] = useState<ChatMessage[]>([]);
+  const [conversationId, setConversationId] = useState<number | null>(null);
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
@@ -62,9 +63,11 @@ export default function LibrarianChat({ campaignId }: LibrarianChatProps) {
       const response = await fetch('/api/chat/librarian', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
+        // History lives on the server; only the new message is sent
         body: JSON.stringify({
-          messages: [...messages, userMessage].map(m => ({ role: m.role, content: m.content })),
-          campaign_id: campaignId
+          messages: [{ role: userMessage.role, content: userMessage.content }],
+          campaign_id: campaignId,
+          conversation_id: conversationId
         })
       });
 
@@ -73,6 +76,7 @@ export default function LibrarianChat({ campaignId }: LibrarianChatProps) {
       }
 
       const data = await response.json();
+      setConversationId(data.conversation_id);
       const assistantMessage: ChatMessage = { role: 'assistant', content: data.response };
       setMessages(prev => [...prev, assistantMessage]);
     } catch (err) {
@@ -81,7 +85,7 @@ export default function LibrarianChat({ campaignId }: LibrarianChatProps) {
     } finally {
       setIsLoading(false);
     }
-  }, [input, messages, campaignId, isLoading]);
+  }, [input, conversationId, campaignId, isLoading]);
 
   const handleKeyDown = (e: React.KeyboardEvent) => {
     if (e.key === 'Enter' && !e.shiftKey) {
@@ -92,6 +96,7 @@ export default function LibrarianChat({ campaignId }: LibrarianChatProps) {
 
   const clearChat = () => {
     setMessages([]);
+    setConversationId(null);
     setError(null);
   };
 